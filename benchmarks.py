@@ -0,0 +1,2014 @@
+# benchmarks.py
+# micro-benchmarks and parity checks for the optimized functions, comparing them with the legacy implementations
+import io
+import os
+import time
+import contextlib
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from fossil_classification import *
+
+
+# Auxiliary functions
+def time_call(func, *args, repeat=3, **kwargs):
+    """time a function call, keeping the best of several runs
+
+    :param func: function to time
+    :param args: positional arguments for func
+    :param repeat: number of runs
+    :param kwargs: keyword arguments for func
+    :return: best run time in seconds, result of the last run
+    """
+    best = None
+    res = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        res = func(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, res
+
+
+def peak_memory_call(func, *args, **kwargs):
+    """measure the peak memory allocated by a function call (tracemalloc, includes numpy buffers)
+
+    :param func: function to measure
+    :param args: positional arguments for func
+    :param kwargs: keyword arguments for func
+    :return: peak memory in MB, result
+    """
+    import tracemalloc
+    tracemalloc.start()
+    res = func(*args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 2 ** 20, res
+
+
+def print_benchmark(name, n_rows, legacy_time, new_time):
+    """print a benchmark result line
+
+    :param name: benchmark name
+    :param n_rows: number of rows processed
+    :param legacy_time: legacy implementation run time in seconds
+    :param new_time: new implementation run time in seconds
+    :return: None
+    """
+    print("{}: {:,} rows | legacy {:.2f}s ({:,.0f} rows/s) | new {:.2f}s ({:,.0f} rows/s) | x{:.1f}".format(
+        name, n_rows,
+        legacy_time, n_rows / legacy_time,
+        new_time, n_rows / new_time,
+        legacy_time / new_time
+    ))
+
+
+def benchmark_result(name, n_rows, legacy_time, new_time, parity):
+    """build a benchmark result dict
+
+    :param name: benchmark name
+    :param n_rows: number of rows processed
+    :param legacy_time: legacy implementation run time in seconds
+    :param new_time: new implementation run time in seconds
+    :param parity: True if the legacy and new outputs are identical
+    :return: benchmark result dict
+    """
+    return {
+        'benchmark': name,
+        'rows': n_rows,
+        'legacy_sec': legacy_time,
+        'new_sec': new_time,
+        'speedup': legacy_time / new_time,
+        'parity': parity
+    }
+
+
+# Legacy implementations
+def legacy_pre_process_reports(reports_fn_list):
+    # reports_etl.pre_process_reports before the single pass: every report is read twice
+    import reports_etl
+    sheet_names = {}
+    for fn in reports_fn_list:
+        report = pd.read_excel(fn, sheet_name=None, header=None)
+        for k in report.keys():
+            k = reports_etl.fix_sheet_name(k)
+            sheet_names[k] = sheet_names.get(k, 0) + 1
+    column_names = {}
+    for fn in reports_fn_list:
+        report = pd.read_excel(fn, sheet_name=None, header=None)
+        for sheet_name in reports_etl.ignore_sheets(report):
+            fixed_sheet_name = reports_etl.fix_sheet_name(sheet_name)
+            if fixed_sheet_name not in column_names:
+                column_names[fixed_sheet_name] = {}
+            sheet = reports_etl.clean_sheet(report[sheet_name])
+            if not sheet.empty:
+                for c in sheet.columns:
+                    c = reports_etl.fix_col_name(c)
+                    column_names[fixed_sheet_name][c] = column_names[fixed_sheet_name].get(c, 0) + 1
+    cols_matrix = pd.DataFrame(column_names)
+    return cols_matrix[cols_matrix.index.notnull()]
+
+
+def legacy_process_summary_sheets(reports_fn_list):
+    # reports_etl.process_summary_sheets before the single pass: the summary sheet is read once more
+    import reports_etl
+    all_summary_sheets_list = []
+    for fn in reports_fn_list:
+        sheet = pd.read_excel(fn, sheet_name="סכום נכסים", header=None)
+        asset_alloc = reports_etl.get_asset_allocation_from_summary_sheet(sheet)
+        if not asset_alloc.empty:
+            asset_alloc["report_id"] = Path(fn).stem
+            all_summary_sheets_list.append(asset_alloc)
+    return reports_etl.concat_summary_sheets(all_summary_sheets_list)
+
+
+def legacy_extract_holdings(reports_fn_list):
+    # reports_etl.extract_holdings before the single pass: every report is read once more
+    import reports_etl
+    all_holdings_list = []
+    for fn in reports_fn_list:
+        report = pd.read_excel(fn, sheet_name=None, header=None)
+        report_id = Path(fn).stem
+        for sheet_name in reports_etl.ignore_sheets(report):
+            sheet = reports_etl.clean_sheet(report[sheet_name])
+            if not sheet.empty:
+                sheet["report_id"] = report_id
+                sheet["holding_type"] = reports_etl.fix_sheet_name(sheet_name)
+                all_holdings_list.append(sheet)
+    all_holdings = pd.concat(all_holdings_list, axis=0, ignore_index=True)
+    all_holdings["report_id"] = all_holdings["report_id"].astype(str)
+    return all_holdings
+
+
+def legacy_download_reports(files_df, to_dir, sleep=6):
+    """download_reports before it was concurrent, rate limited and resumable"""
+    import urllib.error
+    import urllib.request as ur
+    files_len = len(files_df)
+    file_num = 1
+    for index, row in files_df.iterrows():
+        print("Downloading file {} out of {}".format(file_num, files_len), end="\r")
+        try:
+            url = row["url"]
+            filename = to_dir + row["filename"]
+            ur.urlretrieve(url, filename)
+            time.sleep(sleep)
+        except urllib.error.HTTPError as err:
+            print("HTTP error {} when trying to download report {}".format(err.code, filename))
+            continue
+        finally:
+            file_num += 1
+
+
+def legacy_id_col_clean(col):
+    new_col = pd.Series(col.astype(str).str.strip().str.upper())
+# remove '0' and other non valid values
+    new_col = new_col.apply(
+        lambda x: None if (x == '0') | (x == 'NAN') | (x == 'NONE') | (x == '') else x
+    )
+    return new_col
+
+
+def legacy_find_id_col(df, id_type):
+    pattern = id_col_patterns(id_type)
+    max_cnt = 0
+    id_col = None
+    for col in df:
+        # disregard ParentCorpId column
+        if col not in ["ParentCorpLegalId"] and (col.find("parent_corp") == -1):
+            cnt = sum(df[col].astype(str).str.strip().str.contains(pattern, na=False))
+            if cnt > max_cnt:
+                id_col = col
+                max_cnt = cnt
+    return id_col, max_cnt
+
+
+def legacy_find_id_cols(df):
+    return {id_type: legacy_find_id_col(df, id_type) for id_type in id_col_types()}
+
+
+def legacy_find_il_corp_num_col(df):
+    pattern = r"^5([0-9]){8}$"
+    max_pattern_cnt = 0
+    for col in df:
+        # ignoring parent_corp_legal_id
+        if (col.find("parent_corp") == -1):
+            pattern_cnt = sum(df[col].astype(str).str.strip().str.contains(pattern, na=False))
+            if pattern_cnt > max_pattern_cnt:
+                max_col = col
+                max_pattern_cnt = pattern_cnt
+    return max_col if max_pattern_cnt > 0 else 'מספר מנפיק'
+
+
+def legacy_add_id_by_another_id_mapping(df, add_id_type, by_id_type, mapping):
+    mapping = prepare_mapping(mapping, by_id_type, add_id_type)
+    df[by_id_type] = id_col_clean(df[by_id_type])
+    df_with_added_id_type = pd.merge(
+        left=df,
+        right=mapping,
+        left_on=by_id_type,
+        right_index=True,
+        how='left',
+        suffixes=['', '_new']
+    )
+    new_col = add_id_type + '_new'
+    if new_col in df_with_added_id_type.columns:
+        df_with_added_id_type[add_id_type] = df_with_added_id_type[add_id_type].fillna(
+            df_with_added_id_type[new_col]
+        )
+        df_with_added_id_type.drop([new_col], axis=1, inplace=True)
+    return df_with_added_id_type
+
+
+def legacy_add_all_id_types_to_holdings(holdings, tlv_s2i, isin2lei):
+    holdings = fix_id_cols(holdings)
+    holdings = legacy_add_id_by_another_id_mapping(holdings, "ISIN", 'מספר ני"ע', tlv_s2i)
+    if 'מספר תאגיד' in tlv_s2i.columns:
+        holdings = legacy_add_id_by_another_id_mapping(holdings, "מספר מנפיק", "מספר תאגיד", tlv_s2i)
+    holdings = legacy_add_id_by_another_id_mapping(holdings, "מספר מנפיק", 'מספר ני"ע', tlv_s2i)
+    holdings = legacy_add_id_by_another_id_mapping(holdings, "מספר מנפיק", 'ISIN', tlv_s2i)
+    holdings = legacy_add_id_by_another_id_mapping(holdings, "LEI", 'ISIN', isin2lei)
+    return holdings
+
+
+def legacy_clean_instrument_from_ticker(df, instrument_col, ticker_col):
+    instruments = df.copy()
+    instruments["instrument_word_list"] = instruments[instrument_col].str.split()
+    instruments["ticker_first"] = instruments[ticker_col].str.split().str.get(0)
+    instruments["ticker_in_name"] = instruments.apply(
+        lambda row: row["instrument_word_list"][1:].index(row["ticker_first"]) + 1
+        if row["ticker_first"] in row["instrument_word_list"][1:]
+        else np.nan,
+        axis=1)
+    instruments["company_name_cut_ticker"] = instruments.apply(
+        lambda row: ' '.join(row["instrument_word_list"][:int(row["ticker_in_name"])]) if row["ticker_in_name"] > 1
+        else row[instrument_col],
+        axis=1)
+    return instruments.drop(["instrument_word_list", "ticker_first", "ticker_in_name"], axis=1)
+
+
+def legacy_match_holdings_with_prev(holdings, prev, holdings_il_sec_num_col):
+    for id_type, holdings_col, new_col in [
+        ('מספר ני"ע', holdings_il_sec_num_col, "is_fossil_prev_il_sec_num"),
+        ('ISIN', "ISIN", "is_fossil_prev_ISIN"),
+        ("מספר מנפיק", "מספר מנפיק", "is_fossil_prev_issuer"),
+        ("LEI", "LEI", "is_fossil_prev_LEI"),
+        ("מספר תאגיד", "מספר תאגיד", "is_fossil_prev_il_corp_num"),
+    ]:
+        prev_by_id = prev.groupby(id_type).first()
+        holdings = pd.merge(left=holdings,
+                            right=prev_by_id['is_fossil'],
+                            left_on=holdings_col,
+                            right_index=True,
+                            how='left'
+                            )
+        holdings.rename({"is_fossil": new_col}, axis=1, inplace=True)
+    return holdings
+
+
+def legacy_update_prev_class(new_classifications, prev_class_path):
+    # update_prev_class, with the new classifications given as a DataFrame
+    prev_class = pd.read_csv(prev_class_path, dtype=str)
+    prev_class_new = pd.concat([prev_class, new_classifications]).sort_values("classification_date", ascending=False)
+    new_filename = os.path.join(os.path.dirname(prev_class_path), "prev_class backup",
+                                "prev_class {}.csv".format(time.time_ns()))
+    os.makedirs(os.path.dirname(new_filename), exist_ok=True)
+    os.rename(prev_class_path, new_filename)
+    prev_class_new.to_csv(prev_class_path, index=False)
+
+
+def legacy_propagate_is_fossil(df, propagate_by_col):
+    df = df.reset_index(drop=True)
+    propagate_by_col_cond = (
+            (df[propagate_by_col].notnull()) &
+            (~df["holding_type"].isin(ignore_id_types_holding_type()[propagate_by_col]))
+    )
+    prop_col_not_null = df[propagate_by_col_cond]
+    prop_col_null = df[~propagate_by_col_cond]
+    grouped_by_prop_col = prop_col_not_null.sort_values(propagate_by_col).groupby(propagate_by_col)
+    prop_col_not_null['is_fossil'] = grouped_by_prop_col['is_fossil'].transform(
+        lambda x: x.fillna(x.mean()) if x.mean() in [0, 1] else x)
+    return pd.concat([prop_col_not_null, prop_col_null])
+
+
+def legacy_find_is_fossil_conflicts_by_id_type(df, id_type):
+    df = df[~df["holding_type"].isin(ignore_id_types_holding_type()[id_type])]
+    grouped_by_id_type = df.sort_values(id_type).groupby(id_type, dropna=True)
+    fossil_ambiguous = grouped_by_id_type.filter(lambda x: 0 < x["is_fossil"].mean() < 1).reset_index()
+    if len(fossil_ambiguous) > 0:
+        fossil_ambiguous["group type"] = id_type
+        fossil_ambiguous["group"] = fossil_ambiguous[id_type]
+        fossil_ambiguous["clean name"] = fossil_ambiguous["שם המנפיק/שם נייר ערך"].apply(clean_company)
+        fossil_ambiguous = fossil_ambiguous[
+            ["group type", "group", "clean name", "is_fossil"]
+        ].drop_duplicates()
+    else:
+        fossil_ambiguous = pd.DataFrame()
+    return fossil_ambiguous
+
+
+def legacy_consolidate_is_fossil(df):
+    is_fossil_cols = [c for c in df.columns if c.startswith("is_fossil")]
+    is_fossil_il_cols = [c for c in df.columns if c.startswith("is_fossil_il")]
+    df["is_fossil"] = df[is_fossil_il_cols].astype('float').max(axis=1)
+    df["is_fossil"] = df["is_fossil"].fillna(df[is_fossil_cols].astype('float').max(axis=1))
+    return df
+
+
+def legacy_add_is_fossil_conflict(df):
+    is_fossil_cols = [c for c in df.columns if c.startswith("is_fossil")]
+    df["is_fossil_conflict"] = df[is_fossil_cols].mean(axis=1).between(0, 1, inclusive=False)
+    return df
+
+
+def legacy_find_isin_col(df):
+    isin_pattern = r"^[A-Z]{2}([A-Z0-9]){9}[0-9]$"
+    max_isin_cnt = 0
+    for col in df:
+        isin_cnt = sum(df[col].astype(str).str.strip().str.contains(isin_pattern, na=False))
+        if isin_cnt > max_isin_cnt:
+            isin_col = col
+            max_isin_cnt = isin_cnt
+    return isin_col if max_isin_cnt > 0 else None
+
+
+def legacy_prepare_holdings(holdings_path):
+    holdings = pd.read_csv(holdings_path, dtype=str)
+    holdings.columns = holdings.columns.str.strip()
+    isin_col = legacy_find_isin_col(holdings)
+    holdings[isin_col] = legacy_id_col_clean(holdings[isin_col])
+    il_corp_col = legacy_find_il_corp_num_col(holdings)
+    if il_corp_col:
+        holdings[il_corp_col] = legacy_id_col_clean(holdings[il_corp_col])
+    return holdings, isin_col, il_corp_col
+
+
+def legacy_classify_holdings(holdings_path, sources, output_path):
+    # classify_holdings before the rewrite (without FFF matching), with the reference data sources given as fetched
+    holdings, holdings_il_sec_num_col, holdings_il_corp_col = legacy_prepare_holdings(holdings_path)
+    tlv_s2i = prepare_tlv_sec_num_to_issuer(sources["tlv_s2i"].copy())
+    isin2lei = sources["isin2lei"]
+    holdings_enriched = legacy_add_all_id_types_to_holdings(holdings, tlv_s2i, isin2lei)
+    prev_class = prepare_prev_class(sources["prev_class"].copy())
+    prev_class = legacy_add_all_id_types_to_holdings(prev_class, tlv_s2i, isin2lei)
+    holdings_with_prev = legacy_match_holdings_with_prev(holdings_enriched, prev_class, holdings_il_sec_num_col)
+    holdings_with_tlv = match_holdings_with_tlv(holdings_with_prev, prepare_tlv(sources["tlv"].copy()))
+    holdings_final = legacy_consolidate_is_fossil(holdings_with_tlv)
+    for propagate_by_col in [holdings_il_sec_num_col, "ISIN", "LEI"]:
+        holdings_final = legacy_propagate_is_fossil(holdings_final, propagate_by_col)
+    holdings_final = legacy_add_is_fossil_conflict(holdings_final)
+    output(holdings_final, output_path)
+
+
+# Sample data
+def write_sample_reports(reports_path, n_reports, n_rows=200, seed=0):
+    """write CMA like holdings reports (xlsx): a summary sheet with the asset allocation, holdings sheets with
+    title rows, column name variations, boolean cells and total lines, and an ignored sheet in some reports
+
+    :param reports_path: directory for the reports
+    :param n_reports: number of reports
+    :param n_rows: number of holdings rows per holdings sheet
+    :param seed: random seed
+    :return: list of report filenames
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(reports_path, exist_ok=True)
+    assets = ['מזומנים ושווי מזומנים', 'ניירות ערך סחירים', 'מניות', 'אג"ח קונצרני', 'קרנות סל', 'הלוואות']
+    sheets = {
+        'מניות': ['שם נ"ע', 'מספר נ"ע', 'מספר מנפיק', 'זירת מסחר', 'סוג מטבע', 'ערך נקוב', 'שער', 'שווי שוק',
+                  'שעור מנכסי אפיק ההשקעה'],
+        'אגח קונצרני': ['שם המנפיק / שם נייר ערך', 'מספר הנייר', 'מספר מנפיק', 'דירוג', 'שם המדרג', 'סוג מטבע',
+                        'צמוד', 'שיעור ריבית', 'תשואה לפדיון', 'ערך נקוב', 'שווי הוגן'],
+        'תעודות סל': ['שם נ"ע', 'מספר נ"ע', 'ISIN', 'סוג מטבע', 'ערך נקוב', 'שווי שוק']
+    }
+    fns = []
+    for i in range(n_reports):
+        fn = os.path.join(reports_path, "{}.xlsx".format(1000000 + i))
+        with pd.ExcelWriter(fn) as writer:
+            sums = rng.integers(1000, 10 ** 7, len(assets)).astype(float)
+            summary = [["סכום נכסים הקרן", None, None, None], [None, None, None, None]]
+            summary += [[None, a, s, "{:.2f}%".format(100 * s / sums.sum())] for a, s in zip(assets, sums)]
+            summary += [[None, "סך הכל נכסים", sums.sum(), "100%"], [None, None, None, None],
+                        ["* נתונים בלתי מבוקרים", None, None, None]]
+            pd.DataFrame(summary).to_excel(writer, sheet_name="סכום נכסים", header=False, index=False)
+            for sheet_name, cols in sheets.items():
+                n = int(rng.integers(n_rows // 2, n_rows + 1))
+                data = pd.DataFrame({c: rng.choice(["A", "B", "C"], n) for c in cols})
+                data[cols[0]] = ["חברה {} בע\"מ".format(k) for k in rng.integers(0, 500, n)]
+                data[cols[1]] = rng.integers(100000, 999999, n)
+                if 'צמוד' in cols:
+                    # boolean cells, with some text
+                    data['צמוד'] = [[True, False, "לא ידוע"][k] for k in rng.integers(0, 3, n)]
+                for c in cols[-3:]:
+                    data[c] = np.round(rng.random(n) * 1000, 2)
+                rows = [["שם הקרן: קרן {}".format(i)] + [None] * (len(cols) - 1), [None] * len(cols), cols]
+                rows += data.values.tolist()
+                rows += [['סה"כ {}'.format(sheet_name)] + [None] * (len(cols) - 2) + [data[cols[-1]].sum()]]
+                pd.DataFrame(rows).to_excel(writer, sheet_name=sheet_name, header=False, index=False)
+            if i % 10 == 0:
+                pd.DataFrame([["יתרה"], [1.0]]).to_excel(writer, sheet_name="יתרת התחייבות להשקעה", header=False,
+                                                         index=False)
+        fns.append(fn)
+    return fns
+
+
+def serve_sample_files(files, latency=0.0, n_failures=None, no_head=()):
+    """a local HTTP stand-in for the reports site, serving files from memory
+
+    :param files: dict of path (e.g. "/a.xlsx") to content bytes, paths not in files are 404
+    :param latency: seconds to wait before each GET response
+    :param n_failures: dict of path to the number of first GET requests answered with 503
+    :param no_head: paths HEAD requests are answered with 405 (size unknown)
+    :return: 2 objects: started ThreadingHTTPServer, dict of (method, path) to number of requests
+    """
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    n_failures = dict(n_failures or {})
+    requests_made = {}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def respond(self, method):
+            with lock:
+                requests_made[(method, self.path)] = requests_made.get((method, self.path), 0) + 1
+                fail = method == "GET" and requests_made[(method, self.path)] <= n_failures.get(self.path, 0)
+            if method == "HEAD" and self.path in no_head:
+                fail = True
+            if self.path not in files or fail:
+                self.send_response(404 if self.path not in files else 503 if method == "GET" else 405)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if method == "GET":
+                time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(files[self.path])))
+            self.end_headers()
+            if method == "GET":
+                self.wfile.write(files[self.path])
+
+        def do_GET(self):
+            self.respond("GET")
+
+        def do_HEAD(self):
+            self.respond("HEAD")
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, requests_made
+
+
+def sample_public_reports(from_year, to_year, systems, n_per_quarter=100, seed=0):
+    """a sample public reports catalogue, like the GetPublicReports response rows
+
+    :param from_year: first year
+    :param to_year: last year
+    :param systems: system codes
+    :param n_per_quarter: number of reports per quarter and system
+    :param seed: random seed
+    :return: list of report dicts, ordered by period
+    """
+    rng = np.random.default_rng(seed)
+    reports = []
+    for year in range(from_year, to_year + 1):
+        for q in range(1, 5):
+            for system in systems:
+                for i in range(n_per_quarter):
+                    reports.append({
+                        "DocumentId": int(rng.integers(10 ** 8)),
+                        "ParentCorpName": "corp {}".format(int(rng.integers(50))),
+                        "SystemField": system,
+                        "Year": year,
+                        "Quarter": q,
+                        "ReportPeriodDesc": "{} Q{}".format(year, q)
+                    })
+    return reports
+
+
+def serve_public_reports_query(reports, latency=0.0, per_report_latency=0.0):
+    """a local HTTP stand-in for the public reports query API, filtering reports by the query's
+    year/quarter range and system
+
+    :param reports: reports catalogue, see sample_public_reports
+    :param latency: seconds to wait before each response
+    :param per_report_latency: seconds to wait per report in the response
+    :return: 2 objects: started ThreadingHTTPServer, list of the queries posted
+    """
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    queries = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            queries.append(query)
+            first = int(query["fromYear"]) * 4 + int(query["fromQuarter"])
+            last = int(query["toYear"]) * 4 + int(query["toQuarter"])
+            res = [r for r in reports if r["SystemField"] == query["systemField"] and
+                   first <= r["Year"] * 4 + r["Quarter"] <= last]
+            time.sleep(latency + per_report_latency * len(res))
+            body = json.dumps(res).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, queries
+
+
+def sample_all_holdings(n_rows, quarters, systems=("גמל", "פנסיה", "ביטוח"), seed=0):
+    """generate all_holdings rows: report and partition columns, ids as text (some with leading zeros,
+    some missing), values with a few non numeric entries and extra text columns
+
+    :param n_rows: number of rows
+    :param quarters: ReportPeriodDesc values
+    :param systems: SystemName values
+    :param seed: random seed
+    :return: holdings DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    sec = rng.integers(0, 10_000, n_rows)
+    holdings = pd.DataFrame({
+        "שם המנפיק/שם נייר ערך": rng.choice(['טבע', 'APPLE INC', 'בזק'], n_rows),
+        'מספר ני"ע': np.where(rng.random(n_rows) < 0.8, (100000 + sec).astype(str), 'US0378331005'),
+        "מספר מנפיק": rng.choice(['629', '', None, '993'], n_rows),
+        "ISIN": np.where(rng.random(n_rows) < 0.3, ['IL{:010d}'.format(100000 + s) for s in sec], None),
+        "מספר תאגיד": rng.choice(['500000001', '500000002', None], n_rows),
+        "LEI": np.where(rng.random(n_rows) < 0.5, ['5493{:016d}'.format(s) for s in sec], None),
+        "holding_type": rng.choice(["מניות", "אג\"ח קונצרני", "הלוואות", "קרנות סל"], n_rows),
+        "is_fossil": rng.choice([0.0, 1.0, np.nan], n_rows, p=[0.3, 0.05, 0.65])
+    })
+    holdings["ReportPeriodDesc"] = rng.choice(list(quarters), n_rows)
+    holdings["SystemName"] = rng.choice(list(systems), n_rows)
+    report_ids = rng.integers(0, 200, n_rows)
+    holdings["report_id"] = ["{:03d}_{}".format(i, s) for i, s in zip(report_ids, holdings["SystemName"])]
+    holdings["ParentCorpLegalId"] = ["5200{:05d}".format(i % 20) for i in report_ids]
+    holdings["ParentCorpName"] = ["corp {}".format(i % 20) for i in report_ids]
+    holdings['מספר ני"ע'] = np.where(rng.random(n_rows) < 0.1, "0" + holdings['מספר ני"ע'].astype(str),
+                                     holdings['מספר ני"ע'])
+    holdings["שווי"] = np.where(rng.random(n_rows) < 0.001, "-", rng.gamma(1, 10_000, n_rows).round(2).astype(str))
+    holdings["שווי פוסילי"] = pd.to_numeric(holdings["שווי"], errors="coerce") * holdings["is_fossil"]
+    holdings["ערך נקוב"] = rng.integers(0, 10 ** 6, n_rows).astype(float)
+    holdings["זירת מסחר"] = rng.choice(["TASE", "NYSE", "NASDAQ", None], n_rows)
+    holdings["תאריך רכישה"] = rng.choice(["01/01/2020", "15/06/2021", None], n_rows)
+    return holdings
+
+
+def sample_id_col(n_rows, seed=0):
+    """generate an id column resembling the holdings / mapping id columns:
+    ISINs, security numbers, invalid values ('0', 'nan', 'None', '') and padded / lower-case values
+
+    :param n_rows: number of rows
+    :param seed: random seed
+    :return: Series of ids
+    """
+    rng = np.random.default_rng(seed)
+    pool = np.array(
+        ['IL00{:08d}'.format(i) for i in range(5000)] +
+        ['us{:010d} '.format(i) for i in range(5000)] +
+        [str(1000000 + i) for i in range(5000)] +
+        ['0', 'nan', 'None', '', ' ', None, np.nan] * 500,
+        dtype=object
+    )
+    return pd.Series(pool[rng.integers(0, len(pool), n_rows)])
+
+
+def sample_holdings(n_rows, seed=0):
+    """generate holdings with the columns used by is_il_holding: Hebrew / English security names,
+    numeric / ISIN / other security numbers and ISINs
+
+    :param n_rows: number of rows
+    :param seed: random seed
+    :return: holdings DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    names = np.array(['טבע תעשיות', 'APPLE INC', 'אלביט מערכות', 'EXXON MOBIL', 'בזק', 'iShares MSCI',
+                      ' ', None, np.nan, '12345'], dtype=object)
+    sec_nums = np.array(['1081124', ' 629014 ', 'IL0010811243', 'US0378331005', 'us30231g1022', '1.5E3',
+                         '-0.5', 'nan', 'inf', '1_000', 'ABC', '', None, np.nan, 12345, 1.5], dtype=object)
+    isins = np.array(['IL0006290147', 'il0010811243', 'US0378331005', '', None, np.nan], dtype=object)
+    return pd.DataFrame({
+        "שם המנפיק/שם נייר ערך": names[rng.integers(0, len(names), n_rows)],
+        'מספר ני"ע': sec_nums[rng.integers(0, len(sec_nums), n_rows)],
+        "ISIN": isins[rng.integers(0, len(isins), n_rows)]
+    })
+
+
+def sample_wide_holdings(n_rows, n_extra_cols=20, seed=0):
+    """generate wide holdings: id columns (ISIN, corp number, LEI, issuer number) and extra non-id columns
+
+    :param n_rows: number of rows
+    :param n_extra_cols: number of extra non-id columns
+    :param seed: random seed
+    :return: holdings DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    holdings = sample_holdings(n_rows, seed)
+    holdings["מספר תאגיד"] = rng.choice(['520000118', ' 513937714', '12345', None], n_rows)
+    holdings["LEI"] = rng.choice(['549300GKFG0RYRRQ1414', '5493000IBP32UQZ0KL24', '', None], n_rows)
+    holdings["מספר מנפיק"] = rng.choice(['629', '1081', '520000118', None], n_rows)
+    holdings["ParentCorpLegalId"] = rng.choice(['520000118', '520000119'], n_rows)
+    holdings["parent_corp_num"] = '520000118'
+    for i in range(n_extra_cols):
+        holdings["col_{}".format(i)] = rng.random(n_rows).round(2)
+    return holdings
+
+
+def sample_id_mappings(n_securities, n_isin2lei=None, seed=0):
+    """generate a TLV securities mapping and an ISIN2LEI mapping, with duplicates and missing values
+
+    :param n_securities: number of securities in the TLV mapping
+    :param n_isin2lei: number of rows in the ISIN2LEI mapping, default is n_securities
+    :param seed: random seed
+    :return: tlv_s2i, isin2lei DataFrames
+    """
+    rng = np.random.default_rng(seed)
+    if n_isin2lei is None:
+        n_isin2lei = n_securities
+    sec_nums = np.array([str(100000 + i) for i in range(n_securities)], dtype=object)
+    isins = np.array(['IL{:010d}'.format(100000 + i) for i in range(n_securities)], dtype=object)
+    issuers = np.array([str(rng.integers(1, n_securities // 10 + 2)) for i in range(n_securities)], dtype=object)
+    corp_nums = np.array(['5{:08d}'.format(int(i)) for i in issuers], dtype=object)
+    issuers[rng.random(n_securities) < 0.05] = None
+    tlv_s2i = pd.DataFrame({'מספר ני"ע': sec_nums, "ISIN": isins, "מספר מנפיק": issuers, "מספר תאגיד": corp_nums})
+    # half of the ISIN2LEI rows are TLV ISINs (with duplicates), the rest are foreign ISINs
+    lei_isins = np.concatenate([
+        isins[rng.integers(0, n_securities, n_isin2lei // 2)],
+        np.array(['US{:010d}'.format(i) for i in range(n_isin2lei - n_isin2lei // 2)], dtype=object)
+    ])
+    isin2lei = pd.DataFrame({
+        "ISIN": lei_isins,
+        "LEI": ['5493{:016d}'.format(i) for i in range(n_isin2lei)]
+    })
+    return tlv_s2i, isin2lei
+
+
+def sample_holdings_for_ids(n_rows, n_securities, seed=0):
+    """generate holdings with security numbers / ISINs / issuer numbers partly in the TLV mapping
+
+    :param n_rows: number of rows
+    :param n_securities: number of securities in the TLV mapping (see sample_id_mappings)
+    :param seed: random seed
+    :return: holdings DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    sec = rng.integers(0, n_securities * 2, n_rows)
+    holdings = pd.DataFrame({
+        "שם המנפיק/שם נייר ערך": rng.choice(['טבע', 'APPLE INC', 'בזק'], n_rows),
+        'מספר ני"ע': np.where(rng.random(n_rows) < 0.8, (100000 + sec).astype(str), 'US0378331005'),
+        "מספר מנפיק": rng.choice(['629', '', None, '993'], n_rows),
+        "ISIN": np.where(rng.random(n_rows) < 0.3, ['IL{:010d}'.format(100000 + s) for s in sec], None),
+        "מספר תאגיד": rng.choice(['500000001', '500000002', None], n_rows),
+    })
+    return holdings
+
+
+def sample_prev_class(n_rows, n_securities, seed=0):
+    """generate previously classified holdings: several classifications per security over time, some without
+    is_fossil, prepared like classify_holdings does
+
+    :param n_rows: number of rows
+    :param n_securities: number of securities in the TLV mapping (see sample_id_mappings)
+    :param seed: random seed
+    :return: prev_class DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    prev_class = sample_holdings_for_ids(n_rows, n_securities, seed=seed)
+    prev_class["LEI"] = None
+    prev_class["is_fossil"] = rng.choice(['0', '1', None], n_rows, p=[0.6, 0.3, 0.1])
+    prev_class["classification_date"] = pd.Series(
+        pd.Timestamp("2019-01-01") + pd.to_timedelta(rng.integers(0, 1500, n_rows), unit='D')).astype(str)
+    return prepare_prev_class(prev_class)
+
+
+def sample_classified_holdings(n_rows, n_securities, seed=0):
+    """generate classified holdings before propagation: ids shared by several rows, is_fossil partly missing
+    and sometimes conflicting, some holding types where ids are ignored
+
+    :param n_rows: number of rows
+    :param n_securities: number of securities in the TLV mapping (see sample_id_mappings)
+    :param seed: random seed
+    :return: holdings DataFrame with is_fossil and holding_type
+    """
+    rng = np.random.default_rng(seed)
+    holdings = sample_holdings_for_ids(n_rows, n_securities, seed=seed)
+    holdings["LEI"] = np.where(rng.random(n_rows) < 0.5,
+                               ['5493{:016d}'.format(i) for i in rng.integers(0, n_securities // 4, n_rows)], None)
+    holdings["holding_type"] = rng.choice(["מניות", "אג\"ח קונצרני", "הלוואות", "קרנות סל"], n_rows)
+    holdings["is_fossil"] = rng.choice([0.0, 1.0, np.nan], n_rows, p=[0.3, 0.05, 0.65])
+    return holdings
+
+
+def sample_reference_sources(n_securities, n_isin2lei, n_prev, seed=0):
+    """generate the reference sources as fetched: TASE mapping (English columns), ISIN2LEI, TLV companies list
+    and prev_class
+
+    :param n_securities: number of securities in the TLV mapping
+    :param n_isin2lei: number of rows in the ISIN2LEI mapping
+    :param n_prev: number of rows in prev_class
+    :param seed: random seed
+    :return: dict of tlv_s2i, isin2lei, tlv, prev_class DataFrames
+    """
+    rng = np.random.default_rng(seed)
+    tlv_s2i, isin2lei = sample_id_mappings(n_securities, n_isin2lei, seed=seed)
+    tlv_s2i = tlv_s2i.rename({'מספר ני"ע': "Security Number", "מספר מנפיק": "Issuer No",
+                              "מספר תאגיד": "Corporate No"}, axis=1)
+    issuers = tlv_s2i["Issuer No"].dropna().unique()
+    tlv = pd.DataFrame({
+        "מספר מנפיק": issuers,
+        "מספר תאגיד": ['5{:08d}'.format(int(i)) for i in issuers],
+        "רשימה שחורה": rng.choice(['כן', 'לא', '?'], len(issuers), p=[0.1, 0.85, 0.05])
+    })
+    prev_class = sample_holdings_for_ids(n_prev, n_securities, seed=seed + 1)
+    prev_class["LEI"] = None
+    prev_class["is_fossil"] = rng.choice(['0', '1', None], n_prev, p=[0.6, 0.3, 0.1])
+    prev_class["classification_date"] = pd.Series(
+        pd.Timestamp("2019-01-01") + pd.to_timedelta(rng.integers(0, 1500, n_prev), unit='D')).astype(str)
+    return {"tlv_s2i": tlv_s2i, "isin2lei": isin2lei, "tlv": tlv, "prev_class": prev_class}
+
+
+def write_reference_sources(sources_path, n_securities, n_isin2lei, n_prev, n_fff=5_000, seed=0):
+    """write sample reference sources in the formats they are fetched from: TASE mapping csv (2 header lines),
+    ISIN2LEI csv, TLV companies Excel (3 header lines), prev_class csv and FFF Excel (companies on the 2nd sheet)
+
+    :param sources_path: directory for the source files
+    :param n_securities: number of securities in the TLV mapping
+    :param n_isin2lei: number of rows in the ISIN2LEI mapping
+    :param n_prev: number of rows in prev_class
+    :param n_fff: number of FFF companies
+    :param seed: random seed
+    :return: dict of {source name: path}, see reference_source_paths()
+    """
+    rng = np.random.default_rng(seed)
+    sources = sample_reference_sources(n_securities, n_isin2lei, n_prev, seed=seed)
+    os.makedirs(sources_path, exist_ok=True)
+    paths = {name: os.path.join(sources_path, os.path.basename(p)) for name, p in reference_source_paths().items()}
+    with open(paths["tlv_s2i"], "w", encoding="utf-8") as f:
+        f.write("TASE securities\n\n")
+        sources["tlv_s2i"].to_csv(f, index=False)
+    sources["isin2lei"].to_csv(paths["isin2lei"], index=False)
+    sources["prev_class"].to_csv(paths["prev_class"], index=False)
+    tlv = sources["tlv"].assign(**{"מספר מנפיק": sources["tlv"]["מספר מנפיק"].astype(int)})
+    with pd.ExcelWriter(paths["tlv"]) as writer:
+        tlv.to_excel(writer, startrow=3, index=False)
+    fff_names, _ = sample_company_names(n_fff, 0, seed=seed)
+    screens = {c: rng.choice(['Y', None], len(fff_names), p=[0.1, 0.9]) for c in
+               reference_source_required_cols()["fff"][2:]}
+    fff = pd.DataFrame(dict({
+        "Company": fff_names,
+        "Country": "US",
+        "Tickers": ["{}, {}1".format(n.split()[0][:4], n.split()[0][:3]) for n in fff_names]
+    }, **screens))
+    with pd.ExcelWriter(paths["fff"]) as writer:
+        pd.DataFrame({"about": ["Invest Your Values company screens"]}).to_excel(writer, sheet_name="about")
+        fff.to_excel(writer, sheet_name="companies", index=False)
+    return paths
+
+
+def sample_is_fossil_flags(n_rows, seed=0):
+    """generate holdings with is_fossil flags from the matchers (numeric, partly missing, sometimes conflicting),
+    FFF match scores and issuer numbers from the holdings and from the TLV mapping
+
+    :param n_rows: number of rows
+    :param seed: random seed
+    :return: holdings DataFrame
+    """
+    rng = np.random.default_rng(seed)
+
+    def flag(p_missing):
+        return rng.choice([0.0, 1.0, np.nan], n_rows, p=[(1 - p_missing) * 0.8, (1 - p_missing) * 0.2, p_missing])
+
+    return pd.DataFrame({
+        "שם המנפיק/שם נייר ערך": rng.choice(['טבע', 'APPLE INC', 'בזק'], n_rows),
+        "is_fossil_prev_il_sec_num": flag(0.7),
+        "is_fossil_prev_ISIN": flag(0.8),
+        "is_fossil_il_list_issuer": flag(0.6),
+        "fff_fossil_any": np.where(rng.random(n_rows) < 0.5, rng.integers(0, 2, n_rows).astype(float), np.nan),
+        "ticker_company_match_score": np.where(rng.random(n_rows) < 0.5, rng.integers(0, 101, n_rows), np.nan),
+        "is_fossil_company_name": flag(0.9),
+        "מספר מנפיק": rng.choice([None, '629', '1234', '52'], n_rows),
+        "מספר מנפיק_x": rng.choice([None, '', 0, np.nan, '629', '62', '123456', 1234.0], n_rows),
+    })
+
+
+def check_consolidation_parity(holdings):
+    """row-level parity of the vectorized consolidation, threshold gating and issuer choice with the legacy
+    row-wise versions
+
+    :param holdings: holdings DataFrame, see sample_is_fossil_flags()
+    :return: dict of check name: number of rows that differ
+    """
+    gated = holdings["fff_fossil_any"].where(holdings["ticker_company_match_score"] > 80)
+    legacy_gated = holdings.apply(
+        lambda row: row['fff_fossil_any'] if row['ticker_company_match_score'] > 80 else np.nan, axis='columns')
+    issuer = choose_best_issuer_num_col(holdings)
+    legacy_issuer = holdings.apply(choose_best_issuer_num, axis='columns')
+    flags = holdings.drop(["fff_fossil_any", "ticker_company_match_score", "מספר מנפיק", "מספר מנפיק_x"], axis=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        new = consolidate_is_fossil(flags.copy())
+    legacy = legacy_add_is_fossil_conflict(legacy_consolidate_is_fossil(flags.copy()))
+    return {
+        "threshold gating": int((~((gated == legacy_gated) | (gated.isnull() & legacy_gated.isnull()))).sum()),
+        "choose_best_issuer_num": int((~((issuer == legacy_issuer) | (issuer.isnull() & legacy_issuer.isnull()))).sum()),
+        "is_fossil": int((~((new["is_fossil"] == legacy["is_fossil"]) |
+                            (new["is_fossil"].isnull() & legacy["is_fossil"].isnull()))).sum()),
+        "is_fossil_conflict": int((new["is_fossil_conflict"] != legacy["is_fossil_conflict"]).sum())
+    }
+
+
+def sample_company_names(n_fff, n_holdings, seed=0):
+    """generate Fossil Free Funds like company names, and holdings company names:
+    exact copies, variations (dropped / extra words, typos) and unrelated names (some Hebrew)
+
+    :param n_fff: number of FFF company names
+    :param n_holdings: number of holdings company names
+    :param seed: random seed
+    :return: fff_names, holdings_names - lists of unique upper case names
+    """
+    rng = np.random.default_rng(seed)
+    syllables = ['PE', 'TRO', 'CHI', 'NA', 'EX', 'XON', 'MO', 'BIL', 'SHE', 'LL', 'TO', 'TAL', 'BA', 'RRI', 'CK',
+                 'GO', 'LD', 'EN', 'ERGY', 'CO', 'AL', 'SUN', 'COR', 'VA', 'LE', 'RIO', 'TIN', 'TE', 'VA', 'ZU']
+    words = ['ENERGY', 'RESOURCES', 'MINING', 'POWER', 'BANK', 'INTERNATIONAL', 'OIL', 'GAS', 'SYSTEMS',
+             'PETROLEUM', 'UTILITIES', 'TECHNOLOGIES', 'FINANCIAL', 'NATIONAL', 'AMERICAN', 'PACIFIC']
+
+    def name():
+        first = ''.join(rng.choice(syllables, rng.integers(2, 5)))
+        return ' '.join([first] + list(rng.choice(words, rng.integers(0, 3), replace=False)))
+
+    fff_names = list(dict.fromkeys(name() for i in range(n_fff)))
+    heb_names = ['טבע', 'בזק', 'אלביט מערכות', 'דלק קבוצה', 'בנק הפועלים', 'שופרסל', 'עזריאלי קבוצה']
+    holdings_names = []
+    for i in range(n_holdings):
+        kind = rng.integers(0, 4)
+        if kind == 0:
+            holdings_names.append(fff_names[rng.integers(0, len(fff_names))])
+        elif kind == 1:
+            # drop or add a word
+            w = fff_names[rng.integers(0, len(fff_names))].split()
+            holdings_names.append(' '.join(w[:-1] if len(w) > 1 else w + [rng.choice(words)]))
+        elif kind == 2:
+            # a typo in the first word
+            w = fff_names[rng.integers(0, len(fff_names))].split()
+            pos = rng.integers(0, len(w[0]))
+            w[0] = w[0][:pos] + rng.choice(list('AEIOUXZ')) + w[0][pos + 1:]
+            holdings_names.append(' '.join(w))
+        else:
+            holdings_names.append(rng.choice(heb_names) if rng.random() < 0.5 else name())
+    return fff_names, list(dict.fromkeys(holdings_names))
+
+
+def sample_ticker_holdings(n_rows, n_issuers=20_000, seed=0):
+    """generate global bond / equity holdings with Bloomberg like tickers and instrument names,
+    e.g. AKER BP ASA AKERBP 4 3/4 06/15/24 with ticker AKERBP 4 3/4 06/15/24 Corp
+
+    :param n_rows: number of rows
+    :param n_issuers: number of issuers
+    :param seed: random seed
+    :return: DataFrame with instrument and ticker columns
+    """
+    rng = np.random.default_rng(seed)
+    fff_names, _ = sample_company_names(n_issuers, 0, seed=seed)
+    issuers = pd.Series(fff_names)
+    # tickers from the first word, some with trailing digits or exchange suffixes, some Hebrew
+    tickers = issuers.str.split().str.get(0).str[:6]
+    suffixes = np.array(['', '', '5', '.OQ', '.TA', '/', ' 2%', 'טבע'])
+    tickers = tickers + suffixes[rng.integers(0, len(suffixes), len(tickers))]
+    issuer = rng.integers(0, len(issuers), n_rows)
+    coupon = pd.Series(rng.integers(1, 8, n_rows)).astype(str) + " 3/4 06/15/" + pd.Series(
+        rng.integers(22, 40, n_rows)).astype(str)
+    kind = rng.integers(0, 4, n_rows)
+    ticker = pd.Series(tickers.to_numpy()[issuer])
+    instrument = pd.Series(issuers.to_numpy()[issuer])
+    # bonds: name, ticker and coupon in the instrument name
+    is_bond = kind < 2
+    instrument[is_bond] = instrument[is_bond] + " " + ticker[is_bond] + " " + coupon[is_bond]
+    ticker[is_bond] = ticker[is_bond] + " " + coupon[is_bond] + " Corp"
+    # equities: ticker with the exchange, some without a ticker
+    ticker[kind == 2] = ticker[kind == 2] + " US Equity"
+    ticker[(kind == 3) & (rng.random(n_rows) < 0.5)] = np.nan
+    return pd.DataFrame({"instrument": instrument, "ticker": ticker})
+
+
+# Parity checks
+def check_is_il_holding_parity(holdings):
+    """compare is_il_holding_mask with the row-wise is_il_holding on a holdings DataFrame,
+    e.g. holdings extracted from real reports with reports_etl.extract_holdings
+
+    :param holdings: holdings DataFrame
+    :return: DataFrame of rows where the two implementations disagree (empty if identical)
+    """
+    row_mask = holdings.apply(is_il_holding, axis='columns').astype(bool)
+    col_mask = is_il_holding_mask(holdings)
+    diff = holdings.loc[row_mask != col_mask].copy()
+    diff["row_wise"] = row_mask[row_mask != col_mask]
+    diff["column_wise"] = col_mask[row_mask != col_mask]
+    print("is_il_holding parity: {:,} rows, {:,} mismatches".format(len(holdings), len(diff)))
+    return diff
+
+
+def measure_best_match_recall(holdings_names, fff_names, first_word_thresh=95):
+    """measure the recall of CompanyNameIndex candidate generation against the exhaustive best_match scan:
+    recall of the first word matches above first_word_thresh, and identical best_match winners and scores
+
+    :param holdings_names: holdings company names (clean)
+    :param fff_names: FFF company names (clean)
+    :param first_word_thresh: best_match first word threshold
+    :return: dict of recall stats
+    """
+    name_index = CompanyNameIndex(fff_names)
+    relevant = 0
+    retrieved = 0
+    same_winner = 0
+    candidates_cnt = 0
+    queries = 0
+    for s in holdings_names:
+        if len(s.split()) == 0:
+            continue
+        queries += 1
+        first_word = s.split()[0]
+        candidates = set(name_index.candidates(first_word))
+        candidates_cnt += len(candidates)
+        above_thresh = [m for m, score in process.extract(first_word, fff_names, scorer=fuzz.partial_ratio, limit=None)
+                        if score > first_word_thresh]
+        relevant += len(above_thresh)
+        retrieved += sum(m in candidates for m in above_thresh)
+        same_winner += best_match(s, fff_names, first_word_thresh) == best_match(s, fff_names, first_word_thresh,
+                                                                                 name_index=name_index)
+    stats = {
+        'queries': queries,
+        'fff_names': len(fff_names),
+        'avg_candidates': candidates_cnt / max(queries, 1),
+        'first_word_matches': relevant,
+        'first_word_recall': retrieved / relevant if relevant else 1.0,
+        'same_best_match': same_winner / max(queries, 1)
+    }
+    print("best_match recall: {:.2%} of first word matches above {} retrieved, {:.2%} identical winners, "
+          "{:.1f} candidates per query out of {:,}".format(
+            stats['first_word_recall'], first_word_thresh, stats['same_best_match'],
+            stats['avg_candidates'], len(fff_names)))
+    return stats
+
+
+def check_fuzzy_backend_parity(queries, choices, backend='rapidfuzz', tolerance=2):
+    """compare the scores of a fuzzy backend with fuzzywuzzy, per scorer, for the six-score aggregate and for
+    company_names_match_scores (the ticker match gating), e.g. on historical holdings company names against the
+    FFF company names. also checks the rapidfuzz partial_ratio prefilter of best_match_batched is an upper bound
+
+    :param queries: list of company names
+    :param choices: list of company names
+    :param backend: fuzzy backend to compare with fuzzywuzzy
+    :param tolerance: max absolute score difference considered as agreement
+    :return: DataFrame of parity stats per scorer
+    """
+    stats = []
+    agg_reference = 0
+    agg_backend = 0
+    for scorer in fuzzy_scorer_names():
+        reference = match_score_matrix(queries, choices, scorer, 'fuzzywuzzy')
+        scores = match_score_matrix(queries, choices, scorer, backend)
+        agg_reference = agg_reference + reference
+        agg_backend = agg_backend + scores
+        diff = np.abs(reference - scores)
+        stats.append({'scorer': scorer, 'pairs': diff.size, 'identical': (diff == 0).mean(),
+                      'within_tolerance': (diff <= tolerance).mean(), 'max_diff': diff.max()})
+    diff = np.abs(agg_reference - agg_backend) / 6
+    stats.append({'scorer': 'aggregate / 6', 'pairs': diff.size, 'identical': (diff == 0).mean(),
+                  'within_tolerance': (diff <= tolerance).mean(), 'max_diff': diff.max()})
+    pairs = pd.DataFrame([(q, c) for q in queries for c in choices], columns=['holdings_name', 'fff_name'])
+    reference = company_names_match_scores(pairs, 'holdings_name', 'fff_name').to_numpy()
+    scores = company_names_match_scores(pairs, 'holdings_name', 'fff_name', backend=backend).to_numpy()
+    scored = ~np.isnan(reference)
+    diff = np.where(scored, np.abs(reference - scores), 0)
+    stats.append({'scorer': 'company_names_match_scores', 'pairs': diff.size,
+                  'identical': ((diff == 0) & (np.isnan(scores) == ~scored)).mean(),
+                  'within_tolerance': (diff <= tolerance).mean(), 'max_diff': diff.max()})
+    if backend == 'rapidfuzz':
+        from rapidfuzz import fuzz as rf_fuzz, process as rf_process
+        first_words = [utils.full_process(str(q).split()[0]) for q in queries if len(str(q).split()) > 0]
+        processed_choices = [utils.full_process(str(c)) for c in choices]
+        upper_bound = np.rint(rf_process.cdist(first_words, processed_choices, scorer=rf_fuzz.partial_ratio))
+        reference = match_score_matrix(first_words, processed_choices, 'partial_ratio', 'fuzzywuzzy')
+        below = reference > upper_bound
+        stats.append({'scorer': 'best_match_batched prefilter', 'pairs': below.size,
+                      'identical': (upper_bound == reference).mean(), 'within_tolerance': (~below).mean(),
+                      'max_diff': (reference - upper_bound).max()})
+    stats = pd.DataFrame(stats).set_index('scorer')
+    print("fuzzy backend parity, {} vs fuzzywuzzy, tolerance {}:".format(backend, tolerance))
+    print(stats)
+    return stats
+
+
+def check_best_match_backend_parity(holdings_names, fff_names, backend='rapidfuzz', tolerance=2):
+    """compare best_match winners and scores of a fuzzy backend with fuzzywuzzy
+
+    :param holdings_names: holdings company names (clean)
+    :param fff_names: FFF company names (clean)
+    :param backend: fuzzy backend to compare with fuzzywuzzy
+    :param tolerance: max absolute score difference considered as agreement
+    :return: DataFrame of names where winners differ or scores differ by more than tolerance
+    """
+    name_index = CompanyNameIndex(fff_names)
+    rows = []
+    for s in holdings_names:
+        reference = best_match(s, fff_names, name_index=name_index)
+        result = best_match(s, fff_names, name_index=name_index, backend=backend)
+        rows.append((s, reference[0], result[0], reference[1], result[1]))
+    res = pd.DataFrame(rows, columns=['name', 'winner', 'backend_winner', 'score', 'backend_score'])
+    diff = res[(res['winner'] != res['backend_winner']) |
+               ((res['score'].astype(float) - res['backend_score'].astype(float)).abs() > tolerance)]
+    print("best_match backend parity, {} vs fuzzywuzzy: {:.2%} same winner, {:,} out of {:,} differ".format(
+        backend, (res['winner'] == res['backend_winner']).mean(), len(diff), len(res)))
+    return diff
+
+
+# Benchmarks
+def benchmark_single_pass_ingestion(n_reports=40, n_rows=300, reports_path="data/benchmarks/reports"):
+    """compare ingest_reports (each report parsed once) with pre_process_reports, process_summary_sheets and
+    extract_holdings before the single pass (each report parsed 4 times), and check the column names census,
+    the asset allocations and the holdings are the same
+
+    :param n_reports: number of reports
+    :param n_rows: number of holdings rows per holdings sheet
+    :param reports_path: directory for the generated reports
+    :return: benchmark result dict
+    """
+    import reports_etl
+    fns = write_sample_reports(reports_path, n_reports, n_rows)
+
+    def legacy():
+        return legacy_pre_process_reports(fns), legacy_process_summary_sheets(fns), legacy_extract_holdings(fns)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy_time, (legacy_cols, legacy_summary, legacy_holdings) = time_call(legacy, repeat=1)
+        new_time, (_, cols, summary, holdings, failures) = time_call(reports_etl.ingest_reports, fns, repeat=1)
+    parity = (len(failures) == 0 and
+              legacy_cols.sort_index().sort_index(axis=1).equals(cols.sort_index().sort_index(axis=1)) and
+              legacy_summary.equals(summary) and
+              legacy_holdings.equals(holdings))
+    print_benchmark("single pass report ingestion", n_reports, legacy_time, new_time)
+    return benchmark_result("single pass report ingestion", n_reports, legacy_time, new_time, parity)
+
+
+def benchmark_parallel_extraction(n_reports=64, n_rows=300, max_workers=4, reports_path="data/benchmarks/reports"):
+    """compare extract_holdings and process_summary_sheets over a pool of worker processes with the serial mode,
+    and check the holdings, the asset allocations and the failures (a corrupt report is added) are the same
+
+    :param n_reports: number of reports
+    :param n_rows: number of holdings rows per holdings sheet
+    :param max_workers: number of worker processes
+    :param reports_path: directory for the generated reports
+    :return: benchmark result dict
+    """
+    import reports_etl
+    fns = write_sample_reports(reports_path, n_reports, n_rows)
+    corrupt_fn = os.path.join(reports_path, "corrupt.xlsx")
+    with open(corrupt_fn, "wb") as f:
+        f.write(b"not a workbook")
+    # the corrupt report in the middle, failures are collected in the order of the list
+    fns.insert(len(fns) // 2, corrupt_fn)
+
+    def extract(workers):
+        holdings, holdings_failures = reports_etl.extract_holdings(fns, max_workers=workers, return_failures=True)
+        summary, summary_failures = reports_etl.process_summary_sheets(fns, max_workers=workers,
+                                                                       return_failures=True)
+        return holdings, summary, holdings_failures + summary_failures
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy_time, (legacy_holdings, legacy_summary, legacy_failures) = time_call(extract, 1, repeat=1)
+        new_time, (holdings, summary, failures) = time_call(extract, max_workers, repeat=1)
+    parity = (legacy_holdings.equals(holdings) and legacy_summary.equals(summary) and
+              legacy_failures == failures and [fn for fn, _ in failures] == [corrupt_fn] * 2)
+    print_benchmark("parallel extraction, {} workers".format(max_workers), n_reports, legacy_time, new_time)
+    return benchmark_result("parallel extraction", n_reports, legacy_time, new_time, parity)
+
+
+def benchmark_parsed_reports_cache(n_reports=40, n_rows=300, reports_path="data/benchmarks/reports",
+                                   cache_path="data/benchmarks/parsed reports cache"):
+    """compare ingest_reports with a warm parsed reports cache with parsing all reports, and check cache hits and
+    invalidation by counting the reports parsed: none when warm, only a changed report, none after changing
+    fix_col_name (the sheets are cached before the header is set), all after a REPORT_CACHE_VERSION change -
+    with the same output as parsing all reports every time
+
+    :param n_reports: number of reports
+    :param n_rows: number of holdings rows per holdings sheet
+    :param reports_path: directory for the generated reports
+    :param cache_path: parsed reports cache directory, replaced
+    :return: benchmark result dict
+    """
+    import shutil
+    import reports_etl
+    fns = write_sample_reports(reports_path, n_reports, n_rows)
+    shutil.rmtree(cache_path, ignore_errors=True)
+    read_report = reports_etl.read_report
+    parsed = []
+
+    def counting_read_report(fn):
+        parsed.append(fn)
+        return read_report(fn)
+
+    def ingest(cache_dir=None):
+        del parsed[:]
+        with contextlib.redirect_stdout(io.StringIO()):
+            res = reports_etl.ingest_reports(fns, cache_dir=cache_dir)
+        return res[:4], len(parsed)
+
+    def same(a, b):
+        return all(x == y if isinstance(x, dict) else x.equals(y) for x, y in zip(a, b))
+
+    checks = {}
+    reports_etl.read_report = counting_read_report
+    try:
+        legacy_time, (reference, _) = time_call(ingest, repeat=1)
+        _, (cold, checks["cold"]) = time_call(ingest, cache_path, repeat=1)
+        new_time, (warm, checks["warm"]) = time_call(ingest, cache_path, repeat=1)
+        checks["cold"] = checks["cold"] == n_reports and same(reference, cold)
+        checks["warm"] = checks["warm"] == 0 and same(reference, warm)
+        # a report changed on disk
+        write_sample_reports(os.path.join(reports_path, "changed"), 1, n_rows, seed=1)
+        shutil.copy(os.path.join(reports_path, "changed", os.path.basename(fns[0])), fns[0])
+        reference, _ = ingest()
+        changed, n_parsed = ingest(cache_path)
+        checks["changed report"] = n_parsed == 1 and same(reference, changed)
+        # a column name mapping tweak
+        fix_col_name = reports_etl.fix_col_name
+        reports_etl.fix_col_name = lambda c: "שווי" if c == "שווי שוק" else "שווי הוגן" if c == "שווי" else \
+            fix_col_name(c)
+        try:
+            reference, _ = ingest()
+            remapped, n_parsed = ingest(cache_path)
+            checks["fix_col_name change"] = n_parsed == 0 and same(reference, remapped)
+        finally:
+            reports_etl.fix_col_name = fix_col_name
+        # a parsing change
+        reports_etl.REPORT_CACHE_VERSION += 1
+        try:
+            _, n_parsed = ingest(cache_path)
+            checks["cache version change"] = n_parsed == n_reports
+        finally:
+            reports_etl.REPORT_CACHE_VERSION -= 1
+    finally:
+        reports_etl.read_report = read_report
+    print("parsed reports cache checks: {}".format(checks))
+    print_benchmark("parsed reports cache, warm", n_reports, legacy_time, new_time)
+    return benchmark_result("parsed reports cache", n_reports, legacy_time, new_time, all(checks.values()))
+
+
+def benchmark_download_reports(n_files=40, latency=0.1, sleep=0.02, max_workers=4,
+                               download_path="data/benchmarks/downloads"):
+    """compare the serial download_reports (a sleep after every download, no retries) with the concurrent, rate
+    limited one against a local HTTP stand-in, and check retries and resuming: flaky files (503 on the first
+    attempts) are downloaded, a 404 isn't retried, a rerun downloads nothing, files on disk with no manifest entry
+    are added to the manifest without a download only if their size is the remote size (downloaded again if it
+    differs or is unknown), and a corrupt file is downloaded again
+
+    :param n_files: number of files served
+    :param latency: seconds the server waits before each download response
+    :param sleep: seconds between downloads (rate limit)
+    :param max_workers: number of concurrent downloads
+    :param download_path: download directory, replaced
+    :return: benchmark result dict
+    """
+    import shutil
+    import reports_etl
+    rng = np.random.default_rng(0)
+    files = {"/report_{}.xlsx".format(i): rng.bytes(int(rng.integers(1_000, 50_000))) for i in range(n_files)}
+    flaky = ["/report_0.xlsx", "/report_1.xlsx"]
+    no_head = ["/report_2.xlsx"]
+    server, requests_made = serve_sample_files(files, latency, n_failures={path: 2 for path in flaky},
+                                               no_head=no_head)
+    base_url = "http://127.0.0.1:{}".format(server.server_port)
+    files_df = pd.DataFrame({"filename": [path[1:] for path in files] + ["missing.xlsx"]})
+    files_df["url"] = base_url + "/" + files_df["filename"]
+    legacy_path, new_path = os.path.join(download_path, "legacy"), os.path.join(download_path, "new")
+    for path in [legacy_path, new_path]:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+    manifest_fn = os.path.join(new_path, "download_manifest.csv")
+
+    def downloaded(path):
+        return {"/" + fn: Path(path, fn).read_bytes() for fn in os.listdir(path) if fn.endswith(".xlsx")}
+
+    def download(**kwargs):
+        requests_made.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            failures = reports_etl.download_reports(files_df, new_path, sleep=sleep, max_workers=max_workers,
+                                                    retries=3, backoff=0.01, **kwargs)
+        return [fn for fn, _ in failures], {k: v for k, v in requests_made.items() if k[1] in files}
+
+    checks = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy_time, _ = time_call(legacy_download_reports, files_df, legacy_path + "/", sleep=sleep, repeat=1)
+    checks["legacy misses flaky files"] = set(downloaded(legacy_path)) == set(files) - set(flaky)
+    new_time, (failures, made) = time_call(download, repeat=1)
+    checks["first run"] = failures == ["missing.xlsx"] and downloaded(new_path) == files and \
+        all(made[("GET", path)] == 3 for path in flaky) and requests_made[("GET", "/missing.xlsx")] == 1
+    failures, made = download()
+    checks["rerun"] = failures == ["missing.xlsx"] and len(made) == 0
+    # files on disk with no manifest entry - one of them truncated, one with an unknown remote size
+    manifest = pd.read_csv(manifest_fn)
+    unknown_size = manifest["filename"] == no_head[0][1:]
+    unrecorded = manifest.loc[~unknown_size, "filename"].iloc[:3].tolist() + [no_head[0][1:]]
+    manifest[~manifest["filename"].isin(unrecorded)].to_csv(manifest_fn, index=False)
+    with open(os.path.join(new_path, unrecorded[0]), "r+b") as f:
+        f.truncate(100)
+    failures, made = download()
+    checks["files on disk with no manifest entry"] = \
+        all(made.get(("HEAD", "/" + fn)) == 1 for fn in unrecorded) and \
+        sorted(k for k in made if k[0] == "GET") == [("GET", "/" + fn) for fn in sorted(unrecorded[::3])] and \
+        set(reports_etl.read_download_manifest(manifest_fn).index) == {path[1:] for path in files} and \
+        downloaded(new_path) == files
+    # a corrupt file recorded in the manifest
+    with open(os.path.join(new_path, unrecorded[1]), "r+b") as f:
+        f.write(b"corrupt")
+    failures, made = download()
+    checks["corrupt file"] = list(made) == [("GET", "/" + unrecorded[1])] and downloaded(new_path) == files
+    server.shutdown()
+    server.server_close()
+    print("download checks: {}".format(checks))
+    print_benchmark("download {} reports".format(n_files), n_files, legacy_time, new_time)
+    return benchmark_result("download reports", n_files, legacy_time, new_time, all(checks.values()))
+
+
+def benchmark_public_reports_query(from_year=2019, to_year=2022, systems=(1, 2), n_per_quarter=100, latency=0.05,
+                                   per_report_latency=0.001, max_workers=4,
+                                   cache_path="data/benchmarks/query cache"):
+    """compare one public reports query per system for the whole range with per quarter queries sent concurrently,
+    against a local HTTP stand-in of the reports site, and check the merged split queries equal the single ones,
+    a cached rerun posts nothing and expired cache entries are fetched again
+
+    :param from_year: first year
+    :param to_year: last year
+    :param systems: system codes
+    :param n_per_quarter: number of reports per quarter and system
+    :param latency: seconds the server waits before each response
+    :param per_report_latency: seconds the server waits per report in a response
+    :param max_workers: number of concurrent queries
+    :param cache_path: query cache directory, replaced
+    :return: benchmark result dict
+    """
+    import shutil
+    import reports_etl
+    catalogue = sample_public_reports(from_year, to_year, systems, n_per_quarter)
+    server, queries = serve_public_reports_query(catalogue, latency, per_report_latency)
+    base_url = "http://127.0.0.1:{}".format(server.server_port)
+    shutil.rmtree(cache_path, ignore_errors=True)
+
+    def query(system, **kwargs):
+        del queries[:]
+        with contextlib.redirect_stdout(io.StringIO()):
+            return reports_etl.get_report_data_into_data_frame(from_year, 1, to_year, 4, 1, system,
+                                                                base_url=base_url, max_workers=max_workers,
+                                                                **kwargs)
+
+    def legacy():
+        return pd.concat([query(s, split=False) for s in systems], ignore_index=True)
+
+    checks = {}
+    n_reports = len(catalogue)
+    legacy_time, legacy_res = time_call(legacy, repeat=1)
+    new_time, new_res = time_call(query, list(systems), repeat=1)
+    checks["split queries merge"] = new_res.sort_values("DocumentId", ignore_index=True).equals(
+        legacy_res.sort_values("DocumentId", ignore_index=True)) and len(new_res) == n_reports
+    checks["single system order"] = query(systems[0]).equals(query(systems[0], split=False))
+    query(list(systems), cache_dir=cache_path)
+    cached = query(list(systems), cache_dir=cache_path)
+    checks["cached rerun"] = len(queries) == 0 and cached.equals(new_res)
+    query(list(systems), cache_dir=cache_path, ttl=0)
+    checks["expired cache"] = len(queries) == (to_year - from_year + 1) * 4 * len(systems)
+    server.shutdown()
+    server.server_close()
+    print("public reports query checks: {}".format(checks))
+    print_benchmark("public reports query", n_reports, legacy_time, new_time)
+    return benchmark_result("public reports query", n_reports, legacy_time, new_time, all(checks.values()))
+
+
+def benchmark_holdings_dataset(n_rows=1_000_000, n_new=100_000, dataset_path="data/benchmarks/all_holdings"):
+    """compare loading holdings for analysis (2 quarters, 1 system, the analysis columns) and appending a quarter
+    from all_holdings.csv with the parquet dataset, and check the dataset round trip (same values as the CSV),
+    appending a quarter doesn't rewrite other partitions, and appending it again replaces it
+
+    :param n_rows: number of holdings rows
+    :param n_new: number of rows in the appended quarter
+    :param dataset_path: directory for the CSV files and the dataset, replaced
+    :return: benchmark result dict
+    """
+    import shutil
+    import reports_etl
+    from holdings_analysis import get_analysis_cols, load_holdings
+    quarters = ["{} רבעון {}".format(y, q) for y in range(2020, 2024) for q in range(1, 5)]
+    shutil.rmtree(dataset_path, ignore_errors=True)
+    os.makedirs(dataset_path)
+    csv_fn, new_csv_fn = os.path.join(dataset_path, "all_holdings.csv"), os.path.join(dataset_path, "new.csv")
+    parquet_path = os.path.join(dataset_path, "all_holdings")
+    sample_all_holdings(n_rows, quarters).to_csv(csv_fn, index=False)
+    sample_all_holdings(n_new, ["2024 רבעון 1"], seed=1).to_csv(new_csv_fn, index=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        reports_etl.convert_all_holdings_csv_to_dataset(csv_fn, parquet_path, chunksize=n_rows // 3)
+
+    def comparable(holdings):
+        # parquet column types (see holdings_schema) on both sides, rows in the same order
+        holdings = reports_etl.prepare_holdings_for_parquet(holdings)
+        holdings = holdings.astype({c: object for c in holdings.select_dtypes("category").columns})
+        return holdings[sorted(holdings.columns)].sort_values(sorted(holdings.columns), ignore_index=True)
+
+    def same(a, b):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return comparable(a).equals(comparable(b))
+
+    def legacy_load():
+        holdings = pd.read_csv(csv_fn, dtype=reports_etl.holdings_dtypes())
+        holdings = holdings[holdings["ReportPeriodDesc"].isin(quarters[-2:]) & (holdings["SystemName"] == "גמל")]
+        return holdings[get_analysis_cols()]
+
+    def new_load():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return load_holdings(quarters[-2:], ["גמל"], dataset_path=parquet_path)
+
+    def legacy_append():
+        reports_etl.concat_from_csv_by_path(csv_fn, new_csv_fn).to_csv(csv_fn + ".appended", index=False)
+
+    def new_append():
+        with contextlib.redirect_stdout(io.StringIO()):
+            reports_etl.append_csv_to_holdings_dataset(new_csv_fn, parquet_path)
+
+    def partition_files():
+        return {str(p): p.stat().st_mtime_ns for p in Path(parquet_path).rglob("*.parquet")}
+
+    checks = {}
+    legacy_load_time, legacy_res = time_call(legacy_load, repeat=1)
+    new_load_time, new_res = time_call(new_load, repeat=1)
+    checks["load"] = same(legacy_res, new_res)
+    checks["round trip"] = same(pd.read_csv(csv_fn, dtype=reports_etl.holdings_dtypes()),
+                                reports_etl.read_holdings_dataset(parquet_path))
+    before = partition_files()
+    legacy_append_time, _ = time_call(legacy_append, repeat=1)
+    new_append_time, _ = time_call(new_append, repeat=1)
+    after = partition_files()
+    checks["append keeps other partitions"] = all(after.get(fn) == mtime for fn, mtime in before.items()) and \
+        all("2024" in fn for fn in set(after) - set(before))
+    appended = pd.read_csv(csv_fn + ".appended", dtype=reports_etl.holdings_dtypes())
+    checks["append"] = same(appended, reports_etl.read_holdings_dataset(parquet_path))
+    new_append()
+    checks["append again replaces"] = len(reports_etl.read_holdings_dataset(parquet_path, columns=["שווי"])) == \
+        len(appended)
+    print("holdings dataset checks: {}".format(checks))
+    print_benchmark("load holdings for analysis", n_rows, legacy_load_time, new_load_time)
+    print_benchmark("append a quarter", n_new, legacy_append_time, new_append_time)
+    return benchmark_result("holdings dataset", n_rows, legacy_load_time + legacy_append_time,
+                            new_load_time + new_append_time, all(checks.values()))
+
+
+def benchmark_id_col_clean(n_rows=10_000_000, repeat=1):
+    """compare id_col_clean with the legacy per-element lambda implementation
+
+    :param n_rows: number of rows
+    :param repeat: number of runs per implementation (best is kept)
+    :return: benchmark result dict
+    """
+    col = sample_id_col(n_rows)
+    legacy_time, legacy_res = time_call(legacy_id_col_clean, col, repeat=repeat)
+    new_time, new_res = time_call(id_col_clean, col, repeat=repeat)
+    parity = legacy_res.equals(new_res)
+    print_benchmark("id_col_clean", n_rows, legacy_time, new_time)
+    return benchmark_result("id_col_clean", n_rows, legacy_time, new_time, parity)
+
+
+def benchmark_is_il_holding(n_rows=1_000_000, repeat=1):
+    """compare is_il_holding_mask with the row-wise df.apply(is_il_holding, axis='columns')
+
+    :param n_rows: number of rows
+    :param repeat: number of runs per implementation (best is kept)
+    :return: benchmark result dict
+    """
+    holdings = sample_holdings(n_rows)
+    legacy_time, legacy_res = time_call(holdings.apply, is_il_holding, axis='columns', repeat=repeat)
+    new_time, new_res = time_call(is_il_holding_mask, holdings, repeat=repeat)
+    parity = legacy_res.astype(bool).equals(new_res)
+    print_benchmark("is_il_holding", n_rows, legacy_time, new_time)
+    return benchmark_result("is_il_holding", n_rows, legacy_time, new_time, parity)
+
+
+
+def benchmark_find_id_cols(n_rows=1_000_000, n_extra_cols=20, sample_size=10_000, repeat=1):
+    """compare the single-scan detect_id_cols with the legacy scan per id type, and with sampling
+
+    :param n_rows: number of rows
+    :param n_extra_cols: number of extra non-id columns
+    :param sample_size: sample size for the sampled run
+    :param repeat: number of runs per implementation (best is kept)
+    :return: benchmark result dict
+    """
+    holdings = sample_wide_holdings(n_rows, n_extra_cols)
+    legacy_time, legacy_res = time_call(legacy_find_id_cols, holdings, repeat=repeat)
+    new_time, new_res = time_call(detect_id_cols, holdings, repeat=repeat)
+    sample_time, sample_res = time_call(detect_id_cols, holdings, sample_size=sample_size, repeat=repeat)
+    with contextlib.redirect_stdout(io.StringIO()):
+        il_corp_num_col = find_il_corp_num_col(holdings)
+    print("il corp num col: {}".format(il_corp_num_col))
+    parity = legacy_res == new_res and il_corp_num_col == legacy_find_il_corp_num_col(holdings)
+    print_benchmark("find_id_cols", n_rows, legacy_time, new_time)
+    print_benchmark("find_id_cols sample {:,}".format(sample_size), n_rows, legacy_time, sample_time)
+    print("sampled columns: {}".format({k: v[0] for k, v in sample_res.items()}))
+    return benchmark_result("find_id_cols", n_rows, legacy_time, new_time, parity)
+
+
+
+def benchmark_id_resolver(n_rows=200_000, n_securities=100_000, n_isin2lei=2_000_000, n_frames=2):
+    """compare IdResolver (indexes built once) with the legacy merges (mapping prepared per merge),
+    enriching n_frames holdings DataFrames like classify_holdings does with holdings and prev_class
+
+    :param n_rows: number of rows per holdings DataFrame
+    :param n_securities: number of securities in the TLV mapping
+    :param n_isin2lei: number of rows in the ISIN2LEI mapping
+    :param n_frames: number of holdings DataFrames to enrich
+    :return: benchmark result dict
+    """
+    tlv_s2i, isin2lei = sample_id_mappings(n_securities, n_isin2lei)
+    frames = [sample_holdings_for_ids(n_rows, n_securities, seed=i) for i in range(n_frames)]
+
+    def legacy():
+        return [legacy_add_all_id_types_to_holdings(df.copy(), tlv_s2i.copy(), isin2lei.copy()) for df in frames]
+
+    def new():
+        resolver = IdResolver(tlv_s2i, isin2lei)
+        return [resolver.enrich(df.copy()) for df in frames]
+
+    legacy_time, legacy_res = time_call(legacy, repeat=1)
+    new_time, new_res = time_call(new, repeat=1)
+    parity = all(l.equals(n) for l, n in zip(legacy_res, new_res))
+    print_benchmark("add_all_id_types_to_holdings", n_rows * n_frames, legacy_time, new_time)
+    return benchmark_result("add_all_id_types_to_holdings", n_rows * n_frames, legacy_time, new_time, parity)
+
+
+
+def benchmark_isin2lei_snapshot(n_isin2lei=2_000_000, n_lookups=200_000, snapshot_path="data/benchmarks/isin2lei_snapshot"):
+    """compare loading + preparing the ISIN2LEI csv for each run with opening its memory-mapped snapshot,
+    and the LEI lookups of both
+
+    :param n_isin2lei: number of rows in the ISIN2LEI mapping
+    :param n_lookups: number of ISINs to look up
+    :param snapshot_path: directory for the generated csv and snapshot
+    :return: benchmark result dict
+    """
+    tlv_s2i, isin2lei = sample_id_mappings(100_000, n_isin2lei)
+    os.makedirs(snapshot_path, exist_ok=True)
+    isin2lei_path = os.path.join(snapshot_path, "ISIN_LEI.csv")
+    isin2lei.to_csv(isin2lei_path, index=False)
+    convert_time, snapshot = time_call(write_isin2lei_snapshot, snapshot_path=snapshot_path,
+                                       isin2lei_path=isin2lei_path, repeat=1)
+    print("one-time conversion: {:.2f}s".format(convert_time))
+    isins = pd.Series(isin2lei["ISIN"].sample(n_lookups, replace=True, random_state=0).to_numpy())
+
+    def legacy():
+        mapping = prepare_mapping(fetch_latest_isin2lei(isin2lei_path), "ISIN", "LEI")
+        return id_col_clean(isins).map(mapping)
+
+    def new():
+        return Isin2LeiSnapshot(snapshot_path).map(id_col_clean(isins))
+
+    legacy_time, legacy_res = time_call(legacy, repeat=1)
+    new_time, new_res = time_call(new, repeat=1)
+    parity = legacy_res.equals(new_res)
+    print_benchmark("isin2lei load + lookup", n_lookups, legacy_time, new_time)
+    return benchmark_result("isin2lei load + lookup", n_lookups, legacy_time, new_time, parity)
+
+
+
+def benchmark_best_match(n_fff=5_000, n_holdings=2_000):
+    """compare best_match with the exhaustive scan and with the CompanyNameIndex candidates
+
+    :param n_fff: number of FFF company names
+    :param n_holdings: number of holdings company names
+    :return: benchmark result dict
+    """
+    fff_names, holdings_names = sample_company_names(n_fff, n_holdings)
+    fff_names = np.array(fff_names, dtype=object)
+
+    def legacy():
+        return [best_match(s, fff_names) for s in holdings_names]
+
+    def new():
+        name_index = CompanyNameIndex(fff_names)
+        return [best_match(s, fff_names, name_index=name_index) for s in holdings_names]
+
+    legacy_time, legacy_res = time_call(legacy, repeat=1)
+    new_time, new_res = time_call(new, repeat=1)
+    parity = legacy_res == new_res
+    print_benchmark("best_match", len(holdings_names), legacy_time, new_time)
+    return benchmark_result("best_match", len(holdings_names), legacy_time, new_time, parity)
+
+
+
+def benchmark_fuzzy_backend(n_queries=200, n_choices=2_000, backend='rapidfuzz'):
+    """compare the six-score aggregate matrix of a fuzzy backend with fuzzywuzzy
+
+    :param n_queries: number of query names
+    :param n_choices: number of choice names
+    :param backend: fuzzy backend to compare with fuzzywuzzy
+    :return: benchmark result dict
+    """
+    choices, queries = sample_company_names(n_choices, n_queries)
+    legacy_time, legacy_res = time_call(aggregate_match_score_matrix, queries, choices, 'fuzzywuzzy', repeat=1)
+    new_time, new_res = time_call(aggregate_match_score_matrix, queries, choices, backend, repeat=1)
+    parity = bool((np.abs(legacy_res - new_res) / 6 <= 2).mean() > 0.99)
+    print_benchmark("aggregate score matrix", legacy_res.size, legacy_time, new_time)
+    return benchmark_result("aggregate score matrix", legacy_res.size, legacy_time, new_time, parity)
+
+
+def benchmark_ticker_cleaning(n_rows=300_000, repeat=1):
+    """compare ticker_col_clean and the vectorized clean_instrument_from_ticker with the row-wise legacy versions
+
+    :param n_rows: number of rows
+    :param repeat: number of runs per implementation (best is kept)
+    :return: benchmark result dict for clean_instrument_from_ticker
+    """
+    holdings = sample_ticker_holdings(n_rows)
+    legacy_time, legacy_res = time_call(holdings["ticker"].map, clean_ticker, repeat=repeat)
+    new_time, new_res = time_call(ticker_col_clean, holdings["ticker"], repeat=repeat)
+    print_benchmark("clean_ticker", n_rows, legacy_time, new_time)
+    ticker_parity = legacy_res.equals(new_res)
+    legacy_time, legacy_res = time_call(legacy_clean_instrument_from_ticker, holdings, "instrument", "ticker",
+                                        repeat=repeat)
+    new_time, new_res = time_call(clean_instrument_from_ticker, holdings, "instrument", "ticker", repeat=repeat)
+    print_benchmark("clean_instrument_from_ticker", n_rows, legacy_time, new_time)
+    parity = ticker_parity and legacy_res.equals(new_res)
+    return benchmark_result("clean_instrument_from_ticker", n_rows, legacy_time, new_time, parity)
+
+
+def benchmark_clean_company(n_rows=1_000_000, n_names=20_000, repeat=1):
+    """compare company_col_clean (unique names through an LRU cache) with the row-wise map of clean_company,
+    on a cold cache and on a warm cache (e.g. the next quarter of the same funds)
+
+    :param n_rows: number of rows
+    :param n_names: number of distinct company names
+    :param repeat: number of runs per implementation (best is kept)
+    :return: benchmark result dict for the cold cache
+    """
+    rng = np.random.default_rng(0)
+    _, names = sample_company_names(n_names, n_names)
+    names = [n + suffix for n in names for suffix in ['', ' LTD', ' INC 5.5% 2030', ' בעמ']]
+    col = pd.Series(np.array(names, dtype=object)[rng.integers(0, len(names), n_rows)])
+    legacy_time, legacy_res = time_call(col.map, clean_company, repeat=repeat)
+    cached_clean_company.cache_clear()
+    new_time, new_res = time_call(company_col_clean, col, repeat=1)
+    warm_time, warm_res = time_call(company_col_clean, col, repeat=repeat)
+    print(cached_clean_company.cache_info())
+    parity = legacy_res.equals(new_res) and legacy_res.equals(warm_res)
+    print_benchmark("clean_company", n_rows, legacy_time, new_time)
+    print_benchmark("clean_company warm cache", n_rows, legacy_time, warm_time)
+    return benchmark_result("clean_company", n_rows, legacy_time, new_time, parity)
+
+
+def benchmark_match_holdings_with_prev(n_rows=1_000_000, n_prev=500_000, n_securities=200_000, n_extra_cols=20):
+    """compare match_holdings_with_prev (one latest-per-id table, index lookups) with the legacy five
+    groupby-first and merge passes, on a full-quarter size holdings frame: run time and peak memory
+
+    :param n_rows: number of holdings rows
+    :param n_prev: number of previously classified rows
+    :param n_securities: number of securities in the TLV mapping
+    :param n_extra_cols: number of extra holdings columns, copied by every merge
+    :return: benchmark result dict
+    """
+    tlv_s2i, isin2lei = sample_id_mappings(n_securities)
+    resolver = IdResolver(tlv_s2i, isin2lei)
+    holdings = resolver.enrich(sample_holdings_for_ids(n_rows, n_securities))
+    rng = np.random.default_rng(0)
+    for i in range(n_extra_cols):
+        holdings["extra_{}".format(i)] = rng.random(n_rows)
+    prev_class = resolver.enrich(sample_prev_class(n_prev, n_securities, seed=1))
+    legacy_time, legacy_res = time_call(legacy_match_holdings_with_prev, holdings, prev_class, 'מספר ני"ע', repeat=1)
+    new_time, new_res = time_call(match_holdings_with_prev, holdings, prev_class, 'מספר ני"ע', repeat=1)
+    legacy_peak, _ = peak_memory_call(legacy_match_holdings_with_prev, holdings, prev_class, 'מספר ני"ע')
+    new_peak, _ = peak_memory_call(match_holdings_with_prev, holdings, prev_class, 'מספר ני"ע')
+    parity = legacy_res.equals(new_res)
+    print_benchmark("match_holdings_with_prev", n_rows, legacy_time, new_time)
+    print("match_holdings_with_prev peak memory: legacy {:,.0f}MB | new {:,.0f}MB".format(legacy_peak, new_peak))
+    return benchmark_result("match_holdings_with_prev", n_rows, legacy_time, new_time, parity)
+
+
+def benchmark_prev_class_log(n_prev=1_000_000, n_new=50_000, n_securities=200_000,
+                             bench_path="data/benchmarks/prev_class_log"):
+    """compare the PrevClassLog (append a segment, latest views updated incrementally) with rewriting
+    prev_class.csv with a backup, and reading the latest classifications per id from each - the legacy read
+    enriches the ids like prepare_reference_data does
+
+    :param n_prev: number of previous classifications
+    :param n_new: number of new classifications appended
+    :param n_securities: number of securities in the TLV mapping
+    :param bench_path: directory for the benchmark files, replaced
+    :return: benchmark result dict for the update
+    """
+    import shutil
+    shutil.rmtree(bench_path, ignore_errors=True)
+    os.makedirs(bench_path)
+    prev_class_path = os.path.join(bench_path, "prev_class.csv")
+    # distinct classification dates, so the latest classification per id is well defined
+    rng = np.random.default_rng(0)
+    minutes = rng.permutation(n_prev + n_new)
+    dates = (pd.Timestamp("2015-01-01") + pd.to_timedelta(minutes, unit='min')).strftime('%Y-%m-%d %H:%M')
+    prev_class = sample_prev_class(n_prev, n_securities)
+    prev_class["classification_date"] = dates[:n_prev]
+    prev_class["LEI"] = np.where(rng.random(n_prev) < 0.2, ['5493{:016d}'.format(i) for i in range(n_prev)], None)
+    new_cls = sample_prev_class(n_new, n_securities, seed=1)
+    new_cls["classification_date"] = dates[n_prev:]
+    prev_class[prev_class_cols()].to_csv(prev_class_path, index=False)
+    sources = sample_reference_sources(n_securities, n_securities, 1)
+    resolver = IdResolver(prepare_tlv_sec_num_to_issuer(sources["tlv_s2i"].copy()), sources["isin2lei"])
+    prev_class_log = PrevClassLog(os.path.join(bench_path, "log"))
+    prev_class_log.append(prev_class[prev_class_cols()], resolver=resolver)
+    legacy_time, _ = time_call(legacy_update_prev_class, new_cls[prev_class_cols()], prev_class_path, repeat=1)
+    new_time, _ = time_call(prev_class_log.append, new_cls[prev_class_cols()], resolver=resolver, repeat=1)
+    print_benchmark("prev_class update", n_new, legacy_time, new_time)
+
+    def legacy_latest():
+        return prepare_reference_data(sources["tlv_s2i"].copy(), sources["isin2lei"], sources["tlv"].copy(),
+                                      prev_class=fetch_latest_prev_classified(prev_class_path))["latest_prev"]
+
+    legacy_read_time, legacy_res = time_call(legacy_latest, repeat=1)
+    new_read_time, new_res = time_call(prev_class_log.latest, resolver=resolver, repeat=1)
+    print_benchmark("prev_class latest per id", n_prev + n_new, legacy_read_time, new_read_time)
+    parity = legacy_res.sort_index().equals(new_res.sort_index())
+    return benchmark_result("prev_class update", n_new, legacy_time, new_time, parity)
+
+
+def benchmark_propagate_is_fossil(n_rows=200_000, n_securities=40_000):
+    """compare propagate_is_fossil_by_cols (all id columns in one call, group min / max) with the legacy
+    propagate_is_fossil per column (sort, groupby lambda transform, concat)
+
+    :param n_rows: number of rows
+    :param n_securities: number of securities in the TLV mapping
+    :return: benchmark result dict
+    """
+    holdings = sample_classified_holdings(n_rows, n_securities)
+    propagate_by_cols = ['מספר ני"ע', "ISIN", "LEI"]
+    holdings["row_id"] = np.arange(n_rows)
+
+    def legacy():
+        df = holdings
+        for col in propagate_by_cols:
+            df = legacy_propagate_is_fossil(df, col)
+        return df
+
+    legacy_time, legacy_res = time_call(legacy, repeat=1)
+    new_time, new_res = time_call(propagate_is_fossil_by_cols, holdings, propagate_by_cols, repeat=1)
+    # the legacy version moves rows without an id to the end, compare by original row
+    legacy_res = legacy_res.sort_values("row_id").set_index(holdings.index)
+    parity = legacy_res.equals(new_res)
+    print_benchmark("propagate_is_fossil", n_rows, legacy_time, new_time)
+    return benchmark_result("propagate_is_fossil", n_rows, legacy_time, new_time, parity)
+
+
+def benchmark_conflict_report(n_rows=200_000, n_securities=40_000, n_new=10_000):
+    """compare IsFossilConflictReport (all id types at once, group means from aggregates) with the legacy
+    groupby filter per id type, and time an incremental update with n_new added holdings
+
+    :param n_rows: number of rows
+    :param n_securities: number of securities in the TLV mapping
+    :param n_new: number of holdings added for the incremental update
+    :return: benchmark result dict
+    """
+    holdings = sample_classified_holdings(n_rows + n_new, n_securities)
+    id_types = list(ignore_id_types_holding_type())
+
+    def legacy(df):
+        return pd.concat([legacy_find_is_fossil_conflicts_by_id_type(df, id_type) for id_type in id_types])
+
+    def sorted_conflicts(conflicts):
+        return conflicts.sort_values(list(conflicts.columns)).reset_index(drop=True)
+
+    legacy_time, legacy_res = time_call(legacy, holdings.iloc[:n_rows], repeat=1)
+    report = IsFossilConflictReport()
+    new_time, new_res = time_call(report.update, holdings.iloc[:n_rows], repeat=1)
+    parity = sorted_conflicts(legacy_res).equals(sorted_conflicts(new_res))
+    print_benchmark("is_fossil conflicts", n_rows, legacy_time, new_time)
+    # incremental: only the added holdings are scanned
+    legacy_time, legacy_res = time_call(legacy, holdings, repeat=1)
+    new_time, new_res = time_call(report.update, holdings.iloc[n_rows:], repeat=1)
+    parity = parity and sorted_conflicts(legacy_res).equals(sorted_conflicts(new_res))
+    print_benchmark("is_fossil conflicts, {:,} added".format(n_new), n_rows + n_new, legacy_time, new_time)
+    print("conflicts: {:,} rows, report state: {:,} distinct rows".format(len(new_res), len(report.groups)))
+    return benchmark_result("is_fossil conflicts", n_rows, legacy_time, new_time, parity)
+
+
+def benchmark_consolidation(n_rows=1_000_000):
+    """compare the vectorized consolidation (is_fossil and conflict from one flags matrix), threshold gating and
+    issuer choice with the legacy row-wise versions
+
+    :param n_rows: number of rows
+    :return: benchmark result dict
+    """
+    holdings = sample_is_fossil_flags(n_rows)
+    flags = holdings.drop(["fff_fossil_any", "ticker_company_match_score", "מספר מנפיק", "מספר מנפיק_x"], axis=1)
+
+    def legacy():
+        gated = holdings.apply(
+            lambda row: row['fff_fossil_any'] if row['ticker_company_match_score'] > 80 else np.nan, axis='columns')
+        issuer = holdings.apply(choose_best_issuer_num, axis='columns')
+        return gated, issuer, legacy_add_is_fossil_conflict(legacy_consolidate_is_fossil(flags.copy()))
+
+    def new():
+        gated = holdings["fff_fossil_any"].where(holdings["ticker_company_match_score"] > 80)
+        issuer = choose_best_issuer_num_col(holdings)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return gated, issuer, consolidate_is_fossil(flags.copy())
+
+    legacy_time, _ = time_call(legacy, repeat=1)
+    new_time, _ = time_call(new, repeat=1)
+    mismatches = check_consolidation_parity(holdings.iloc[:100_000])
+    print("row-level mismatches: {}".format(mismatches))
+    print_benchmark("consolidation", n_rows, legacy_time, new_time)
+    return benchmark_result("consolidation", n_rows, legacy_time, new_time, sum(mismatches.values()) == 0)
+
+
+def benchmark_classify_holdings_batch(n_files=10, n_rows=20_000, n_securities=100_000, n_isin2lei=1_000_000,
+                                      n_prev=500_000, batch_path="data/benchmarks/batch"):
+    """compare classifying holdings files one by one, preparing the reference data for each file as
+    classify_holdings does, with classify_holdings_batch (reference data prepared once). FFF matching is skipped
+
+    :param n_files: number of holdings files
+    :param n_rows: number of rows per holdings file
+    :param n_securities: number of securities in the TLV mapping
+    :param n_isin2lei: number of rows in the ISIN2LEI mapping
+    :param n_prev: number of rows in prev_class
+    :param batch_path: directory for the generated holdings files and their outputs
+    :return: benchmark result dict
+    """
+    sources = sample_reference_sources(n_securities, n_isin2lei, n_prev)
+    os.makedirs(batch_path, exist_ok=True)
+    holdings_paths = []
+    for i in range(n_files):
+        holdings_path = os.path.join(batch_path, "holdings_{}.csv".format(i))
+        holdings = sample_holdings_for_ids(n_rows, n_securities, seed=100 + i)
+        holdings["holding_type"] = np.random.default_rng(i).choice(["מניות", "אג\"ח קונצרני", "הלוואות"], n_rows)
+        holdings.to_csv(holdings_path, index=False)
+        holdings_paths.append(holdings_path)
+
+    def prepared_reference():
+        return prepare_reference_data(**{k: v.copy() for k, v in sources.items()})
+
+    def legacy():
+        outputs = {}
+        for p in holdings_paths:
+            outputs[p] = pd.read_csv(classify_holdings_file(p, prepared_reference()), dtype=str)
+        return outputs
+
+    def new():
+        output_paths = classify_holdings_batch(holdings_paths, reference=prepared_reference())
+        return {p: pd.read_csv(o, dtype=str) for p, o in output_paths.items()}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy_time, legacy_res = time_call(legacy, repeat=1)
+        new_time, new_res = time_call(new, repeat=1)
+    parity = all(legacy_res[p].equals(new_res[p]) for p in holdings_paths)
+    print_benchmark("classify {} holdings files".format(n_files), n_rows * n_files, legacy_time, new_time)
+    return benchmark_result("classify_holdings_batch", n_rows * n_files, legacy_time, new_time, parity)
+
+
+def benchmark_classification_context(n_securities=100_000, n_isin2lei=1_000_000, n_prev=500_000, n_rows=20_000,
+                                     context_path="data/benchmarks/context"):
+    """compare preparing the reference data from its sources (as every classify_holdings call does) with loading
+    a saved ClassificationContext, and check both classify a holdings DataFrame the same
+
+    :param n_securities: number of securities in the TLV mapping
+    :param n_isin2lei: number of rows in the ISIN2LEI mapping
+    :param n_prev: number of rows in prev_class
+    :param n_rows: number of holdings rows classified
+    :param context_path: directory for the source files, the ISIN2LEI snapshot and the saved context
+    :return: benchmark result dict
+    """
+    source_paths = write_reference_sources(context_path, n_securities, n_isin2lei, n_prev)
+    snapshot_path = os.path.join(context_path, "isin2lei_snapshot")
+    context_fn = os.path.join(context_path, "classification_context.pkl")
+    holdings = sample_holdings_for_ids(n_rows, n_securities, seed=1)
+    holdings["holding_type"] = "מניות"
+    with contextlib.redirect_stdout(io.StringIO()):
+        # the ISIN2LEI snapshot is converted once, either way
+        write_isin2lei_snapshot(snapshot_path=snapshot_path, isin2lei_path=source_paths["isin2lei"])
+
+        def legacy():
+            return ClassificationContext(source_paths, isin2lei_snapshot_path=snapshot_path)
+
+        legacy_time, context = time_call(legacy, repeat=1)
+        context.save(context_fn)
+        new_time, loaded = time_call(ClassificationContext.load, context_fn, repeat=3)
+        changed = loaded.changed_sources()
+        cold_res = context.classify(holdings, match_cache_path=None)
+        warm_res = loaded.classify(holdings, match_cache_path=None)
+    print(context.versions())
+    print("saved context: {:.1f}MB, load {:.3f}s, changed sources: {}".format(
+        os.path.getsize(context_fn) / 2 ** 20, new_time, changed))
+    parity = cold_res.equals(warm_res) and loaded.version == context.version and len(changed) == 0
+    print_benchmark("classification context", n_isin2lei + n_prev, legacy_time, new_time)
+    return benchmark_result("classification context", n_isin2lei + n_prev, legacy_time, new_time, parity)
+
+
+def benchmark_classify_holdings_file(n_rows=100_000, n_securities=100_000, n_isin2lei=1_000_000, n_prev=200_000,
+                                     holdings_path="data/benchmarks/classify/holdings.csv"):
+    """compare the classify_holdings_file output with the classify_holdings pipeline before the rewrite (prev_class
+    matching, consolidation, propagation and conflicts, see the legacy_* functions), end to end on a holdings file.
+    FFF matching is skipped on both sides, it has parity checks of its own (check_best_match_backend_parity).
+    is_fossil_conflict is compared with the legacy conflict of the flags cast to float: the legacy conflict left
+    out the text is_fossil_prev_* flags, see consolidate_is_fossil
+
+    :param n_rows: number of holdings rows
+    :param n_securities: number of securities in the TLV mapping
+    :param n_isin2lei: number of rows in the ISIN2LEI mapping
+    :param n_prev: number of rows in prev_class
+    :param holdings_path: holdings csv path, the outputs are written next to it
+    :return: benchmark result dict
+    """
+    rng = np.random.default_rng(3)
+    sources = sample_reference_sources(n_securities, n_isin2lei, n_prev)
+    holdings = sample_classified_holdings(n_rows, n_securities, seed=3).drop("is_fossil", axis=1)
+    # security numbers (with foreign ISINs) in their own column, like in the reports
+    holdings["ISIN"] = holdings["ISIN"].where(rng.random(n_rows) < 0.3)
+    holdings.insert(0, "row_id", ["r{:07d}".format(i) for i in range(n_rows)])
+    os.makedirs(os.path.dirname(holdings_path), exist_ok=True)
+    holdings.to_csv(holdings_path, index=False)
+    legacy_path = holdings_path.replace(".csv", " legacy.csv")
+
+    def new():
+        reference = prepare_reference_data(sources["tlv_s2i"].copy(), sources["isin2lei"], sources["tlv"].copy(),
+                                           prev_class=sources["prev_class"].copy())
+        return classify_holdings_file(holdings_path, reference, match_cache_path=None)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy_time, _ = time_call(legacy_classify_holdings, holdings_path, sources, legacy_path, repeat=1)
+        new_time, new_path = time_call(new, repeat=1)
+    legacy_res = pd.read_csv(legacy_path, dtype=str).set_index("row_id").sort_index()
+    new_res = pd.read_csv(new_path, dtype=str).set_index("row_id").sort_index()
+    cols = [c for c in legacy_res.columns if c != "is_fossil_conflict"]
+    flags = legacy_res[[c for c in cols if c.startswith("is_fossil")]].astype(float)
+    legacy_conflict = legacy_add_is_fossil_conflict(flags)["is_fossil_conflict"].astype(str)
+    checks = {
+        "columns": sorted(legacy_res.columns) == sorted(new_res.columns),
+        "values": new_res[cols].equals(legacy_res[cols]),
+        "is_fossil_conflict": new_res["is_fossil_conflict"].equals(legacy_conflict)
+    }
+    diff = (new_res[cols].fillna("") != legacy_res[cols].fillna("")).sum() if checks["columns"] else None
+    print("classify_holdings_file checks: {}, differing values: {}".format(
+        checks, None if diff is None else diff[diff > 0].to_dict()))
+    print("is_fossil: {}".format(new_res["is_fossil"].value_counts(dropna=False).to_dict()))
+    print_benchmark("classify_holdings_file", n_rows, legacy_time, new_time)
+    return benchmark_result("classify_holdings_file", n_rows, legacy_time, new_time, all(checks.values()))
+
+
+def benchmark_classification_service(n_requests=8, n_rows=2_000, concurrency=4, n_securities=100_000,
+                                     n_isin2lei=1_000_000, n_prev=500_000, context_path="data/benchmarks/context"):
+    """compare classifying ad-hoc holdings with a cold start per request (reference data prepared for every file,
+    as the notebook does) with concurrent requests to the classification service (reference data kept warm)
+
+    :param n_requests: number of holdings uploads
+    :param n_rows: number of rows per upload
+    :param concurrency: number of concurrent requests to the service
+    :param n_securities: number of securities in the TLV mapping
+    :param n_isin2lei: number of rows in the ISIN2LEI mapping
+    :param n_prev: number of rows in prev_class
+    :param context_path: directory for the source files, the ISIN2LEI snapshot and the saved context
+    :return: benchmark result dict
+    """
+    import json
+    import threading
+    import urllib.request
+    from concurrent.futures import ThreadPoolExecutor
+    from classification_service import ClassificationServer
+    source_paths = write_reference_sources(context_path, n_securities, n_isin2lei, n_prev)
+    snapshot_path = os.path.join(context_path, "isin2lei_snapshot")
+    uploads = []
+    for i in range(n_requests):
+        holdings = sample_holdings_for_ids(n_rows, n_securities, seed=200 + i)
+        holdings["holding_type"] = "מניות"
+        uploads.append(holdings)
+    with contextlib.redirect_stdout(io.StringIO()):
+        context = load_classification_context(os.path.join(context_path, "classification_context.pkl"),
+                                              source_paths=source_paths, isin2lei_snapshot_path=snapshot_path)
+        server = ClassificationServer(("127.0.0.1", 0), context, max_concurrent=concurrency,
+                                      match_cache_path=None, fuzzy_backend='rapidfuzz')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def legacy():
+            return [ClassificationContext(source_paths, isin2lei_snapshot_path=snapshot_path).classify(
+                holdings, match_cache_path=None, fuzzy_backend='rapidfuzz')["is_fossil"].tolist()
+                    for holdings in uploads]
+
+        def request(holdings):
+            req = urllib.request.Request(
+                "http://127.0.0.1:{}/classify".format(server.server_port),
+                data=holdings.to_csv(index=False).encode("utf-8"),
+                headers={"Content-Type": "text/csv"}
+            )
+            with urllib.request.urlopen(req) as response:
+                return [r["is_fossil"] for r in json.loads(response.read())["data"]]
+
+        def new():
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                return list(executor.map(request, uploads))
+
+        legacy_time, legacy_res = time_call(legacy, repeat=1)
+        new_time, new_res = time_call(new, repeat=1)
+        metrics = json.loads(urllib.request.urlopen(
+            "http://127.0.0.1:{}/metrics".format(server.server_port)).read())
+        server.shutdown()
+        server.server_close()
+    parity = all(pd.Series(n, dtype=float).equals(pd.Series(l, dtype=float)) for n, l in zip(new_res, legacy_res))
+    print("service /classify latency: {}".format(
+        {k: v for k, v in metrics["endpoints"]["classify"].items() if k.endswith("_sec")}))
+    print_benchmark("classify {} uploads".format(n_requests), n_rows * n_requests, legacy_time, new_time)
+    return benchmark_result("classification service", n_rows * n_requests, legacy_time, new_time, parity)
+
+
+def benchmark_chunked_classification(n_rows=300_000, chunk_size=50_000, n_securities=100_000, n_excel_rows=30_000,
+                                     context_path="data/benchmarks/context", chunked_path="data/benchmarks/chunked"):
+    """compare the peak memory and time of classifying a holdings file whole with classifying it in chunks
+    (propagation by the aggregates of all the chunks), and check both outputs are the same - for a CSV file,
+    and for an xlsx file (streamed in chunks)
+
+    :param n_rows: number of holdings rows
+    :param chunk_size: number of rows per chunk
+    :param n_excel_rows: number of rows of the xlsx file, classified in chunks of chunk_size // 10 rows
+    :param n_securities: number of securities in the TLV mapping of the saved context
+    :param context_path: saved context directory, see benchmark_classification_context
+    :param chunked_path: directory for the generated holdings file and the outputs
+    :return: benchmark result dict
+    """
+    rng = np.random.default_rng(0)
+    context = ClassificationContext.load(os.path.join(context_path, "classification_context.pkl"))
+    holdings = sample_holdings_for_ids(n_rows, n_securities, seed=11)
+    # the same securities and LEIs in many rows, across chunks
+    holdings['מספר ני"ע'] = rng.choice(holdings['מספר ני"ע'].unique()[:n_rows // 20], n_rows)
+    holdings["LEI"] = np.where(rng.random(n_rows) < 0.5,
+                               ['5493{:016d}'.format(i) for i in rng.integers(0, n_rows // 50, n_rows)], None)
+    holdings["holding_type"] = rng.choice(["מניות", "אג\"ח קונצרני", "הלוואות", "קרנות סל"], n_rows)
+    os.makedirs(chunked_path, exist_ok=True)
+    whole_path = os.path.join(chunked_path, "whole.csv")
+    chunked_fn = os.path.join(chunked_path, "chunked.csv")
+    holdings.to_csv(whole_path, index=False)
+    holdings.to_csv(chunked_fn, index=False)
+    del holdings
+    args = {"match_cache_path": None, "fuzzy_backend": 'rapidfuzz'}
+    with contextlib.redirect_stdout(io.StringIO()):
+        legacy_time, whole_output = time_call(classify_holdings_file, whole_path, context.reference, repeat=1, **args)
+        new_time, chunked_output = time_call(classify_holdings_file, chunked_fn, context.reference,
+                                             chunk_size=chunk_size, repeat=1, **args)
+        legacy_peak, _ = peak_memory_call(classify_holdings_file, whole_path, context.reference, **args)
+        new_peak, _ = peak_memory_call(classify_holdings_file, chunked_fn, context.reference,
+                                       chunk_size=chunk_size, **args)
+    with open(whole_output, "rb") as w, open(chunked_output, "rb") as c:
+        parity = w.read() == c.read()
+    excel_holdings = pd.read_csv(whole_path, dtype=str, nrows=n_excel_rows)
+    excel_outputs = []
+    for fn in ["whole.xlsx", "chunked.xlsx"]:
+        excel_holdings.to_excel(os.path.join(chunked_path, fn), index=False)
+    with contextlib.redirect_stdout(io.StringIO()):
+        excel_outputs.append(classify_holdings_file(os.path.join(chunked_path, "whole.xlsx"), context.reference, **args))
+        excel_outputs.append(classify_holdings_file(os.path.join(chunked_path, "chunked.xlsx"), context.reference,
+                                                    chunk_size=chunk_size // 10, **args))
+    with open(excel_outputs[0], "rb") as w, open(excel_outputs[1], "rb") as c:
+        excel_parity = w.read() == c.read()
+    print("xlsx parity, whole vs chunks of {:,} rows: {}".format(chunk_size // 10, excel_parity))
+    parity = parity and excel_parity
+    print("peak memory: whole {:.0f}MB | chunks of {:,} rows {:.0f}MB".format(legacy_peak, chunk_size, new_peak))
+    print_benchmark("chunked classification", n_rows, legacy_time, new_time)
+    return dict(benchmark_result("chunked classification", n_rows, legacy_time, new_time, parity),
+                legacy_peak_mb=legacy_peak, new_peak_mb=new_peak)
+
+
+if __name__ == '__main__':
+    print(benchmark_single_pass_ingestion())
+    print(benchmark_parallel_extraction())
+    print(benchmark_parsed_reports_cache())
+    print(benchmark_download_reports())
+    print(benchmark_public_reports_query())
+    print(benchmark_holdings_dataset())
+    print(benchmark_id_col_clean())
+    print(benchmark_is_il_holding())
+    print(benchmark_find_id_cols())
+    print(benchmark_id_resolver())
+    print(benchmark_isin2lei_snapshot())
+    print(benchmark_best_match())
+    print(measure_best_match_recall(*sample_company_names(5_000, 2_000)[::-1]))
+    print(benchmark_fuzzy_backend())
+    print(benchmark_ticker_cleaning())
+    print(benchmark_clean_company())
+    print(benchmark_match_holdings_with_prev())
+    print(benchmark_prev_class_log())
+    print(benchmark_propagate_is_fossil())
+    print(benchmark_conflict_report())
+    print(benchmark_consolidation())
+    print(benchmark_classify_holdings_batch())
+    print(benchmark_classification_context())
+    print(benchmark_classify_holdings_file())
+    print(benchmark_classification_service())
+    print(benchmark_chunked_classification())
@@ -0,0 +1,327 @@
+# classification_service.py
+# a local HTTP service classifying holdings against reference data kept in memory (see ClassificationContext),
+# instead of paying the cold start of classify_holdings for every ad-hoc holdings file
+#
+# POST /classify - body is a CSV or Excel file (raw, or a multipart/form-data upload) or JSON rows
+#                  query params: ticker_col, company_col, sheet, format=json|csv, all_columns=1
+# GET /metrics   - request counts, concurrency and latency per endpoint
+# GET /health    - context version and reference source versions
+import io
+import json
+import time
+import threading
+from collections import deque
+from email.parser import BytesParser
+from email.policy import default as default_policy
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+from fossil_classification import *
+
+
+class ServiceMetrics:
+    """Thread-safe request metrics per endpoint: counts by status, in-flight and peak concurrent requests,
+    classified rows and latency percentiles over the last requests
+    """
+
+    def __init__(self, latency_window=1000):
+        """
+        :param latency_window: number of latest requests per endpoint latency percentiles are computed over
+        """
+        self.latency_window = latency_window
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.endpoints = {}
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.waiting = 0
+
+    def endpoint(self, name):
+        if name not in self.endpoints:
+            self.endpoints[name] = {
+                "requests": 0,
+                "statuses": {},
+                "rows": 0,
+                "total_sec": 0.0,
+                "latencies": deque(maxlen=self.latency_window)
+            }
+        return self.endpoints[name]
+
+    def request_started(self):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def request_finished(self, name, status, elapsed, rows=0):
+        """record a finished request
+
+        :param name: endpoint name
+        :param status: HTTP status code
+        :param elapsed: request time in seconds
+        :param rows: number of rows classified
+        :return: None
+        """
+        with self.lock:
+            self.in_flight -= 1
+            endpoint = self.endpoint(name)
+            endpoint["requests"] += 1
+            endpoint["statuses"][str(status)] = endpoint["statuses"].get(str(status), 0) + 1
+            endpoint["rows"] += rows
+            endpoint["total_sec"] += elapsed
+            endpoint["latencies"].append(elapsed)
+
+    def wait_started(self):
+        with self.lock:
+            self.waiting += 1
+
+    def wait_finished(self):
+        with self.lock:
+            self.waiting -= 1
+
+    def snapshot(self):
+        """the current metrics
+
+        :return: dict, JSON serializable
+        """
+        with self.lock:
+            endpoints = {}
+            for name, endpoint in self.endpoints.items():
+                latencies = np.array(endpoint["latencies"])
+                p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) > 0 else (None,) * 3
+                endpoints[name] = {
+                    "requests": endpoint["requests"],
+                    "statuses": dict(endpoint["statuses"]),
+                    "rows": endpoint["rows"],
+                    "mean_sec": endpoint["total_sec"] / endpoint["requests"] if endpoint["requests"] else None,
+                    "p50_sec": p50,
+                    "p95_sec": p95,
+                    "p99_sec": p99,
+                    "max_sec": latencies.max() if len(latencies) > 0 else None
+                }
+            return {
+                "uptime_sec": time.time() - self.started_at,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "waiting": self.waiting,
+                "endpoints": endpoints
+            }
+
+
+def read_holdings_upload(body, content_type, sheet_num=0):
+    """read uploaded holdings: a CSV or Excel file, raw or in a multipart/form-data upload, or JSON rows
+    (a list of row objects, or {"rows": [...]})
+
+    :param body: request body bytes
+    :param content_type: request Content-Type header
+    :param sheet_num: Excel sheet number
+    :return: holdings DataFrame, read like prepare_holdings does
+    """
+    filename = ""
+    if (content_type or "").lower().startswith("multipart/form-data"):
+        # the boundary in the header is case sensitive
+        message = BytesParser(policy=default_policy).parsebytes(
+            b"Content-Type: " + content_type.encode("utf-8") + b"\r\n\r\n" + body)
+        files = [part for part in message.iter_parts() if part.get_filename()]
+        if len(files) == 0:
+            raise ValueError("no file in multipart upload")
+        filename = files[0].get_filename().lower()
+        content_type = files[0].get_content_type()
+        body = files[0].get_payload(decode=True)
+    content_type = (content_type or "").lower()
+    if "json" in content_type or filename.endswith(".json"):
+        rows = json.loads(body)
+        if isinstance(rows, dict):
+            rows = rows.get("rows", [])
+        # like the holdings read from CSV, all values as strings
+        return pd.DataFrame(rows, dtype=str)
+    if filename.endswith((".xlsx", ".xls")) or "spreadsheet" in content_type or "excel" in content_type:
+        return pd.read_excel(io.BytesIO(body), sheet_name=sheet_num)
+    if filename.endswith(".csv") or "csv" in content_type or "text/plain" in content_type:
+        return pd.read_csv(io.BytesIO(body), dtype=str)
+    raise ValueError("unsupported upload type: {}, send CSV, Excel or JSON".format(content_type or "none"))
+
+
+def classification_result_cols(classified, holdings_cols):
+    """columns returned for classified holdings: the input columns, is_fossil, the is_fossil_* provenance
+    columns and is_fossil_conflict
+
+    :param classified: classified holdings DataFrame
+    :param holdings_cols: input holdings columns
+    :return: list of columns
+    """
+    input_cols = [c for c in holdings_cols if c in classified.columns and not c.startswith("is_fossil")]
+    return input_cols + [c for c in classified.columns if c.startswith("is_fossil")]
+
+
+class ClassificationServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer holding the ClassificationContext shared by the request threads, the request metrics
+    and a bound on the number of concurrent classifications (each one holds its holdings in memory)
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address, context, max_concurrent=4, max_workers=1,
+                 match_cache_path="data/fff_match_cache.csv", fuzzy_backend='fuzzywuzzy'):
+        """
+        :param server_address: (host, port)
+        :param context: ClassificationContext
+        :param max_concurrent: number of classifications run at the same time, other requests wait
+        :param max_workers: number of fuzzy matching worker processes per classification
+        :param match_cache_path: fuzzy match cache csv path, None disables the cache
+        :param fuzzy_backend: fuzzy scoring backend, see fuzzy_backends()
+        """
+        super().__init__(server_address, ClassificationRequestHandler)
+        self.context = context
+        self.metrics = ServiceMetrics()
+        self.classify_slots = threading.BoundedSemaphore(max_concurrent)
+        if context.reference["fff"] is not None and match_cache_path is not None and \
+                not path.isfile(match_cache_path):
+            # create the cache before the request threads append to it, so only one header is written
+            append_fff_match_cache({}, match_cache_path, None, create=True)
+        self.classify_args = {
+            "max_workers": max_workers,
+            "match_cache_path": match_cache_path,
+            "fuzzy_backend": fuzzy_backend
+        }
+
+
+class ClassificationRequestHandler(BaseHTTPRequestHandler):
+
+    def send_body(self, status, body, content_type="application/json; charset=utf-8"):
+        body = body.encode("utf-8")
+        # from here on an error can't be sent as a response of its own
+        self.response_started = True
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, obj):
+        self.send_body(status, json.dumps(obj, ensure_ascii=False, default=str))
+
+    def handle_endpoint(self, name, func):
+        """run an endpoint handler, recording its metrics and turning errors into JSON error responses -
+        unless the response was already started (e.g. the client disconnected while it was sent)
+
+        :param name: endpoint name
+        :param func: handler, returns the number of rows classified
+        :return: None
+        """
+        metrics = self.server.metrics
+        metrics.request_started()
+        start = time.perf_counter()
+        status = 200
+        rows = 0
+        self.response_started = False
+        try:
+            rows = func()
+        except Exception as e:
+            status = 400 if isinstance(e, ValueError) else 500
+            error = str(e) if status == 400 else "{}: {}".format(type(e).__name__, e)
+            if self.response_started:
+                self.log_error("error after the response was started: %s", error)
+                self.close_connection = True
+            else:
+                self.send_json(status, {"error": error})
+        finally:
+            metrics.request_finished(name, status, time.perf_counter() - start, rows=rows or 0)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/metrics":
+            self.handle_endpoint("metrics", lambda: self.send_json(200, self.server.metrics.snapshot()))
+        elif url.path == "/health":
+            self.handle_endpoint("health", self.health)
+        else:
+            self.send_json(404, {"error": "not found: {}".format(url.path)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/classify":
+            self.handle_endpoint("classify", lambda: self.classify(parse_qs(url.query)))
+        else:
+            self.send_json(404, {"error": "not found: {}".format(url.path)})
+
+    def health(self):
+        context = self.server.context
+        self.send_json(200, {
+            "context_version": context.version,
+            "created_at": context.created_at,
+            "sources": {name: {"version": s["version"], "modified": s["modified"], "rows": s["rows"]}
+                        for name, s in context.sources.items()}
+        })
+
+    def classify(self, query):
+        """classify the uploaded holdings and send the classified rows
+
+        :param query: parsed query string
+        :return: number of rows classified
+        """
+        length = int(self.headers.get("Content-Length") or 0)
+        if length == 0:
+            raise ValueError("empty request body")
+        body = self.rfile.read(length)
+        holdings = read_holdings_upload(body, self.headers.get("Content-Type"),
+                                        sheet_num=int(query.get("sheet", [0])[0]))
+        holdings_cols = holdings.columns.str.strip().tolist()
+        company_col = query.get("company_col", ["שם המנפיק/שם נייר ערך"])[0]
+        if company_col not in holdings_cols:
+            raise ValueError("company column {} not in holdings columns".format(company_col))
+        ticker_col = query.get("ticker_col", [None])[0]
+        if ticker_col is not None and ticker_col not in holdings_cols:
+            raise ValueError("ticker column {} not in holdings columns".format(ticker_col))
+        metrics = self.server.metrics
+        metrics.wait_started()
+        with self.server.classify_slots:
+            metrics.wait_finished()
+            start = time.perf_counter()
+            classified = self.server.context.classify(
+                holdings,
+                holdings_ticker_col=ticker_col,
+                holdings_company_col=company_col,
+                **self.server.classify_args
+            )
+            classify_sec = time.perf_counter() - start
+        if query.get("all_columns", ["0"])[0] != "1":
+            classified = classified[classification_result_cols(classified, holdings_cols)]
+        if query.get("format", ["json"])[0] == "csv":
+            self.send_body(200, classified.to_csv(index=False), content_type="text/csv; charset=utf-8")
+        else:
+            # rows as JSON records, NaN as null
+            self.send_body(200, '{{"context_version": {}, "rows": {}, "classify_sec": {:.3f}, "data": {}}}'.format(
+                json.dumps(self.server.context.version), len(classified), classify_sec,
+                classified.to_json(orient="records", force_ascii=False)
+            ))
+        return len(classified)
+
+    def log_message(self, format, *args):
+        print("{} - {}".format(self.address_string(), format % args))
+
+
+def serve(context=None, host="127.0.0.1", port=8050, max_concurrent=4, max_workers=1,
+          match_cache_path="data/fff_match_cache.csv", fuzzy_backend='fuzzywuzzy', context_path=None):
+    """run the classification service until interrupted
+
+    :param context: ClassificationContext, default is load_classification_context(context_path)
+    :param host: host to listen on, local only by default
+    :param port: port to listen on
+    :param context_path: saved context path, see load_classification_context
+    other params as in ClassificationServer
+    :return: None
+    """
+    if context is None:
+        context = load_classification_context(context_path)
+    server = ClassificationServer((host, port), context, max_concurrent=max_concurrent, max_workers=max_workers,
+                                  match_cache_path=match_cache_path, fuzzy_backend=fuzzy_backend)
+    print("classification service on http://{}:{}, context {}".format(host, server.server_port, context.version))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    serve()
@@ -1,16 +1,45 @@
 # enrich_holdings.py
+import os
+import time
 import pandas as pd
+import numpy as np
 import re
+from functools import lru_cache
 
 
 # Auxiliary functions
+def str_col(col):
+    """col.astype(str) that never modifies col
+    pandas < 2 casts object arrays in place when their dtype is not the canonical object dtype, e.g. after unpickling
+    in a worker process - a zero-copy view with the canonical dtype makes astype copy as expected
+
+    :param col: Series or Index
+    :return: Series of str
+    """
+    col = pd.Series(col)
+    if col.dtype == object:
+        col = pd.Series(col.to_numpy().view(np.dtype(object)), index=col.index, name=col.name)
+    return col.astype(str)
+
+
+def id_col_invalid_values():
+    """get id values that are considered missing, after strip and upper
+
+    :return: a list of invalid id values
+    """
+    return ['0', 'NAN', 'NONE', '']
+
+
 def id_col_clean(col):
-    new_col = pd.Series(col.astype(str).str.strip().str.upper())
-# remove '0' and other non valid values
-    new_col = new_col.apply(
-        lambda x: None if (x == '0') | (x == 'NAN') | (x == 'NONE') | (x == '') else x
-    )
-    return new_col
+    new_col = str_col(col)
+    # id columns repeat a lot - clean each distinct value once and map back by code
+    codes, uniques = pd.factorize(new_col)
+    clean_uniques = pd.Series(uniques, dtype=object).str.strip().str.upper()
+    # remove '0' and other non valid values
+    clean_uniques = clean_uniques.where(~clean_uniques.isin(id_col_invalid_values()), None)
+    # a trailing None serves missing values (code -1)
+    values = np.append(clean_uniques.to_numpy(dtype=object), None)[codes]
+    return pd.Series(values, index=new_col.index, name=new_col.name, dtype=object)
 
 
 def remove_words_without_letters(s):
@@ -41,6 +70,35 @@ def clean_company(s):
     return s.strip()
 
 
+@lru_cache(maxsize=2 ** 18)
+def cached_clean_company(s):
+    """clean_company with a bounded LRU cache - holdings names repeat across funds and quarters
+    cached_clean_company.cache_info() reports the hits and misses
+
+    :param s: company name string
+    :return: clean company name
+    """
+    return clean_company(s)
+
+
+def company_col_clean(col):
+    """clean_company for a whole column: each distinct name is cleaned once, through cached_clean_company
+
+    :param col: Series of company names
+    :return: Series of clean company names, same index as col
+    """
+    start = time.perf_counter()
+    hits_before = cached_clean_company.cache_info().hits
+    # clean_company starts with str(s), so names are factorized as strings
+    codes, uniques = pd.factorize(str_col(col))
+    clean_uniques = np.array([cached_clean_company(s) for s in uniques], dtype=object)
+    hits = cached_clean_company.cache_info().hits - hits_before
+    print("clean company names: {:,} rows, {:,} unique, {:,} cache hits ({:.1%}), {:.2f}s".format(
+        len(codes), len(uniques), hits, hits / max(len(uniques), 1), time.perf_counter() - start
+    ))
+    return pd.Series(clean_uniques[codes], index=col.index, name=col.name, dtype=object)
+
+
 def any_heb_char(s):
     s = str(s)
     # df["has_hebrew_char"] = df[string_column].map(lambda s: any_heb_char(s))
@@ -82,6 +140,43 @@ def is_il_holding(row):
     return heb_char | numeric_sec_num | sec_num_il_isin
 
 
+def heb_char_pattern():
+    """a pattern matching any Hebrew character, same range as any_heb_char
+
+    :return: regex pattern
+    """
+    return "[\u0590-\u05EA]"
+
+
+def number_pattern():
+    """a pattern matching the strings float() accepts (after strip), except NaN, same as is_number
+
+    :return: regex pattern
+    """
+    # digits may be separated by single underscores, e.g. 1_000
+    digits = r"\d(?:_?\d)*"
+    return (r"[+-]?(?:(?:{d}(?:\.(?:{d})?)?|\.{d})(?:E[+-]?{d})?|INF(?:INITY)?)"
+            .format(d=digits))
+
+
+def is_il_holding_mask(df):
+    """a column-wise version of is_il_holding: true for Israeli holdings based on security number and security name
+
+    :param df: holdings DataFrame
+    :return: boolean Series, True if holding is Israeli holding, False else
+    """
+    sec_name = str_col(df["שם המנפיק/שם נייר ערך"]).str.upper().str.strip()
+    sec_num = str_col(df['מספר ני"ע']).str.upper().str.strip()
+    heb_char = sec_name.str.contains(heb_char_pattern(), regex=True)
+    numeric_sec_num = sec_num.str.fullmatch(number_pattern(), case=False)
+    sec_num_il_isin = sec_num.str.startswith("IL")
+    if "ISIN" in df.columns:
+        # None ISIN is stringified to 'NONE' which does not start with IL
+        sec_isin_il = str_col(df["ISIN"]).str.upper().str.strip().str.startswith("IL")
+        sec_num_il_isin = sec_num_il_isin | sec_isin_il
+    return (heb_char | numeric_sec_num | sec_num_il_isin).astype(bool)
+
+
 def bogus_issuer_numbers():
     """ a list of bogus issuer numbers, to be removed from any holding file
 
@@ -114,42 +209,122 @@ def id_col_patterns(id_type):
     return patterns[id_type]
 
 
-def find_id_col(df, id_type):
+def id_cols_pattern(id_types):
+    """a single pattern scoring all id types at once - an optional lookahead group per id type,
+    so one regex pass on a value tells which of the id type patterns it matches
+
+    :param id_types: list of id types, see id_col_types()
+    :return: regex pattern with groups g0, g1, ... in id_types order
+    """
+    groups = ["(?=(?P<g{}>{}))?".format(i, id_col_patterns(id_type)) for i, id_type in enumerate(id_types)]
+    return "^" + "".join(groups)
+
+
+def is_parent_corp_col(col):
+    """check if a column holds the parent corp (the reporting institution) id, to disregard it as an id column
+
+    :param col: column name
+    :return: True if col is a parent corp column
+    """
+    return (col == "ParentCorpLegalId") or (str(col).find("parent_corp") != -1)
+
+
+def score_id_cols(df, id_types=None, sample_size=None, exclude_parent_corp=True):
+    """count the values matching each id type pattern per column, scanning each column once
+
+    :param df: DataFrame
+    :param id_types: list of id types to score, default is all of id_col_types()
+    :param sample_size: if set, score only the first sample_size non-null values of each column (fast estimate)
+    :param exclude_parent_corp: disregard parent corp columns
+    :return: DataFrame of match counts, index is df columns, columns are id types
+    """
+    if id_types is None:
+        id_types = id_col_types()
+    pattern = id_cols_pattern(id_types)
+    group_names = ["g{}".format(i) for i in range(len(id_types))]
+    scores = {}
+    for col in df:
+        if exclude_parent_corp and is_parent_corp_col(col):
+            continue
+        values = df[col]
+        if isinstance(values, pd.DataFrame):
+            # duplicate column names - score the first one, as df[col].astype(str) would fail anyway
+            values = values.iloc[:, 0]
+        if sample_size is not None:
+            values = values.dropna().head(sample_size)
+        # run the pattern once per distinct value, weighted by its count
+        value_counts = str_col(values).str.strip().value_counts()
+        if value_counts.empty:
+            scores[col] = [0] * len(id_types)
+            continue
+        matches = pd.Series(value_counts.index, dtype=object).str.extract(pattern)[group_names].notna()
+        scores[col] = list(matches.mul(value_counts.to_numpy(), axis=0).sum())
+    return pd.DataFrame.from_dict(scores, orient='index', columns=id_types, dtype='int64')
+
+
+def detect_id_cols(df, id_types=None, sample_size=None, exclude_parent_corp=True):
+    """Automatically identify the best column for each id type, in a single scan of the DataFrame
+
+    :param df: DataFrame
+    :param id_types: list of id types to detect, default is all of id_col_types()
+    :param sample_size: if set, score only the first sample_size non-null values of each column (fast estimate)
+    :param exclude_parent_corp: disregard parent corp columns
+    :return: a dictionary of {id_type: (id_col, match_count)}, id_col is None if no column matches
+    """
+    if id_types is None:
+        id_types = id_col_types()
+    scores = score_id_cols(df, id_types, sample_size, exclude_parent_corp)
+    id_cols = {}
+    for id_type in id_types:
+        max_cnt = scores[id_type].max() if not scores.empty else 0
+        # first column with the max count, same as a strictly greater scan
+        id_cols[id_type] = (scores[id_type].idxmax(), int(max_cnt)) if max_cnt > 0 else (None, 0)
+    return id_cols
+
+
+def print_id_col(id_type, id_col, cnt, n_rows):
+    """print the detected id column and its match count
+
+    :param id_type: id type
+    :param id_col: detected id column, None if not found
+    :param cnt: number of matching values
+    :param n_rows: number of rows in the DataFrame
+    :return: None
+    """
+    if id_col is not None:
+        print("\nHolding file {} col is: {}".format(id_type, id_col))
+        print("number of {}s: {} out of {} rows".format(id_type, cnt, n_rows))
+    else:
+        print("\nno {}s in holdings file".format(id_type))
+
+
+def find_id_col(df, id_type, sample_size=None):
     """Automatically identify columns with the chosen id_type
 
     :param df: DataFrame
     :param id_type: str, one of the following: ISIN, LEI, il_corp_num
+    :param sample_size: if set, score only the first sample_size non-null values of each column
     :return: id_col: string
     """
     if id_type not in id_col_types():
         print("ERROR: {} is an unknown ID type".format(id_type))
         return
-    pattern = id_col_patterns(id_type)
-    max_cnt = 0
-    for col in df:
-        # disregard ParentCorpId column
-        if col not in ["ParentCorpLegalId"] and (col.find("parent_corp") == -1):
-            cnt = sum(df[col].astype(str).str.strip().str.contains(pattern, na=False))
-            if cnt > max_cnt:
-                id_col = col
-                max_cnt = cnt
-    if max_cnt > 0:
-        print("\nHolding file {} col is: {}".format(id_type, id_col))
-        print("number of {}s: {} out of {} rows".format(id_type, max_cnt, df.shape[0]))
-        return id_col
-    else:
-        print("\nno {}s in holdings file".format(id_type))
+    id_col, cnt = detect_id_cols(df, [id_type], sample_size)[id_type]
+    print_id_col(id_type, id_col, cnt, df.shape[0])
+    return id_col
 
 
-def find_id_cols(df):
+def find_id_cols(df, sample_size=None):
     """get all ID columns for a given DataFrame
 
     :param df: DataFrame
+    :param sample_size: if set, score only the first sample_size non-null values of each column
     :return: a dictionary of {id_type:id_col} for all ID types
     """
     id_cols = {}
-    for id_col_type in id_col_types():
-        id_cols[id_col_type] = find_id_col(df, id_col_type)
+    for id_col_type, (id_col, cnt) in detect_id_cols(df, sample_size=sample_size).items():
+        print_id_col(id_col_type, id_col, cnt, df.shape[0])
+        id_cols[id_col_type] = id_col
     return id_cols
 
 
@@ -175,7 +350,7 @@ def fix_id_cols(df):
             df[id_type] = id_col_clean(df[id_type])
     if "מספר מנפיק" in df.columns:
         # remove il_issuer_number for non Israeli holdings
-        df_il_mask = df.apply(is_il_holding, axis='columns')
+        df_il_mask = is_il_holding_mask(df)
         df.loc[~df_il_mask, "מספר מנפיק"] = None
         # remove bogus issuer_number for all holdings
         df.loc[df["מספר מנפיק"].isin(bogus_issuer_numbers()), "מספר מנפיק"] = None
@@ -256,6 +431,106 @@ def fetch_latest_isin2lei(isin2lei_path="data_sources/ISIN_LEI.csv"):
     return isin2lei
 
 
+def fetch_isin2lei_snapshot_path():
+    return "data_sources/isin2lei_snapshot"
+
+
+class Isin2LeiSnapshot:
+    """A read-only ISIN to LEI index over a memory-mapped snapshot written by write_isin2lei_snapshot:
+    sorted unique fixed-width utf-8 ISIN keys (isin.npy) and their LEI values (lei.npy), looked up by binary search.
+    Loading maps the files without reading them, and pickling keeps only the path
+    """
+
+    def __init__(self, snapshot_path=None):
+        """open the snapshot
+
+        :param snapshot_path: snapshot directory, default is fetch_isin2lei_snapshot_path()
+        """
+        if snapshot_path is None:
+            snapshot_path = fetch_isin2lei_snapshot_path()
+        self.snapshot_path = snapshot_path
+        self.keys = np.load(os.path.join(snapshot_path, "isin.npy"), mmap_mode='r')
+        self.values = np.load(os.path.join(snapshot_path, "lei.npy"), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __getstate__(self):
+        return {"snapshot_path": self.snapshot_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["snapshot_path"])
+
+    def map(self, col):
+        """look up LEIs for a column of clean ISINs, like col.map(isin2lei_index)
+
+        :param col: Series of clean ISINs (see id_col_clean)
+        :return: Series of LEIs, NaN where not found
+        """
+        result = np.full(len(col), np.nan, dtype=object)
+        codes, uniques = pd.factorize(col)
+        if (len(uniques) == 0) or (len(self.keys) == 0):
+            return pd.Series(result, index=col.index)
+        # ISINs longer than the key width cannot be in the snapshot
+        encoded = [u.encode("utf-8") if isinstance(u, str) else b"" for u in uniques]
+        valid = np.array([(len(e) > 0) and (len(e) <= self.keys.dtype.itemsize) for e in encoded])
+        queries = np.array([e if v else b"" for e, v in zip(encoded, valid)], dtype=self.keys.dtype)
+        pos = np.searchsorted(self.keys, queries).clip(max=len(self.keys) - 1)
+        found = valid & (self.keys[pos] == queries)
+        unique_values = np.full(len(uniques) + 1, np.nan, dtype=object)
+        unique_values[:-1][found] = [v.decode("utf-8") for v in self.values[pos[found]]]
+        # code -1 (missing ISIN) takes the trailing NaN
+        result[:] = unique_values[codes]
+        return pd.Series(result, index=col.index)
+
+
+def write_isin2lei_snapshot(isin2lei=None, snapshot_path=None, isin2lei_path="data_sources/ISIN_LEI.csv"):
+    """one-time conversion of the ISIN2LEI mapping to a memory-mappable snapshot (see Isin2LeiSnapshot)
+    ISINs are cleaned and deduplicated (first LEI kept), same as prepare_mapping
+
+    :param isin2lei: ISIN to LEI mapping, default is read from isin2lei_path
+    :param snapshot_path: snapshot directory, default is fetch_isin2lei_snapshot_path()
+    :param isin2lei_path: ISIN to LEI mapping path, used if isin2lei is None
+    :return: Isin2LeiSnapshot
+    """
+    if snapshot_path is None:
+        snapshot_path = fetch_isin2lei_snapshot_path()
+    if isin2lei is None:
+        isin2lei = fetch_latest_isin2lei(isin2lei_path)
+    mapping = prepare_mapping(isin2lei[["ISIN", "LEI"]].copy(), "ISIN", "LEI")
+    # fixed-width utf-8 bytes, sorted bytewise for the binary search
+    keys = np.array(mapping.index.str.encode("utf-8"), dtype=bytes)
+    values = np.array(mapping.str.encode("utf-8"), dtype=bytes)
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    values = values[order]
+    os.makedirs(snapshot_path, exist_ok=True)
+    for name, arr in [("isin", keys), ("lei", values)]:
+        # write to a temp file and rename, so a failed conversion never leaves a partial snapshot
+        tmp_fn = os.path.join(snapshot_path, name + ".tmp.npy")
+        np.save(tmp_fn, arr)
+        os.replace(tmp_fn, os.path.join(snapshot_path, name + ".npy"))
+    print("ISIN2LEI snapshot: {:,} ISINs saved to {}".format(len(keys), snapshot_path))
+    return Isin2LeiSnapshot(snapshot_path)
+
+
+def fetch_latest_isin2lei_snapshot(snapshot_path=None, isin2lei_path="data_sources/ISIN_LEI.csv"):
+    """open the ISIN2LEI snapshot, converting the mapping file first if the snapshot is missing or older
+
+    :param snapshot_path: snapshot directory, default is fetch_isin2lei_snapshot_path()
+    :param isin2lei_path: ISIN to LEI mapping path
+    :return: Isin2LeiSnapshot
+    """
+    if snapshot_path is None:
+        snapshot_path = fetch_isin2lei_snapshot_path()
+    # lei.npy is written last - its presence marks a complete snapshot
+    values_fn = os.path.join(snapshot_path, "lei.npy")
+    if (not os.path.isfile(values_fn)) or (
+            os.path.isfile(isin2lei_path) and os.path.getmtime(isin2lei_path) > os.path.getmtime(values_fn)):
+        return write_isin2lei_snapshot(snapshot_path=snapshot_path, isin2lei_path=isin2lei_path)
+    return Isin2LeiSnapshot(snapshot_path)
+
+
 def prepare_tlv_sec_num_to_issuer(tlv_s2i):
     tlv_s2i.columns = tlv_s2i.columns.str.strip()
     tlv_s2i["ISIN"] = id_col_clean(tlv_s2i["ISIN"])
@@ -325,37 +600,217 @@ def add_id_by_another_id_mapping(df, add_id_type, by_id_type, mapping):
     return df_with_added_id_type
 
 
-def add_all_id_types_to_holdings(holdings, tlv_s2i, isin2lei):
+def id_resolution_steps():
+    """the id resolution steps, in the order they are applied to holdings
+
+    :return: a list of (add_id_type, by_id_type, mapping source) tuples, source is either "tlv_s2i" or "isin2lei"
+    """
+    steps = [
+        ("ISIN", 'מספר ני"ע', "tlv_s2i"),
+        ("מספר מנפיק", "מספר תאגיד", "tlv_s2i"),
+        ("מספר מנפיק", 'מספר ני"ע', "tlv_s2i"),
+        ("מספר מנפיק", "ISIN", "tlv_s2i"),
+        ("LEI", "ISIN", "isin2lei"),
+    ]
+    return steps
+
+
+class IdResolver:
+    """In-memory id indexes built once from the TLV securities mapping and ISIN2LEI,
+    used to add all id_types to any holdings DataFrame with vectorized lookups.
+    Picklable - can be saved with save(), loaded with IdResolver.load() or passed to worker processes
+    """
+
+    def __init__(self, tlv_s2i, isin2lei):
+        """build an index (a Series with a unique key index) per resolution step
+
+        :param tlv_s2i: TLV securities mapping, after prepare_tlv_sec_num_to_issuer
+        :param isin2lei: ISIN to LEI mapping, either a DataFrame or an Isin2LeiSnapshot
+        """
+        mappings = {"tlv_s2i": tlv_s2i, "isin2lei": isin2lei}
+        self.steps = []
+        self.indexes = {}
+        for add_id_type, by_id_type, source in id_resolution_steps():
+            mapping = mappings[source]
+            if isinstance(mapping, Isin2LeiSnapshot):
+                # already a prepared index
+                self.indexes[(add_id_type, by_id_type)] = mapping
+                self.steps.append((add_id_type, by_id_type))
+                continue
+            if (by_id_type not in mapping.columns) or (add_id_type not in mapping.columns):
+                # e.g. an old TLV mapping without מספר תאגיד
+                continue
+            # prepare a copy of the two columns only, leaving the original mapping untouched
+            self.indexes[(add_id_type, by_id_type)] = prepare_mapping(
+                mapping[[by_id_type, add_id_type]].copy(), by_id_type, add_id_type
+            )
+            self.steps.append((add_id_type, by_id_type))
+        self.coverage = []
+
+    def add_id(self, df, add_id_type, by_id_type):
+        """Add or update add_id_type by by_id_type, same as add_id_by_another_id_mapping
+
+        :param df: DataFrame with by_id_type
+        :param add_id_type: the id_type to be added
+        :param by_id_type: the id_type by which to look up
+        :return: df with add_id_type (updated for missing values if existing already)
+        """
+        df[by_id_type] = id_col_clean(df[by_id_type])
+        index = self.indexes[(add_id_type, by_id_type)]
+        # a Series index is looked up with Series.map, a snapshot with its own map
+        found = index.map(df[by_id_type]) if isinstance(index, Isin2LeiSnapshot) else df[by_id_type].map(index)
+        if add_id_type in df.columns:
+            missing_before = df[add_id_type].isnull().sum()
+            df[add_id_type] = df[add_id_type].fillna(found)
+        else:
+            missing_before = len(df)
+            df[add_id_type] = found
+        with_value = df[add_id_type].notnull().sum()
+        with_key = df[by_id_type].notnull().sum()
+        self.coverage.append({
+            "add_id_type": add_id_type,
+            "by_id_type": by_id_type,
+            "rows": len(df),
+            "rows_with_key": with_key,
+            "rows_found": found.notnull().sum(),
+            "rows_filled": missing_before - df[add_id_type].isnull().sum(),
+            "rows_with_value": with_value
+        })
+        print("{}s with matching {}: {} out of total relevant rows: {}".format(
+            by_id_type,
+            add_id_type,
+            with_value,
+            with_key
+        ))
+        return df
+
+    def enrich(self, holdings):
+        """Add all id_types to holdings DataFrame
+
+        :param holdings: holdings DataFrame, with מספר ני"ע and מספר מנפיק
+        :return: holdings with added id_types
+        """
+        holdings = fix_id_cols(holdings)
+        for add_id_type, by_id_type in self.steps:
+            holdings = self.add_id(holdings, add_id_type, by_id_type)
+        return holdings
+
+    def coverage_stats(self):
+        """get coverage stats of all add_id calls so far
+
+        :return: DataFrame, a row per add_id call
+        """
+        return pd.DataFrame(self.coverage)
+
+    def index_sizes(self):
+        """get the number of keys per index
+
+        :return: dict of {(add_id_type, by_id_type): number of keys}
+        """
+        return {step: len(index) for step, index in self.indexes.items()}
+
+    def version(self):
+        """a version id of the indexes content - changes when any of the mappings changes,
+        e.g. to rebuild data enriched with an older version
+
+        :return: version string
+        """
+        import hashlib
+        h = hashlib.sha256()
+        for step in self.steps:
+            index = self.indexes[step]
+            h.update(str(step).encode("utf-8"))
+            if isinstance(index, Isin2LeiSnapshot):
+                h.update(np.ascontiguousarray(index.keys).tobytes())
+                h.update(np.ascontiguousarray(index.values).tobytes())
+            else:
+                h.update(pd.util.hash_pandas_object(index, index=True).to_numpy().tobytes())
+        return h.hexdigest()[:16]
+
+    def save(self, path):
+        """save the resolver indexes with pickle
+
+        :param path: file path
+        :return: None
+        """
+        import pickle
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """load a resolver saved with save()
+
+        :param path: file path
+        :return: IdResolver
+        """
+        import pickle
+        with open(path, "rb") as f:
+            resolver = pickle.load(f)
+        resolver.coverage = []
+        return resolver
+
+
+def fetch_id_resolver_path():
+    return "data_sources/id_resolver.pkl"
+
+
+def load_id_resolver(resolver_path=None, rebuild=False,
+                     tlv_s2i_path="data_sources/TASE mapping.csv", isin2lei_path="data_sources/ISIN_LEI.csv"):
+    """load the saved id resolver, or build it from the latest mappings and save it
+    the saved resolver is rebuilt if any of the mapping files is newer
+
+    :param resolver_path: resolver pickle path, default is fetch_id_resolver_path()
+    :param rebuild: build from the latest mappings even if a saved resolver exists
+    :param tlv_s2i_path: TLV securities mapping path
+    :param isin2lei_path: ISIN to LEI mapping path
+    :return: IdResolver
+    """
+    if resolver_path is None:
+        resolver_path = fetch_id_resolver_path()
+    # the ISIN2LEI snapshot is kept up to date on its own and referenced by path from the saved resolver
+    isin2lei = fetch_latest_isin2lei_snapshot(isin2lei_path=isin2lei_path)
+    if (not rebuild) and os.path.isfile(resolver_path):
+        stale = os.path.isfile(tlv_s2i_path) and os.path.getmtime(tlv_s2i_path) > os.path.getmtime(resolver_path)
+        if not stale:
+            resolver = IdResolver.load(resolver_path)
+            resolver.indexes[("LEI", "ISIN")] = isin2lei
+            return resolver
+    print("building id resolver from {}".format(tlv_s2i_path))
+    resolver = IdResolver(prepare_tlv_sec_num_to_issuer(fetch_latest_tlv_sec_num_to_issuer(tlv_s2i_path)), isin2lei)
+    resolver.save(resolver_path)
+    return resolver
+
+
+def add_all_id_types_to_holdings(holdings, tlv_s2i=None, isin2lei=None, resolver=None):
     """Add all id_types to holdings DataFrame, using TLV mapping and ISIN2LEI
 
     :param holdings: holdings DataFrame, with מספר ני"ע and מספר מנפיק
     :param tlv_s2i: TLV securities mapping
     :param isin2lei: ISIN to LEI mapping
+    :param resolver: IdResolver to reuse instead of building one from tlv_s2i and isin2lei
     :return: holdings Data with added id_types
     """
-    holdings = fix_id_cols(holdings)
-    holdings = add_id_by_another_id_mapping(holdings, add_id_type="ISIN", by_id_type='מספר ני"ע', mapping=tlv_s2i)
-    if 'מספר תאגיד' in tlv_s2i.columns:
-        holdings = add_id_by_another_id_mapping(holdings, add_id_type="מספר מנפיק", by_id_type="מספר תאגיד",
-                                            mapping=tlv_s2i)
-    holdings = add_id_by_another_id_mapping(holdings, add_id_type="מספר מנפיק", by_id_type='מספר ני"ע', mapping=tlv_s2i)
-    holdings = add_id_by_another_id_mapping(holdings, add_id_type="מספר מנפיק", by_id_type='ISIN', mapping=tlv_s2i)
-    holdings = add_id_by_another_id_mapping(holdings, add_id_type="LEI", by_id_type='ISIN', mapping=isin2lei)
-    return holdings
+    if resolver is None:
+        resolver = IdResolver(tlv_s2i, isin2lei)
+    return resolver.enrich(holdings)
 
 
-def load_mappings_and_add_ids_to_holdings(holdings):
+def load_mappings_and_add_ids_to_holdings(holdings, resolver=None):
     """load needed id mappings and add ids to holdings DataFrame
 
     :param holdings: Dataframe
+    :param resolver: IdResolver to reuse, default is the saved one (see load_id_resolver)
     :return: holdings with added id columns
     """
-    tlv_s2i = prepare_tlv_sec_num_to_issuer(fetch_latest_tlv_sec_num_to_issuer())
-    isin2lei = fetch_latest_isin2lei()
+    if resolver is None:
+        resolver = load_id_resolver()
     # adding "I_" to ParentCorpLegalId to avoid confusion with il_corp_num
     holdings["ParentCorpLegalId"] = "I_" + holdings["ParentCorpLegalId"]
     # enrich holdings file - fix IDs
-    holdings = add_all_id_types_to_holdings(holdings, tlv_s2i, isin2lei)
+    holdings = add_all_id_types_to_holdings(holdings, resolver=resolver)
     return holdings
 
 
@@ -4,12 +4,17 @@ import numpy as np
 import pandas as pd
 import re
 import string
+import hashlib
 from fuzzywuzzy import fuzz
 from fuzzywuzzy import process
+from fuzzywuzzy import utils
 from datetime import datetime
 from bs4 import BeautifulSoup
 import urllib.request
+import os
 from os import path, rename
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from enrich_holdings import *
 
 pd.set_option('display.max_columns', None)
@@ -23,22 +28,186 @@ def clean_ticker(s):
     return re.sub(r'[\\/%\s]+$', '', without_trailing_digits).partition('.')[0].partition(' ')[0]
 
 
+def ticker_col_clean(col):
+    """clean_ticker for a whole column, vectorized over its unique values
+
+    :param col: Series of tickers
+    :return: Series of clean tickers, same index as col
+    """
+    codes, uniques = pd.factorize(str_col(col))
+    # the shortest prefix followed by a dot or a space, or by trailing slashes, percents and whitespace and then
+    # trailing digits - the same as removing trailing digits, then trailing slashes..., then everything after a dot
+    # or a space
+    clean_uniques = pd.Series(uniques, dtype=object).str.extract(
+        r"^([^. ]*?)(?=[. ]|[\\/%\s]*[0-9]*\Z)", expand=False
+    )
+    return pd.Series(clean_uniques.to_numpy(dtype=object)[codes], index=col.index, name=col.name)
+
+
 def clean_instrument_from_ticker(df, instrument_col, ticker_col):
     # remove ticker and everything that follows from instrument name if it appears in the 3rd word or later
     # e.g. AKER BP ASA AKERBP 4 3/4 06/15/24 --> AKER BP, AIB GROUP PLC AIB 5 1/4 PERP --> AIB GROUP PLC
-    instruments = df
-    instruments["instrument_word_list"] = instruments[instrument_col].str.split()
-    instruments["ticker_first"] = instruments[ticker_col].str.split().str.get(0)
-    instruments["ticker_in_name"] = instruments.apply(
-        lambda row: row["instrument_word_list"][1:].index(row["ticker_first"]) + 1
-        if row["ticker_first"] in row["instrument_word_list"][1:]
-        else np.nan,
-        axis=1)
-    instruments["company_name_cut_ticker"] = instruments.apply(
-        lambda row: ' '.join(row["instrument_word_list"][:int(row["ticker_in_name"])]) if row["ticker_in_name"] > 1
-        else row[instrument_col],
-        axis=1)
-    return instruments.drop(["instrument_word_list", "ticker_first", "ticker_in_name"], axis=1)
+    instrument_names = df[instrument_col]
+    ticker_first = df[ticker_col].str.split().str.get(0).to_numpy(dtype=object)
+    word_lists = instrument_names.str.split().to_numpy(dtype=object)
+    # one row per instrument word, indexed by the instrument row position
+    words = pd.Series(word_lists).explode()
+    word_pos = words.groupby(level=0).cumcount()
+    is_ticker = (word_pos > 0).to_numpy() & (words.to_numpy(dtype=object) == ticker_first[words.index])
+    # first position of the ticker after the first word, cut only when it is the 3rd word or later
+    ticker_in_name = word_pos[is_ticker].groupby(level=0).min()
+    ticker_in_name = ticker_in_name[ticker_in_name > 1]
+    company_name_cut_ticker = instrument_names.to_numpy(dtype=object).copy()
+    company_name_cut_ticker[ticker_in_name.index] = [
+        ' '.join(word_list[:pos]) for word_list, pos in zip(word_lists[ticker_in_name.index], ticker_in_name)
+    ]
+    return df.assign(company_name_cut_ticker=company_name_cut_ticker)
+
+
+def fuzzy_backends():
+    """available fuzzy scoring backends: fuzzywuzzy (default, one pair at a time) and rapidfuzz (batched, optional)
+
+    :return: list of backend names
+    """
+    return ['fuzzywuzzy', 'rapidfuzz']
+
+
+def fuzzy_scorer_names():
+    """the six scorers aggregated by best_match
+
+    :return: list of scorer names
+    """
+    return ['ratio', 'partial_ratio', 'token_sort_ratio', 'token_set_ratio',
+            'partial_token_sort_ratio', 'partial_token_set_ratio']
+
+
+def fuzzy_process_for_scorer(s, scorer):
+    """process a string the way the fuzzywuzzy scorer does before comparing, so rapidfuzz compares the same strings:
+    token scorers run full_process (forcing ascii), token sort scorers sort the tokens as well
+
+    :param s: string
+    :param scorer: scorer name, see fuzzy_scorer_names()
+    :return: processed string
+    """
+    if scorer in ['ratio', 'partial_ratio']:
+        return s
+    processed = utils.full_process(s, force_ascii=True)
+    if scorer in ['token_sort_ratio', 'partial_token_sort_ratio']:
+        return " ".join(sorted(processed.split())).strip()
+    return processed
+
+
+def partial_ratio_compat(s1, s2):
+    """fuzz.partial_ratio computed with rapidfuzz: the same block-aligned windows (from the Levenshtein
+    matching blocks, as fuzzywuzzy with python-Levenshtein) scored by the rapidfuzz ratio.
+    rapidfuzz's own partial_ratio searches all alignments and may score higher
+
+    :param s1: string
+    :param s2: string
+    :return: int score 0-100
+    """
+    from rapidfuzz.distance import Levenshtein, Indel
+    if s1 == s2:
+        return 100
+    if (len(s1) == 0) or (len(s2) == 0):
+        return 0
+    shorter, longer = (s1, s2) if len(s1) <= len(s2) else (s2, s1)
+    max_ratio = 0
+    for block in Levenshtein.editops(shorter, longer).as_matching_blocks():
+        long_start = max(block.b - block.a, 0)
+        r = Indel.normalized_similarity(shorter, longer[long_start:long_start + len(shorter)])
+        if r > .995:
+            return 100
+        max_ratio = max(max_ratio, r)
+    return int(round(100 * max_ratio))
+
+
+def partial_token_set_ratio_compat(p1, p2):
+    """fuzz.partial_token_set_ratio of processed strings, with partial_ratio_compat
+
+    :param p1: string processed with full_process
+    :param p2: string processed with full_process
+    :return: int score 0-100
+    """
+    if (len(p1) == 0) or (len(p2) == 0):
+        return 0
+    tokens1 = set(p1.split())
+    tokens2 = set(p2.split())
+    sorted_sect = " ".join(sorted(tokens1 & tokens2))
+    combined_1to2 = (sorted_sect + " " + " ".join(sorted(tokens1 - tokens2))).strip()
+    combined_2to1 = (sorted_sect + " " + " ".join(sorted(tokens2 - tokens1))).strip()
+    return max(
+        partial_ratio_compat(sorted_sect, combined_1to2),
+        partial_ratio_compat(sorted_sect, combined_2to1),
+        partial_ratio_compat(combined_1to2, combined_2to1)
+    )
+
+
+def match_score_matrix(queries, choices, scorer, backend='fuzzywuzzy', workers=1):
+    """fuzzy scores of every query against every choice (many-to-many), rounded to int as fuzzywuzzy does
+
+    :param queries: list of strings
+    :param choices: list of strings
+    :param scorer: scorer name, see fuzzy_scorer_names()
+    :param backend: fuzzy scoring backend, see fuzzy_backends()
+    :param workers: rapidfuzz threads, -1 for all cores
+    :return: int ndarray of shape (len(queries), len(choices))
+    """
+    queries = [str(q) for q in queries]
+    choices = [str(c) for c in choices]
+    if (len(queries) == 0) or (len(choices) == 0):
+        return np.zeros((len(queries), len(choices)), dtype=int)
+    if backend == 'fuzzywuzzy':
+        scorer_func = getattr(fuzz, scorer)
+        return np.array([[scorer_func(q, c) for c in choices] for q in queries], dtype=int)
+    if backend != 'rapidfuzz':
+        raise ValueError("unknown fuzzy backend: {}, use one of {}".format(backend, fuzzy_backends()))
+    from rapidfuzz import fuzz as rf_fuzz, process as rf_process
+    queries_p = [fuzzy_process_for_scorer(q, scorer) for q in queries]
+    choices_p = [fuzzy_process_for_scorer(c, scorer) for c in choices]
+    # partial scorers use fuzzywuzzy's block-aligned windows, pair by pair
+    if scorer in ['partial_ratio', 'partial_token_sort_ratio']:
+        return np.array([[partial_ratio_compat(q, c) for c in choices_p] for q in queries_p], dtype=int)
+    if scorer == 'partial_token_set_ratio':
+        return np.array([[partial_token_set_ratio_compat(q, c) for c in choices_p] for q in queries_p], dtype=int)
+    # ratio of the (processed) strings, or token set computed by rapidfuzz - a batched matrix
+    rf_scorer = rf_fuzz.token_set_ratio if scorer == 'token_set_ratio' else rf_fuzz.ratio
+    scores = np.rint(rf_process.cdist(queries_p, choices_p, scorer=rf_scorer, workers=workers)).astype(int)
+    # same edge cases as fuzzywuzzy: equal strings score 100, empty strings score 0
+    queries_p = np.array(queries_p, dtype=object)
+    choices_p = np.array(choices_p, dtype=object)
+    empty = (np.array([len(q) == 0 for q in queries_p])[:, None] | np.array([len(c) == 0 for c in choices_p])[None, :])
+    if scorer == 'token_set_ratio':
+        scores[empty] = 0
+    else:
+        equal = queries_p[:, None] == choices_p[None, :]
+        scores[equal] = 100
+        scores[empty & ~equal] = 0
+    return scores
+
+
+def aggregate_match_score_matrix(queries, choices, backend='fuzzywuzzy', workers=1):
+    """the six-score aggregate of best_match (sum of the six scorers) for every query against every choice
+
+    :param queries: list of strings
+    :param choices: list of strings
+    :param backend: fuzzy scoring backend, see fuzzy_backends()
+    :param workers: rapidfuzz threads, -1 for all cores
+    :return: int ndarray of shape (len(queries), len(choices))
+    """
+    return sum(match_score_matrix(queries, choices, scorer, backend, workers) for scorer in fuzzy_scorer_names())
+
+
+def aggregate_match_scores(query, choices, backend='fuzzywuzzy', workers=1):
+    """the six-score aggregate of best_match for one query against many choices
+
+    :param query: string
+    :param choices: list of strings
+    :param backend: fuzzy scoring backend, see fuzzy_backends()
+    :param workers: rapidfuzz threads, -1 for all cores
+    :return: int ndarray of len(choices)
+    """
+    return aggregate_match_score_matrix([query], choices, backend, workers)[0]
 
 
 def company_names_match_score(row, holdings_company_col, fff_company_col, min_len=3):
@@ -50,6 +219,34 @@ def company_names_match_score(row, holdings_company_col, fff_company_col, min_le
         return fuzz.partial_ratio(holdings_company_name, fff_company_name)
 
 
+def company_names_match_scores(df, holdings_company_col, fff_company_col, min_len=3, backend='fuzzywuzzy'):
+    """company_names_match_score for all rows, the names cleaned and filtered in a single batch.
+    with the rapidfuzz backend pairs are scored by partial_ratio_compat, as the score gates the ticker matches
+
+    :param df: DataFrame with holdings_company_col and fff_company_col
+    :param holdings_company_col: holdings company name column
+    :param fff_company_col: FFF company name column
+    :param min_len: minimal name length to score
+    :param backend: fuzzy scoring backend, see fuzzy_backends()
+    :return: Series of partial_ratio scores, NaN where a name is missing or too short
+    """
+    if df.empty:
+        return pd.Series(np.nan, index=df.index)
+    if backend == 'fuzzywuzzy':
+        return df.apply(
+            lambda row: company_names_match_score(row, holdings_company_col, fff_company_col, min_len),
+            axis='columns'
+        ).astype(float)
+    holdings_names = df[holdings_company_col].astype(str).str.strip().str.lower()
+    fff_names = df[fff_company_col].astype(str).str.strip().str.lower()
+    valid = ((holdings_names != 'nan') & (fff_names != 'nan') &
+             (holdings_names.str.len() >= min_len) & (fff_names.str.len() >= min_len)).to_numpy()
+    scores = np.full(len(df), np.nan)
+    if valid.any():
+        scores[valid] = [partial_ratio_compat(h, f) for h, f in zip(holdings_names[valid], fff_names[valid])]
+    return pd.Series(scores, index=df.index)
+
+
 def get_common_words_in_company_name(holdings, fff, holdings_company_col, fff_company_col):
     # returns a list of common words, to be disregarded when matching by company names
     # print(fff[fff_company_col].str.split(expand=True).stack().value_counts().head(30))
@@ -67,20 +264,14 @@ def remove_common_words(l, common):
     return res
 
 
-def find_isin_col(df):
+def find_isin_col(df, sample_size=None):
     '''
     Automatically identify columns with ISINs
     :param df: DataFrame
+    :param sample_size: if set, score only the first sample_size non-null values of each column
     :return: isin_col: string
     '''
-    isin_pattern = r"^[A-Z]{2}([A-Z0-9]){9}[0-9]$"
-    max_isin_cnt = 0
-    for col in df:
-        isin_cnt = sum(df[col].astype(str).str.strip().str.contains(isin_pattern, na=False))
-        if isin_cnt > max_isin_cnt:
-            isin_col = col
-            max_isin_cnt = isin_cnt
-
+    isin_col, max_isin_cnt = detect_id_cols(df, ['ISIN'], sample_size, exclude_parent_corp=False)['ISIN']
     if max_isin_cnt > 0:
         print("\nHolding file ISIN col is: " + isin_col)
         print("number of ISINs: {} out of {} rows".format(max_isin_cnt, df.shape[0]))
@@ -89,22 +280,17 @@ def find_isin_col(df):
         print("\nERROR: no ISINs in holdings file")
 
 
-def find_il_corp_num_col(df):
+def find_il_corp_num_col(df, sample_size=None):
     '''
     Automatically identify columns with Israeli Corp Numbers (מספר תאגיד)
-    :param df:
-    :return:
+    :param df: DataFrame
+    :param sample_size: if set, score only the first sample_size non-null values of each column
+    :return: il_corp_num_col: string
     '''
-    pattern = r"^5([0-9]){8}$"
-    max_pattern_cnt = 0
-    for col in df:
-        # ignoring parent_corp_legal_id
-        if (col.find("parent_corp") == -1):
-            pattern_cnt = sum(df[col].astype(str).str.strip().str.contains(pattern, na=False))
-            if pattern_cnt > max_pattern_cnt:
-                max_col = col
-                max_pattern_cnt = pattern_cnt
-
+    # only parent_corp columns are disregarded here, ParentCorpLegalId is scored as any other column
+    cols = [str(col).find("parent_corp") == -1 for col in df.columns]
+    max_col, max_pattern_cnt = detect_id_cols(df if all(cols) else df.loc[:, cols], ['מספר תאגיד'], sample_size,
+                                              exclude_parent_corp=False)['מספר תאגיד']
     if max_pattern_cnt > 0:
         print("\nHolding file Israel Corp col is: " + max_col)
         print("number of Israel Corp Numbers: {} out of {} rows".format(max_pattern_cnt, df.shape[0]))
@@ -119,7 +305,7 @@ def is_tlv(df, isin_col):
 
 
 # Fossil Free Funds list functions
-def fetch_latest_fff_list():
+def fetch_latest_fff_list(fff_path="data_sources/Invest+Your+Values+company+screens.xlsx"):
     # fetch newest file from Fossil Free Funds - stopped working (asking for email), reverted to manual download
     # returns Dataframe read from excel file
     # site = "https://fossilfreefunds.org/how-it-works"
@@ -136,7 +322,7 @@ def fetch_latest_fff_list():
     # links_in_page = [link.get('href') for link in soup.findAll('a')]
     # fff_latest_company_screens_url = [l for l in links_in_page if 'Invest+Your+Values+company+screens' in l][0]
     # print("\n** Fetching latest Fossil Free Funds company screens list **")
-    fff_latest_company_screens_url = "data_sources/Invest+Your+Values+company+screens.xlsx"
+    fff_latest_company_screens_url = fff_path
     print("Using " + fff_latest_company_screens_url)
     return pd.read_excel(fff_latest_company_screens_url, sheet_name=1)
 
@@ -261,11 +447,24 @@ def prepare_holdings(holdings_path, sheet_num):
         return
     print("\n** Holdings file for classification **")
     print(holdings_path)
+    return prepare_holdings_df(holdings)
+
+
+def prepare_holdings_df(holdings, id_cols=None):
+    """prepare a holdings DataFrame for classification: strip column names, find and clean the id columns
+
+    :param holdings: holdings DataFrame, as read from the holdings file
+    :param id_cols: (security number column, corp number column) already found, e.g. in the first chunk of a file
+    :return: holdings, Israeli security number (or ISIN) column, Israeli corp number column (None if missing)
+    """
     holdings.columns = holdings.columns.str.strip()
-    print("columns: {}".format(holdings.columns))
-    isin_col = find_isin_col(holdings)
+    if id_cols is None:
+        print("columns: {}".format(holdings.columns))
+        isin_col = find_isin_col(holdings)
+        il_corp_col = find_il_corp_num_col(holdings)
+    else:
+        isin_col, il_corp_col = id_cols
     holdings[isin_col] = id_col_clean(holdings[isin_col])
-    il_corp_col = find_il_corp_num_col(holdings)
     if il_corp_col:
         holdings[il_corp_col] = id_col_clean(holdings[il_corp_col])
     return holdings, isin_col, il_corp_col
@@ -283,6 +482,29 @@ def choose_best_issuer_num(row):
             return row["מספר מנפיק_x"]
 
 
+def choose_best_issuer_num_col(df):
+    """choose_best_issuer_num for all rows, vectorized
+
+    :param df: DataFrame with "מספר מנפיק" (clean, from the mapping) and "מספר מנפיק_x" (original) columns
+    :return: Series of the chosen issuer numbers
+    """
+    def falsy(col):
+        # same truth test as choose_best_issuer_num (None, '' or 0 - NaN is truthy)
+        return np.equal(col.to_numpy(dtype=object), None) | col.isin(['', 0]).to_numpy()
+
+    new_issuer = df["מספר מנפיק"]
+    orig_issuer = df["מספר מנפיק_x"]
+    new_len = str_col(new_issuer).str.len().to_numpy()
+    orig_len = str_col(orig_issuer).str.len().to_numpy()
+    # the shorter issuer number is the more accurate one
+    choose_new = ~falsy(new_issuer) & (falsy(orig_issuer) | ((new_len < orig_len) & (new_len > 0)))
+    return pd.Series(
+        np.where(choose_new, new_issuer.to_numpy(dtype=object), orig_issuer.to_numpy(dtype=object)),
+        index=df.index,
+        dtype=object
+    )
+
+
 def add_tlv_issuer_by_col(df, mapping, holdings_join_col, mapping_join_col):
     mapping = mapping.groupby(mapping_join_col).first()
     df_with_issuer = pd.merge(left=df,
@@ -296,7 +518,7 @@ def add_tlv_issuer_by_col(df, mapping, holdings_join_col, mapping_join_col):
         # choose the more accurate issuer number
         df_with_issuer.rename({"מספר מנפיק_y": "מספר מנפיק"}, axis=1, inplace=True)
         df_with_issuer["מספר מנפיק"] = id_col_clean(df_with_issuer["מספר מנפיק"])
-        df_with_issuer["מספר מנפיק"] = df_with_issuer.apply(choose_best_issuer_num, axis='columns')
+        df_with_issuer["מספר מנפיק"] = choose_best_issuer_num_col(df_with_issuer)
         df_with_issuer = df_with_issuer.drop(['מספר מנפיק_x'], axis=1)
     df_with_issuer["מספר מנפיק"] = id_col_clean(df_with_issuer["מספר מנפיק"])
     print("Holdings with matching issuer number after joining by {}: {} out of total holdings {}".format(
@@ -322,13 +544,13 @@ def add_tlv_issuer_by_ticker(
     df_tlv_mask = is_tlv(df, df_isin_col)
     df_tlv = df[df_tlv_mask]
     # remove trailing digits from tickers
-    df_tlv["clean_ticker"] = df_tlv[df_ticker_col].map(lambda s: clean_ticker(s))
+    df_tlv["clean_ticker"] = ticker_col_clean(df_tlv[df_ticker_col])
     # handle hebrew tickers
-    df_tlv_heb_ticker = df_tlv[df_tlv[df_ticker_col].map(lambda s: any_heb_char(s))]
+    df_tlv_heb_ticker = df_tlv[str_col(df_tlv[df_ticker_col]).str.contains(heb_char_pattern(), regex=True)]
     # focus on tickers with no issuer
     df_tlv_heb_ticker_no_issuer = df_tlv_heb_ticker[df_tlv_heb_ticker[df_issuer_col].isnull()]
     mapping_heb = mapping[[mapping_heb_ticker_col, 'מספר מנפיק']]
-    mapping_heb[mapping_heb_ticker_col] = mapping_heb[mapping_heb_ticker_col].map(lambda s: clean_ticker(s))
+    mapping_heb[mapping_heb_ticker_col] = ticker_col_clean(mapping_heb[mapping_heb_ticker_col])
     mapping_heb = mapping_heb.groupby(mapping_heb_ticker_col).first()
     merge_by_heb_ticker = pd.merge(
         df_tlv_heb_ticker_no_issuer[[df_isin_col, "clean_ticker"]],
@@ -339,7 +561,7 @@ def add_tlv_issuer_by_ticker(
     )
     # do the same for English tickers
     mapping_eng = mapping[[mapping_eng_ticker_col, 'מספר מנפיק']]
-    mapping_eng[mapping_eng_ticker_col] = mapping_eng[mapping_eng_ticker_col].map(lambda s: clean_ticker(s))
+    mapping_eng[mapping_eng_ticker_col] = ticker_col_clean(mapping_eng[mapping_eng_ticker_col])
     mapping_eng = mapping_eng.groupby(mapping_eng_ticker_col).first()
     df_tlv_no_issuer = df_tlv[df_tlv[df_issuer_col].isnull()]
     merge_by_eng_ticker = pd.merge(
@@ -387,79 +609,67 @@ def add_LEI_by_isin(df, mapping, df_isin_col):
 
 
 # Matching functions: holdings with prev, TLV list, FFF list
-def match_holdings_with_prev(holdings, prev, holdings_il_sec_num_col):
-    # 1. matching by security number
-    print("\n1. matching to previously classified by Israeli security number")
-    prev_sec_num = prev.groupby('מספר ני"ע').first()
-    holdings = pd.merge(left=holdings,
-                        right=prev_sec_num['is_fossil'],
-                        left_on=holdings_il_sec_num_col,
-                        right_index=True,
-                        how='left'
-                        )
-    holdings.rename({"is_fossil": "is_fossil_prev_il_sec_num"}, axis=1, inplace=True)
-    print("\nprevious is_fossil coverage")
-    print("Israeli security numbers previously classified: {} out of total holdings: {}".format(
-        holdings["is_fossil_prev_il_sec_num"].notnull().sum(),
-        holdings.shape[0]
-    ))
-    # 2. matching by ISIN
-    print("\n2. matching to previously classified by ISIN")
-    prev_sec_num = prev.groupby('ISIN').first()
-    holdings = pd.merge(left=holdings,
-                        right=prev_sec_num['is_fossil'],
-                        left_on="ISIN",
-                        right_index=True,
-                        how='left'
-                        )
-    holdings.rename({"is_fossil": "is_fossil_prev_ISIN"}, axis=1, inplace=True)
-    print("\nprevious is_fossil coverage")
-    print("ISINs previously classified: {} out of total holdings: {}".format(
-        holdings["is_fossil_prev_ISIN"].notnull().sum(),
-        holdings.shape[0]
-    ))
-    # 3. by issuer number
-    print("\n3. matching to previously classified by issuer number")
-    prev_issuer = prev.groupby("מספר מנפיק").first()
-    holdings = pd.merge(left=holdings,
-                        right=prev_issuer['is_fossil'],
-                        left_on="מספר מנפיק",
-                        right_index=True,
-                        how='left'
-                        )
-    holdings.rename({"is_fossil": "is_fossil_prev_issuer"}, axis=1, inplace=True)
-    print("issuers previously classified: {} out of total holdings: {}".format(
-        holdings["is_fossil_prev_issuer"].notnull().sum(),
-        holdings.shape[0]
-    ))
-    # 4. by LEI - (Legal Entity Identifier, international)
-    print("\n4. matching to previously classified by LEI")
-    prev_LEI = prev.groupby("LEI").first()
-    holdings = pd.merge(left=holdings,
-                        right=prev_LEI['is_fossil'],
-                        left_on="LEI",
-                        right_index=True,
-                        how='left'
-                        )
-    holdings.rename({"is_fossil": "is_fossil_prev_LEI"}, axis=1, inplace=True)
-    print("LEIs previously classified: {} out of total holdings: {}".format(
-        holdings["is_fossil_prev_LEI"].notnull().sum(),
-        holdings.shape[0]
-    ))
-    # 5. by Israeli Corp Number
-    print("\n5. matching to previously classified by מספר תאגיד")
-    prev_il_corp_num = prev.groupby("מספר תאגיד").first()
-    holdings = pd.merge(left=holdings,
-                        right=prev_il_corp_num['is_fossil'],
-                        left_on="מספר תאגיד",
-                        right_index=True,
-                        how='left'
-                        )
-    holdings.rename({"is_fossil": "is_fossil_prev_il_corp_num"}, axis=1, inplace=True)
-    print("Israeli Corp Nums previously classified: {} out of total holdings: {}".format(
-        holdings["is_fossil_prev_il_corp_num"].notnull().sum(),
-        holdings.shape[0]
-    ))
+def prev_class_id_types():
+    """id types for matching holdings with previously classified, with the is_fossil_prev_* column suffix
+    and the coverage message for each, in matching order
+
+    :return: dict of id type: (column suffix, coverage message)
+    """
+    return {
+        'מספר ני"ע': ("il_sec_num", "Israeli security numbers previously classified"),
+        'ISIN': ("ISIN", "ISINs previously classified"),
+        'מספר מנפיק': ("issuer", "issuers previously classified"),
+        'LEI': ("LEI", "LEIs previously classified"),
+        'מספר תאגיד': ("il_corp_num", "Israeli Corp Nums previously classified"),
+    }
+
+
+def latest_prev_classifications(prev, with_dates=False):
+    """latest is_fossil per id, for all id types in one table
+    prev is sorted by classification date desc (see prepare_prev_class), so the first non-null is_fossil per id
+    is the latest - same as prev.groupby(id_type).first()
+
+    :param prev: previously classified DataFrame, after prepare_prev_class and add_all_id_types_to_holdings
+    :param with_dates: if True, return the classification_date as well
+    :return: is_fossil Series indexed by (id_type, id), or a DataFrame with is_fossil and classification_date
+    """
+    cols = ["is_fossil", "classification_date"] if with_dates else ["is_fossil"]
+    values = prev[cols].to_numpy(dtype=object)
+    classified = prev["is_fossil"].notnull().to_numpy()
+    latest = {}
+    for id_type in prev_class_id_types():
+        by_id_type = pd.DataFrame(values, index=prev[id_type].to_numpy(), columns=cols)
+        by_id_type = by_id_type[classified & by_id_type.index.notnull()]
+        latest[id_type] = by_id_type[~by_id_type.index.duplicated()]
+    latest = pd.concat(latest, names=["id_type", "id"])
+    return latest if with_dates else latest["is_fossil"]
+
+
+def match_holdings_with_prev(holdings, prev, holdings_il_sec_num_col, latest_prev=None):
+    """add is_fossil_prev_* columns: the latest previous is_fossil by each id type
+
+    :param holdings: holdings DataFrame
+    :param prev: previously classified DataFrame, ignored if latest_prev is given
+    :param holdings_il_sec_num_col: holdings Israeli security number column
+    :param latest_prev: latest_prev_classifications(prev), computed if None
+    :return: holdings DataFrame with is_fossil_prev_* columns
+    """
+    if latest_prev is None:
+        latest_prev = latest_prev_classifications(prev)
+    holdings_cols = {'מספר ני"ע': holdings_il_sec_num_col}
+    # a lookup by index, no merge: the new columns are added to a shallow copy, holdings data is not copied
+    holdings = holdings.copy(deep=False)
+    for i, (id_type, (suffix, coverage)) in enumerate(prev_class_id_types().items()):
+        print("\n{}. matching to previously classified by {}".format(i + 1, id_type))
+        has_id_type = id_type in latest_prev.index.get_level_values("id_type")
+        latest = latest_prev.xs(id_type, level="id_type") if has_id_type else pd.Series(dtype=object)
+        col = "is_fossil_prev_" + suffix
+        holdings[col] = holdings[holdings_cols.get(id_type, id_type)].map(latest)
+        print("{}: {} out of total holdings: {}".format(
+            coverage,
+            holdings[col].notnull().sum(),
+            holdings.shape[0]
+        ))
     return holdings
 
 
@@ -501,13 +711,14 @@ def match_holdings_with_fff_by_ticker(
         holdings_ticker_col,
         holdings_company_col,
         fff_company_col="Company",
-        match_threshold=80):
+        match_threshold=80,
+        backend='fuzzywuzzy'):
     holdings_without_ticker = holdings[holdings[holdings_ticker_col].isnull()]
     print("Holdings without ticker: {}".format(holdings_without_ticker.shape[0]))
     holdings_with_ticker = holdings[holdings[holdings_ticker_col].notnull()]
     print("Holdings with ticker: {}".format(holdings_with_ticker.shape[0]))
-    holdings_with_ticker["clean_ticker"] = holdings_with_ticker[holdings_ticker_col].map(lambda s: clean_ticker(s))
-    fff["clean_ticker"] = fff["Tickers"].map(lambda s: clean_ticker(s))
+    holdings_with_ticker["clean_ticker"] = ticker_col_clean(holdings_with_ticker[holdings_ticker_col])
+    fff["clean_ticker"] = ticker_col_clean(fff["Tickers"])
     fff = fff[fff["clean_ticker"].notnull()]
     fff_one_per_ticker = fff.groupby(["clean_ticker", fff_company_col]).first().reset_index()
     fff_one_per_ticker["clean_ticker"] = id_col_clean(fff_one_per_ticker["clean_ticker"])
@@ -523,13 +734,11 @@ def match_holdings_with_fff_by_ticker(
     )
     holdings_with_fff_by_ticker.rename({fff_company_col: 'fff_company_by_ticker'}, axis=1, inplace=True)
     # adding fuzzy matching between holdings company name and fff company name to discard false positives by ticker
-    holdings_with_fff_by_ticker['ticker_company_match_score'] = holdings_with_fff_by_ticker.apply(
-        lambda row: company_names_match_score(
-            row,
-            holdings_company_col=holdings_company_col,
-            fff_company_col='fff_company_by_ticker'
-        ),
-        axis='columns'
+    holdings_with_fff_by_ticker['ticker_company_match_score'] = company_names_match_scores(
+        holdings_with_fff_by_ticker,
+        holdings_company_col=holdings_company_col,
+        fff_company_col='fff_company_by_ticker',
+        backend=backend
     )
     # take ticker matches with maximal company name match
     got_ticker_matches = holdings_with_fff_by_ticker[holdings_with_fff_by_ticker['fff_company_by_ticker'].notnull()]
@@ -540,9 +749,8 @@ def match_holdings_with_fff_by_ticker(
         got_ticker_matches.columns.drop(['fff_company_by_ticker', 'fff_fossil_any', 'ticker_company_match_score'])
     )
     holdings_with_fff_by_ticker = pd.concat([got_ticker_matches, no_ticker_matches])
-    holdings_with_fff_by_ticker["is_fossil_fff_ticker"] = holdings_with_fff_by_ticker.apply(
-        lambda row: row['fff_fossil_any'] if row['ticker_company_match_score'] > match_threshold else np.nan,
-        axis='columns'
+    holdings_with_fff_by_ticker["is_fossil_fff_ticker"] = holdings_with_fff_by_ticker['fff_fossil_any'].where(
+        holdings_with_fff_by_ticker['ticker_company_match_score'] > match_threshold
     )
     # rename columns
     holdings_with_fff_by_ticker = holdings_with_fff_by_ticker.rename({"fff_fossil_any": "fff_by_ticker_fossil"}, axis=1)
@@ -555,14 +763,86 @@ def match_holdings_with_fff_by_ticker(
     return holdings_with_fff_by_ticker
 
 
-def best_match(s, l, first_word_thresh=95):
+class CompanyNameIndex:
+    """Candidate generation for best_match: an inverted index of character n-grams of the company names,
+    processed the same way process.extract processes them (utils.full_process).
+    a first word match above best_match's first_word_thresh (95) requires a nearly exact aligned substring,
+    with an exact run of at least 5 characters unless the shorter string is matched exactly,
+    so it always shares an n-gram (n <= 5) with the name, or contains / is contained in it if shorter than n -
+    scoring only the names sharing an n-gram gives the same winners as scanning the whole list
+    """
+
+    def __init__(self, names, gram_size=4):
+        """build the index once per company list
+
+        :param names: company names, e.g. the clean Fossil Free Funds company names
+        :param gram_size: n-gram size
+        """
+        self.names = list(names)
+        self.name_set = set(self.names)
+        self.gram_size = gram_size
+        self.grams = {}
+        self.short_names = []
+        for i, name in enumerate(self.names):
+            processed = utils.full_process(str(name))
+            if len(processed) < gram_size:
+                self.short_names.append(i)
+            # index all substrings up to gram_size, so short words can be looked up as well
+            for gram in set(processed[j:j + n] for n in range(1, gram_size + 1)
+                            for j in range(len(processed) - n + 1)):
+                self.grams.setdefault(gram, []).append(i)
+
+    def candidates(self, word):
+        """get the names that may match word with a high partial_ratio, in their original order
+
+        :param word: query word
+        :return: list of candidate names
+        """
+        processed = utils.full_process(str(word))
+        if len(processed) == 0:
+            return []
+        if len(processed) < self.gram_size:
+            query_grams = [processed]
+        else:
+            query_grams = set(processed[j:j + self.gram_size] for j in range(len(processed) - self.gram_size + 1))
+        positions = set(self.short_names)
+        for gram in query_grams:
+            positions.update(self.grams.get(gram, []))
+        return [self.names[i] for i in sorted(positions)]
+
+
+# the last CompanyNameIndex built, reused while the FFF names don't change - e.g. for the chunks of a file,
+# the files of a batch or the requests of the classification service
+last_company_name_index = (None, None)
+
+
+def company_name_index(names):
+    """a CompanyNameIndex of names, reusing the last one built if the names are the same
+
+    :param names: company names
+    :return: CompanyNameIndex
+    """
+    global last_company_name_index
+    indexed_names, name_index = last_company_name_index
+    names = list(names)
+    if indexed_names != names:
+        name_index = CompanyNameIndex(names)
+        last_company_name_index = (names, name_index)
+    return name_index
+
+
+def best_match(s, l, first_word_thresh=95, name_index=None, backend='fuzzywuzzy'):
     s = str(s)
     # if there's a perfect match, it's the winner
-    if s in l:
+    if s in (l if name_index is None else name_index.name_set):
         return s, 100
     # start with matching the first word (most indicative)
     if len(s) > 0:
-        first_word_matches = process.extract(s.split()[0], l, scorer=fuzz.partial_ratio, limit=10)
+        # with an index, score only the candidates sharing an n-gram with the first word
+        choices = l if name_index is None else name_index.candidates(s.split()[0])
+        if backend != 'fuzzywuzzy':
+            return best_match_batched(s, choices, first_word_thresh, backend)
+        first_word_matches = process.extract(s.split()[0], choices, scorer=fuzz.partial_ratio, limit=10)
     else:
         return '', 0
     # go over candidates with good first word match, get fuzzy match score for each and choose winner
@@ -586,6 +866,159 @@ def best_match(s, l, first_word_thresh=95):
     return winner, final_score
 
 
+def best_match_batched(s, choices, first_word_thresh=95, backend='rapidfuzz'):
+    """best_match scoring with batched one-to-many scores: the first word against all choices,
+    then the six-score aggregate against the top 10 first word matches
+
+    :param s: company name
+    :param choices: candidate company names
+    :param first_word_thresh: first word threshold
+    :param backend: fuzzy scoring backend, see fuzzy_backends()
+    :return: winner, score (0-100)
+    """
+    choices = list(choices)
+    if len(choices) == 0:
+        return '', 0
+    from rapidfuzz import fuzz as rf_fuzz, process as rf_process
+    # same as process.extract: full_process both sides, top 10 by score, ties kept in choices order
+    first_word = utils.full_process(s.split()[0])
+    processed_choices = [utils.full_process(str(c)) for c in choices]
+    # rapidfuzz's optimal partial_ratio is never below fuzzywuzzy's - only the choices above the threshold
+    # by it may pass the threshold, score just those the fuzzywuzzy way. it only prefilters, the first word
+    # scores and the aggregate are fuzzywuzzy's (see check_fuzzy_backend_parity)
+    upper_bound = np.rint(rf_process.cdist([first_word], processed_choices, scorer=rf_fuzz.partial_ratio)[0])
+    first_word_scores = np.zeros(len(choices), dtype=int)
+    for i in np.flatnonzero(upper_bound > first_word_thresh):
+        first_word_scores[i] = partial_ratio_compat(first_word, processed_choices[i])
+    top = np.argsort(-first_word_scores, kind='stable')[:10]
+    top = [i for i in top if first_word_scores[i] > first_word_thresh]
+    if len(top) == 0:
+        return '', 0
+    top_choices = [choices[i] for i in top]
+    agg_scores = aggregate_match_scores(s, top_choices, backend)
+    # first choice with the max aggregate score wins, as long as it is above 0
+    best = int(np.argmax(agg_scores))
+    if agg_scores[best] <= 0:
+        return '', 0
+    return top_choices[best], agg_scores[best] / 6
+
+
+def fff_names_version(fff_company_names, first_word_thresh=95, backend='fuzzywuzzy'):
+    """a version id of the FFF company names list for the match cache - any change in the names,
+    their order (which breaks best_match ties), the threshold or the fuzzy backend gives a new version
+
+    :param fff_company_names: FFF clean company names, as passed to best_match
+    :param first_word_thresh: best_match first word threshold
+    :param backend: fuzzy scoring backend, see fuzzy_backends()
+    :return: version string
+    """
+    h = hashlib.sha256(str(first_word_thresh).encode("utf-8"))
+    if backend != 'fuzzywuzzy':
+        h.update(backend.encode("utf-8"))
+    for name in fff_company_names:
+        h.update(b"\n" + str(name).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def fff_match_cache_columns():
+    return ['company_clean', 'fff_version', 'fff_by_name', 'company_name_match_score']
+
+
+def read_fff_match_cache(match_cache_path, fff_version):
+    """read cached best_match results for a FFF names version
+
+    :param match_cache_path: match cache csv path
+    :param fff_version: FFF names version, see fff_names_version
+    :return: dict of {company_clean: (fff_by_name, company_name_match_score)}
+    """
+    if not path.isfile(match_cache_path):
+        return {}
+    cache = pd.read_csv(match_cache_path, dtype={'company_clean': str, 'fff_version': str, 'fff_by_name': str},
+                        keep_default_na=False, float_precision='round_trip')
+    cache = cache[cache['fff_version'] == fff_version].drop_duplicates('company_clean', keep='last')
+    # scores are read as text if the file has a stray row (e.g. a second header)
+    cache['company_name_match_score'] = pd.to_numeric(cache['company_name_match_score'], errors='coerce')
+    return dict(zip(cache['company_clean'], zip(cache['fff_by_name'], cache['company_name_match_score'])))
+
+
+def append_fff_match_cache(matches, match_cache_path, fff_version, create=False):
+    """append new best_match results to the match cache
+
+    :param matches: dict of {company_clean: (fff_by_name, company_name_match_score)}
+    :param match_cache_path: match cache csv path
+    :param fff_version: FFF names version, see fff_names_version
+    :param create: write the header even if there are no matches, when the cache doesn't exist yet
+    :return: None
+    """
+    if len(matches) == 0 and not create:
+        return
+    new_rows = pd.DataFrame(
+        [(c, fff_version, m[0], m[1]) for c, m in matches.items()],
+        columns=fff_match_cache_columns()
+    )
+    cache_dir = path.dirname(match_cache_path)
+    if cache_dir:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    # one write to a file opened for appending, so rows appended by parallel classify_holdings_batch workers
+    # don't interleave
+    rows = new_rows.to_csv(header=not path.isfile(match_cache_path), index=False)
+    with open(match_cache_path, 'a', encoding='utf-8', newline='') as f:
+        f.write(rows)
+
+
+# the FFF names and their index in a best_matches worker process, set once by init_best_match_worker
+worker_fff_company_names = None
+worker_name_index = None
+worker_backend = 'fuzzywuzzy'
+
+
+def init_best_match_worker(fff_company_names, backend='fuzzywuzzy'):
+    global worker_fff_company_names, worker_name_index, worker_backend
+    worker_fff_company_names = fff_company_names
+    worker_name_index = CompanyNameIndex(fff_company_names)
+    worker_backend = backend
+
+
+def best_match_worker(names):
+    return [best_match(c, worker_fff_company_names, name_index=worker_name_index, backend=worker_backend)
+            for c in names]
+
+
+def best_matches(names, fff_company_names, max_workers=1, match_cache_path=None, chunk_size=200,
+                 backend='fuzzywuzzy'):
+    """best_match for each name, optionally split across worker processes and cached on disk
+
+    :param names: unique clean holding company names
+    :param fff_company_names: FFF clean company names
+    :param max_workers: number of worker processes, 1 runs in the current process
+    :param match_cache_path: match cache csv path - cached names are not scored again for the same FFF names
+    version, None disables the cache
+    :param chunk_size: number of names per worker task
+    :param backend: fuzzy scoring backend, see fuzzy_backends()
+    :return: dict of {name: (fff_by_name, company_name_match_score)}, in names order
+    """
+    cached = {}
+    if match_cache_path is not None:
+        fff_version = fff_names_version(fff_company_names, backend=backend)
+        cached = read_fff_match_cache(match_cache_path, fff_version)
+    to_match = [c for c in names if c not in cached]
+    print("fuzzy matching {} company names ({} cached)".format(len(to_match), len(names) - len(to_match)))
+    new_matches = {}
+    if max_workers > 1 and len(to_match) > chunk_size:
+        chunks = [to_match[i:i + chunk_size] for i in range(0, len(to_match), chunk_size)]
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_best_match_worker,
+                                 initargs=(list(fff_company_names), backend)) as executor:
+            for chunk, chunk_matches in zip(chunks, executor.map(best_match_worker, chunks)):
+                new_matches.update(zip(chunk, chunk_matches))
+    elif len(to_match) > 0:
+        name_index = company_name_index(fff_company_names)
+        for c in to_match:
+            new_matches[c] = best_match(c, fff_company_names, name_index=name_index, backend=backend)
+    if match_cache_path is not None:
+        append_fff_match_cache(new_matches, match_cache_path, fff_version)
+    return {c: new_matches[c] if c in new_matches else cached[c] for c in names}
+
+
 def match_holdings_with_fff_by_company_name(
         holdings,
         fff,
@@ -593,11 +1026,14 @@ def match_holdings_with_fff_by_company_name(
         holdings_company_col,
         fff_company_col="Company",
         min_match_threshold=60,
-        is_fossil_match_threshold=90
+        is_fossil_match_threshold=90,
+        max_workers=1,
+        match_cache_path=None,
+        backend='fuzzywuzzy'
 ):
     # prepare company names for fuzzy matching
     # remove common words (LTD, Corp etc.)
-    holdings["company_clean"] = holdings[holdings_company_col].map(lambda s: clean_company(s))
+    holdings["company_clean"] = company_col_clean(holdings[holdings_company_col])
     holdings["company_clean"] = remove_common_words(holdings["company_clean"], common_words_in_company)
     # TODO: maybe use ASA, PLC, INC etc. as separator? remove everything after separator if got >= n (3?) words
     holdings_company_names = holdings["company_clean"].dropna().str.upper().str.strip().unique()
@@ -605,10 +1041,9 @@ def match_holdings_with_fff_by_company_name(
     fff["company_clean"] = fff["company_clean"].str.upper().str.strip()
     fff_company_names = fff["company_clean"].dropna().unique()
     # fuzzy matching company names
-    print("\n** fuzzy matching company names ** (this could take a few minutes)")
-    agg_matches = {}
-    for c in holdings_company_names:
-        agg_matches[c] = best_match(c, fff_company_names)
+    print("\n** fuzzy matching company names **")
+    agg_matches = best_matches(holdings_company_names, fff_company_names, max_workers=max_workers,
+                               match_cache_path=match_cache_path, backend=backend)
     agg_fuzzy_results = pd.DataFrame(agg_matches).transpose()
     agg_fuzzy_results.rename({0: 'fff_by_name', 1: 'company_name_match_score'}, axis=1, inplace=True)
     agg_fuzzy_results = agg_fuzzy_results[agg_fuzzy_results['company_name_match_score'] > min_match_threshold]
@@ -629,9 +1064,8 @@ def match_holdings_with_fff_by_company_name(
         right_index=True,
         how='left'
     )
-    holdings_with_fuzzy["is_fossil_company_name"] = holdings_with_fuzzy.apply(
-        lambda row: row['fff_fossil_any'] if row['company_name_match_score'] > is_fossil_match_threshold else np.nan,
-        axis='columns'
+    holdings_with_fuzzy["is_fossil_company_name"] = holdings_with_fuzzy['fff_fossil_any'].where(
+        holdings_with_fuzzy['company_name_match_score'] > is_fossil_match_threshold
     )
     # rename columns
     holdings_with_fuzzy = holdings_with_fuzzy.rename({'fff_fossil_any': 'fff_by_name_fossil'}, axis=1)
@@ -647,13 +1081,39 @@ def match_holdings_with_fff_by_company_name(
 
 
 # is_fossil consolidation - using multiple is_fossil_x flags to get is_fossil
+def is_fossil_flags(df):
+    """all the is_fossil flag columns as one float matrix, cast once
+
+    :param df: a holdings DataFrame with is_fossil_... columns
+    :return: list of flag columns, float ndarray of shape (rows, flag columns)
+    """
+    is_fossil_cols = [c for c in df.columns if c.startswith("is_fossil") and c != "is_fossil_conflict"]
+    return is_fossil_cols, df[is_fossil_cols].astype('float').to_numpy(dtype=float)
+
+
+def is_fossil_flags_conflict(flags):
+    """conflict between flags: True iff the mean of the non-null flags is strictly between 0 and 1
+
+    :param flags: float flags matrix, see is_fossil_flags()
+    :return: bool ndarray, a value per row
+    """
+    classified = ~np.isnan(flags)
+    n_classified = classified.sum(axis=1)
+    flags_mean = np.where(classified, flags, 0).sum(axis=1) / np.maximum(n_classified, 1)
+    return (n_classified > 0) & (flags_mean > 0) & (flags_mean < 1)
+
+
 def consolidate_is_fossil(df):
-    # produces final is_fossil flag, based on all the sub flags
-    is_fossil_cols = [c for c in df.columns if c.startswith("is_fossil")]
-    is_fossil_il_cols = [c for c in df.columns if c.startswith("is_fossil_il")]
-    # is_fossil_il gets precedence over the other flags
-    df["is_fossil"] = df[is_fossil_il_cols].astype('float').max(axis=1)
-    df["is_fossil"] = df["is_fossil"].fillna(df[is_fossil_cols].astype('float').max(axis=1))
+    # produces final is_fossil flag, based on all the sub flags, and is_fossil_conflict between them
+    # all the flags are cast to one float matrix once
+    is_fossil_cols, flags = is_fossil_flags(df)
+    is_fossil_il = np.array([c.startswith("is_fossil_il") for c in is_fossil_cols], dtype=bool)
+    # is_fossil_il gets precedence over the other flags (fmax ignores NaN, NaN if all flags are NaN)
+    is_fossil = np.fmax.reduce(flags[:, is_fossil_il], axis=1, initial=np.nan)
+    is_fossil = np.where(np.isnan(is_fossil), np.fmax.reduce(flags, axis=1, initial=np.nan), is_fossil)
+    df["is_fossil"] = is_fossil
+    # propagation only fills is_fossil where all the flags are missing, so it never changes the conflict
+    df["is_fossil_conflict"] = is_fossil_flags_conflict(flags)
     print("\n***** Final Results before propagation *****")
     print("is_fossil coverage:")
     print(df["is_fossil"].value_counts(dropna=False))
@@ -666,12 +1126,118 @@ def add_is_fossil_conflict(df):
     :param df: a holdings DataFrame with is_fossil_... columns
     :return: df with added is_fossil_conflict column
     """
-    is_fossil_cols = [c for c in df.columns if c.startswith("is_fossil")]
     # adding conflict indicator for rows with multiple fossil flags
-    df["is_fossil_conflict"] = df[is_fossil_cols].mean(axis=1).between(0, 1, inclusive=False)
+    df["is_fossil_conflict"] = is_fossil_flags_conflict(is_fossil_flags(df)[1])
     return df
 
 
+class IsFossilConflictReport:
+    """is_fossil conflicts per id, for all id types at once: ids with both is_fossil=0 and is_fossil=1 holdings
+    (0 < mean is_fossil < 1), ignoring ids at holding types where they should be ignored.
+    Holdings are reduced to distinct (id type, id, name, is_fossil) rows with a row count - enough to compute the
+    group means - so the report can be updated with only the holdings added since the last one
+    """
+
+    def __init__(self, id_types=None, name_col="שם המנפיק/שם נייר ערך"):
+        """create an empty report
+
+        :param id_types: id types to group by, default is all the id types in ignore_id_types_holding_type()
+        :param name_col: holding name column
+        """
+        self.id_types = list(ignore_id_types_holding_type()) if id_types is None else list(id_types)
+        self.name_col = name_col
+        self.groups = pd.DataFrame({
+            "group type": pd.Series(dtype=object),
+            "group": pd.Series(dtype=object),
+            "name": pd.Series(dtype=object),
+            "is_fossil": pd.Series(dtype=float),
+            "rows": pd.Series(dtype=int)
+        })
+
+    def update(self, df):
+        """add holdings to the report
+
+        :param df: holdings DataFrame with the id type columns, holding_type, is_fossil and name_col - only the
+        holdings not added before
+        :return: the conflicts table, see conflicts()
+        """
+        new_groups = []
+        for id_type in self.id_types:
+            if id_type not in df.columns:
+                continue
+            # ignore matches within ignored holding_type per id_type
+            rows = (
+                    (df[id_type].notnull()) &
+                    (~df["holding_type"].isin(ignore_id_types_holding_type().get(id_type, [])))
+            ).to_numpy()
+            new_groups.append(pd.DataFrame({
+                "group type": id_type,
+                "group": df[id_type].to_numpy()[rows],
+                "name": df[self.name_col].to_numpy()[rows],
+                "is_fossil": df["is_fossil"].to_numpy(dtype=float)[rows],
+                "rows": 1
+            }))
+        groups = pd.concat([self.groups] + new_groups, ignore_index=True)
+        self.groups = groups.groupby(
+            ["group type", "group", "name", "is_fossil"], dropna=False, sort=False
+        )["rows"].sum().reset_index()
+        return self.conflicts()
+
+    def conflicts(self):
+        """the conflicts table: a row per distinct (id type, id, clean name, is_fossil) of the conflicting ids
+
+        :return: DataFrame with group type, group, clean name and is_fossil columns, sorted by id type and id
+        """
+        groups = self.groups
+        classified = groups["is_fossil"].notnull()
+        # group mean of is_fossil over all holdings rows, from the distinct rows and their counts
+        fossil_sum = (groups["is_fossil"].fillna(0) * groups["rows"]).groupby(
+            [groups["group type"], groups["group"]], sort=False).transform('sum')
+        classified_rows = groups["rows"].where(classified, 0).groupby(
+            [groups["group type"], groups["group"]], sort=False).transform('sum')
+        is_fossil_mean = fossil_sum / classified_rows.where(classified_rows > 0)
+        conflicts = groups[(is_fossil_mean > 0) & (is_fossil_mean < 1)]
+        conflicts = conflicts.assign(**{"clean name": company_col_clean(conflicts["name"])})
+        # sort by the id type order and id, keeping the order the names were added within an id
+        conflicts = conflicts.assign(type_order=conflicts["group type"].map(
+            {id_type: i for i, id_type in enumerate(self.id_types)}))
+        conflicts = conflicts.sort_values(["type_order", "group"], kind="stable")
+        return conflicts[["group type", "group", "clean name", "is_fossil"]].drop_duplicates().reset_index(drop=True)
+
+    def save(self, path):
+        """save the report state with pickle
+
+        :param path: file path
+        :return: None
+        """
+        import pickle
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        """load a report saved with save()
+
+        :param path: file path
+        :return: IsFossilConflictReport
+        """
+        import pickle
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def find_is_fossil_conflicts(df, id_types=None):
+    """Find all is_fossil conflicts in a holdings DataFrame, for all id types at once
+
+    :param df: holdings DataFrame
+    :param id_types: id types to be grouped by while searching for conflicts, default is all
+    :return: a DataFrame of conflicts, see IsFossilConflictReport.conflicts()
+    """
+    return IsFossilConflictReport(id_types).update(df)
+
+
 def find_is_fossil_conflicts_by_id_type(df, id_type):
     """Find all is_fossil conflicts in a holdings DataFrame, grouped by id_col
 
@@ -679,20 +1245,61 @@ def find_is_fossil_conflicts_by_id_type(df, id_type):
     :param id_type: id type to be grouped by while searching for conflicts
     :return: a DataFrame of conflicts
     """
-    # ignore matches within ignored holding_type per id_type
-    df = df[~df["holding_type"].isin(ignore_id_types_holding_type()[id_type])]
-    grouped_by_id_type = df.sort_values(id_type).groupby(id_type, dropna=True)
-    fossil_ambiguous = grouped_by_id_type.filter(lambda x: 0 < x["is_fossil"].mean() < 1).reset_index()
-    if len(fossil_ambiguous) > 0:
-        fossil_ambiguous["group type"] = id_type
-        fossil_ambiguous["group"] = fossil_ambiguous[id_type]
-        fossil_ambiguous["clean name"] = fossil_ambiguous["שם המנפיק/שם נייר ערך"].apply(clean_company)
-        fossil_ambiguous = fossil_ambiguous[
-            ["group type", "group", "clean name", "is_fossil"]
-        ].drop_duplicates()
-    else:
-        fossil_ambiguous = pd.DataFrame()
-    return fossil_ambiguous
+    fossil_ambiguous = find_is_fossil_conflicts(df, [id_type])
+    return fossil_ambiguous if len(fossil_ambiguous) > 0 else pd.DataFrame()
+
+
+def propagation_ids(col):
+    """the ids is_fossil is propagated by: the values of an id column as text, so ids grouped across chunks of a
+    file (see ChunkedPropagation) and within a whole file are the same ids
+
+    :param col: id column
+    :return: 2 objects: int ndarray of the id code per row (-1 where missing), object ndarray of the distinct ids
+    """
+    codes, uniques = pd.factorize(col.to_numpy())
+    if pd.api.types.infer_dtype(uniques, skipna=False) == "string":
+        # e.g. ids cleaned by id_col_clean
+        return codes, uniques.astype(object)
+    # distinct values are converted once, values with the same text get the same code
+    id_codes, ids = pd.factorize(str_col(pd.Series(uniques, dtype=object)).to_numpy(dtype=object))
+    return np.append(id_codes, -1)[codes], ids
+
+
+def propagate_is_fossil_by_cols(df, propagate_by_cols):
+    """propagate is_fossil across same identity (ISIN, LEI, Israeli corporate number etc.), by several id columns
+    in order - each column propagates the is_fossil filled by the previous ones.
+    Within a group of the same id, missing is_fossil is filled when there's no conflict: all the classified rows
+    agree on 0 or 1 (group min equals group max)
+
+    :param df: holdings df with propagate_by_cols and "is_fossil" column to propagate
+    :param propagate_by_cols: columns to propagate by, in order
+    :return: holdings df with is_fossil filled by propagation when applicable, rows in the same order
+    """
+    # use freshly classified holdings to classify others with similar ISINs or LEIs
+    # a shallow copy: only is_fossil is replaced, the other columns are not copied
+    df = df.copy(deep=False)
+    is_fossil = df["is_fossil"].to_numpy(dtype=float, copy=True)
+    for propagate_by_col in propagate_by_cols:
+        print("\nPropagating by {}".format(propagate_by_col))
+        propagate_by_col_cond = (
+                (df[propagate_by_col].notnull()) &
+                # ignore Israeli sec num for holding types where it should be ignored
+                (~df["holding_type"].isin(ignore_id_types_holding_type().get(propagate_by_col, [])))
+        ).to_numpy()
+        print("\nis_fossil coverage before propagation by {}:".format(propagate_by_col))
+        print(pd.Series(is_fossil).value_counts(dropna=False))
+        rows = np.flatnonzero(propagate_by_col_cond)
+        codes = propagation_ids(df[propagate_by_col])[0][rows]
+        grouped = pd.Series(is_fossil[rows]).groupby(codes)
+        group_min = grouped.transform('min').to_numpy()
+        group_max = grouped.transform('max').to_numpy()
+        # propagate to missing is_fossil when there's no conflict in is_fossil within group
+        fill = np.isnan(is_fossil[rows]) & (group_min == group_max) & np.isin(group_min, [0, 1])
+        is_fossil[rows[fill]] = group_min[fill]
+        print("\nis_fossil coverage after propagation by {}:".format(propagate_by_col))
+        print(pd.Series(is_fossil).value_counts(dropna=False))
+    df["is_fossil"] = is_fossil
+    return df
 
 
 def propagate_is_fossil(df, propagate_by_col):
@@ -702,34 +1309,7 @@ def propagate_is_fossil(df, propagate_by_col):
     :param propagate_by_col: column to propagate by
     :return: holdings df with is_fossil filled by propagation when applicable
     """
-    # use freshly classified holdings to classify others with similar ISINs or LEIs
-    print("\nPropagating by {}".format(propagate_by_col))
-    df = df.reset_index(drop=True)
-    propagate_by_col_cond = (
-            (df[propagate_by_col].notnull()) &
-            # ignore Israeli sec num for holding types where it should be ignored
-            (~df["holding_type"].isin(ignore_id_types_holding_type()[propagate_by_col]))
-    )
-    prop_col_not_null = df[propagate_by_col_cond]
-    prop_col_null = df[~propagate_by_col_cond]
-    grouped_by_prop_col = prop_col_not_null.sort_values(propagate_by_col).groupby(propagate_by_col)
-    # HAVING different is_fossil values, including nulls
-    # fossil_partially_missing = grouped_by_prop_col.filter(lambda x: x["is_fossil"].nunique(dropna=False) > 1)
-    # if len(fossil_partially_missing) >0:
-    #     print("\nHAVING different is_fossil values within group, including nulls (partially missing classification)")
-    #     print(grouped_by_prop_col.filter(lambda x: x["is_fossil"].nunique(dropna=False) > 1))
-
-    # deal with holdings HAVING both is_fossil=0 and is_fossil=1 values for the same group
-    # # TODO: Warning - multiple is_fossil values for the same entity
-    # propagate mean to missing is_fossil when there's no conflict in is_fossil within group
-    prop_col_not_null['is_fossil'] = grouped_by_prop_col['is_fossil'].transform(
-        lambda x: x.fillna(x.mean()) if x.mean() in [0, 1] else x)
-    result = pd.concat([prop_col_not_null, prop_col_null])
-    print("\nis_fossil coverage before propagation by {}:".format(propagate_by_col))
-    print(df["is_fossil"].value_counts(dropna=False))
-    print("\nis_fossil coverage after propagation by {}:".format(propagate_by_col))
-    print(result["is_fossil"].value_counts(dropna=False))
-    return result
+    return propagate_is_fossil_by_cols(df, [propagate_by_col])
 
 
 # TODO: upload csv to Google Drive or other repository
@@ -738,55 +1318,118 @@ def output(df, output_path):
     print("\nWriting results to {}".format(output_path))
 
 
-def classify_holdings(
-        holdings_path="data/holdings_for_classification/missing_cls.csv",
+def prepare_reference_data(tlv_s2i, isin2lei, tlv, prev_class=None, latest_prev=None, fff_all=None,
+                           prev_class_log=None):
+    """prepare the reference data holdings are classified by - once for any number of holdings files
+
+    :param tlv_s2i: TLV security number to issuer mapping, as fetched
+    :param isin2lei: ISIN to LEI mapping, either a DataFrame or an Isin2LeiSnapshot
+    :param tlv: TLV companies fossil classification, as fetched
+    :param prev_class: previously classified, as fetched - ignored if latest_prev is given
+    :param latest_prev: latest_prev_classifications, e.g. PrevClassLog.latest()
+    :param fff_all: Fossil Free Funds company list, as fetched, None skips matching with FFF
+    :param prev_class_log: PrevClassLog to take the latest previous classifications from, instead of prev_class -
+    its view is rebuilt if it was enriched with other id mappings
+    :return: dict of reference data: tlv_s2i, id_resolver, latest_prev, tlv, fff_all and fff
+    """
+    print("\n2. Preparing mapping files")
+    tlv_s2i = prepare_tlv_sec_num_to_issuer(tlv_s2i)
+    # build the id indexes once, for prev_class and all holdings files
+    id_resolver = IdResolver(tlv_s2i, isin2lei)
+    print("\n4. Preparing previously classified file")
+    if prev_class_log is not None:
+        latest_prev = prev_class_log.latest(resolver=id_resolver)
+    elif latest_prev is None:
+        prev_class = add_all_id_types_to_holdings(prepare_prev_class(prev_class), resolver=id_resolver)
+        latest_prev = latest_prev_classifications(prev_class)
+    tlv = prepare_tlv(tlv)
+    fff = None
+    if fff_all is not None:
+        # get Fossil Free Funds company list, transform to one row per ticker symbol
+        print("\n6. Preparing Fossil Free Funds company list")
+        fff = prepare_fff(fff_all)
+    return {
+        "tlv_s2i": tlv_s2i,
+        "id_resolver": id_resolver,
+        "latest_prev": latest_prev,
+        "tlv": tlv,
+        "fff_all": fff_all,
+        "fff": fff
+    }
+
+
+def load_reference_data(skip_fff=False, prev_class_log_path=None):
+    """fetch and prepare the reference data, see prepare_reference_data
+
+    :param skip_fff: don't load the Fossil Free Funds company list
+    :param prev_class_log_path: PrevClassLog path to take the latest previous classifications from,
+    None reads the whole prev_class file
+    :return: dict of reference data
+    """
+    # the latest classification per id is kept up to date in the log, no need to read the whole history
+    prev_class_log = PrevClassLog(prev_class_log_path) if prev_class_log_path else None
+    return prepare_reference_data(
+        fetch_latest_tlv_sec_num_to_issuer(),
+        fetch_latest_isin2lei_snapshot(),
+        fetch_latest_tlv_list(),
+        prev_class=None if prev_class_log else fetch_latest_prev_classified(),
+        fff_all=None if skip_fff else fetch_latest_fff_list(),
+        prev_class_log=prev_class_log
+    )
+
+
+def classify_prepared_holdings(
+        holdings,
+        holdings_il_sec_num_col,
+        reference,
         holdings_ticker_col=None,
         holdings_company_col="שם המנפיק/שם נייר ערך",
-        sheet_num=0,
-        skip_fff = False
+        max_workers=1,
+        match_cache_path="data/fff_match_cache.csv",
+        fuzzy_backend='fuzzywuzzy',
+        propagate_by_cols=None
 ):
-    # 1. prepare holdings file for classification
-    print("\n1. Preparing holding file")
-    holdings, holdings_il_sec_num_col, holdings_il_corp_col = prepare_holdings(holdings_path, sheet_num=sheet_num)
+    """classify holdings as is_fossil by the reference data
+
+    :param holdings: holdings DataFrame, after prepare_holdings
+    :param holdings_il_sec_num_col: holdings Israeli security number column
+    :param reference: reference data, see load_reference_data - may be shared by many holdings files
+    :param holdings_ticker_col: holdings ticker column, None if there isn't one
+    :param holdings_company_col: holdings company (or instrument) name column
+    :param max_workers: number of fuzzy matching worker processes
+    :param match_cache_path: fuzzy match cache csv path, None disables the cache
+    :param fuzzy_backend: fuzzy scoring backend, see fuzzy_backends()
+    :param propagate_by_cols: id columns to propagate is_fossil by, default is security number, ISIN and LEI
+    :return: classified holdings DataFrame
+    """
     # If ticker exists, remove ticker information from instrument name
     if holdings_ticker_col:
         holdings = clean_instrument_from_ticker(holdings, holdings_company_col, holdings_ticker_col)
         holdings_company_col = "company_name_cut_ticker"
-    # 2. prepare mapping files: TLV security number to issuer & isin to LEI for international holdings
-    print("\n2. Preparing mapping files")
-    tlv_s2i = prepare_tlv_sec_num_to_issuer(fetch_latest_tlv_sec_num_to_issuer())
-    isin2lei = fetch_latest_isin2lei()
     # 3. enrich holdings file
     print("\n3. Enriching holding file")
-    holdings_enriched = add_all_id_types_to_holdings(holdings, tlv_s2i, isin2lei)
+    holdings_enriched = add_all_id_types_to_holdings(holdings, resolver=reference["id_resolver"])
     if holdings_ticker_col:
         holdings_enriched = add_tlv_issuer_by_ticker(
             holdings_enriched,
-            tlv_s2i,
+            reference["tlv_s2i"],
             df_isin_col=holdings_il_sec_num_col,
             df_issuer_col="מספר מנפיק",
             df_ticker_col=holdings_ticker_col,
             mapping_heb_ticker_col="סימול(עברית)",
             mapping_eng_ticker_col="סימול(אנגלית)"
         )
-    # 4. prepare previously classified as is_fossil
-    print("\n4. Preparing previously classified file")
-    prev_class = prepare_prev_class(fetch_latest_prev_classified())
-    prev_class = add_all_id_types_to_holdings(prev_class, tlv_s2i, isin2lei)
     # 5. match holdings with previously classified - by ISIN, issuer or LEI
     print("\n5. Matching holdings with previously classified")
     holdings_with_prev = match_holdings_with_prev(
         holdings_enriched,
-        prev_class,
-        holdings_il_sec_num_col
+        None,
+        holdings_il_sec_num_col,
+        latest_prev=reference["latest_prev"]
     )
-    tlv = prepare_tlv(fetch_latest_tlv_list())
-    holdings_with_tlv = match_holdings_with_tlv(holdings_with_prev, tlv)
-    if not skip_fff:
-        # 6. get Fossil Free Funds company list, transform to one row per ticker symbol
-        print("\n6. Preparing Fossil Free Funds company list")
-        fff_all = fetch_latest_fff_list()
-        fff = prepare_fff(fff_all)
+    holdings_with_tlv = match_holdings_with_tlv(holdings_with_prev, reference["tlv"])
+    if reference["fff"] is not None:
+        fff = reference["fff"]
         # 7. match holdings with FFF
         print("\n7. Matchinging holdings with Fossil Free Funds company list")
         # TODO: if needed, add Ticker per holding using open FIGI API (only if company name isn't enough)
@@ -796,7 +1439,8 @@ def classify_holdings(
                 holdings_with_tlv,
                 fff,
                 holdings_ticker_col=holdings_ticker_col,
-                holdings_company_col=holdings_company_col
+                holdings_company_col=holdings_company_col,
+                backend=fuzzy_backend
             )
         else:
             holdings_with_fff_by_ticker = holdings_with_tlv
@@ -805,7 +1449,7 @@ def classify_holdings(
         # prepare common words to ignore while matching
         common = get_common_words_in_company_name(
             holdings_with_fff_by_ticker,
-            fff_all,
+            reference["fff_all"],
             holdings_company_col=holdings_company_col,
             fff_company_col="Company"
         )
@@ -815,7 +1459,10 @@ def classify_holdings(
             fff,
             common_words_in_company=common,
             holdings_company_col=holdings_company_col,
-            fff_company_col="Company"
+            fff_company_col="Company",
+            max_workers=max_workers,
+            match_cache_path=match_cache_path,
+            backend=fuzzy_backend
         )
         # TODO: inner matching - consolidate to issuer based on ISIN
         # (doable in the US - without the last characters, check about the others)
@@ -827,17 +1474,744 @@ def classify_holdings(
     holdings_final = consolidate_is_fossil(holdings_before_consolidation)
     # output(holdings_final, "debug_" + output_path)
     # 9. propagate is_fossil across ISIN and LEI (fill in missing is_fossil according to existing ones within group)
-    print("\n9. Propagating is_fossil across il_sec_num, ISIN and LEI")
-    holdings_propagate_is_fossil = propagate_is_fossil(holdings_final, holdings_il_sec_num_col)
-    holdings_propagate_is_fossil = propagate_is_fossil(holdings_propagate_is_fossil, "ISIN")
-    holdings_propagate_is_fossil = propagate_is_fossil(holdings_propagate_is_fossil, "LEI")
-    holdings_propagate_is_fossil = add_is_fossil_conflict(holdings_propagate_is_fossil)
+    if propagate_by_cols is None:
+        propagate_by_cols = [holdings_il_sec_num_col, "ISIN", "LEI"]
+    print("\n9. Propagating is_fossil across {}".format(", ".join(propagate_by_cols)))
+    return propagate_is_fossil_by_cols(holdings_final, propagate_by_cols)
+
+
+def classification_output_path(holdings_path):
     # output path = input path with 'with fossil classification' added
-    output_path = ''.join(holdings_path.split('.')[:-1]) + ' with fossil classification.' + holdings_path.split('.')[-1]
-    output(holdings_propagate_is_fossil, output_path)
+    return ''.join(holdings_path.split('.')[:-1]) + ' with fossil classification.' + holdings_path.split('.')[-1]
+
+
+def classify_holdings_file(
+        holdings_path,
+        reference,
+        holdings_ticker_col=None,
+        holdings_company_col="שם המנפיק/שם נייר ערך",
+        sheet_num=0,
+        max_workers=1,
+        match_cache_path="data/fff_match_cache.csv",
+        fuzzy_backend='fuzzywuzzy',
+        propagate_by_cols=None,
+        chunk_size=None
+):
+    """classify a holdings file by already prepared reference data, output next to it
+
+    :param holdings_path: holdings file path, CSV or Excel file
+    :param reference: reference data, see load_reference_data
+    :param sheet_num: Excel sheet number
+    :param chunk_size: classify the file in chunks of this many rows, see classify_holdings_file_chunked,
+    None reads the whole file
+    other params as in classify_prepared_holdings
+    :return: output path
+    """
+    if chunk_size:
+        return classify_holdings_file_chunked(
+            holdings_path,
+            reference,
+            holdings_ticker_col=holdings_ticker_col,
+            holdings_company_col=holdings_company_col,
+            sheet_num=sheet_num,
+            chunk_size=chunk_size,
+            max_workers=max_workers,
+            match_cache_path=match_cache_path,
+            fuzzy_backend=fuzzy_backend,
+            propagate_by_cols=propagate_by_cols
+        )
+    # 1. prepare holdings file for classification
+    print("\n1. Preparing holding file")
+    holdings, holdings_il_sec_num_col, holdings_il_corp_col = prepare_holdings(holdings_path, sheet_num=sheet_num)
+    holdings_classified = classify_prepared_holdings(
+        holdings,
+        holdings_il_sec_num_col,
+        reference,
+        holdings_ticker_col=holdings_ticker_col,
+        holdings_company_col=holdings_company_col,
+        max_workers=max_workers,
+        match_cache_path=match_cache_path,
+        fuzzy_backend=fuzzy_backend,
+        propagate_by_cols=propagate_by_cols
+    )
+    output_path = classification_output_path(holdings_path)
+    output(holdings_classified, output_path)
+    return output_path
+
+
+def iter_xlsx_rows(holdings_path, sheet_num=0, chunk_size=200_000):
+    """stream the rows of an xlsx sheet in batches, cells converted like read_excel does: empty cells as "",
+    integral numbers as int. rows are padded to the header width, empty rows at the end of the sheet are dropped
+
+    :param holdings_path: xlsx file path
+    :param sheet_num: sheet number
+    :param chunk_size: number of rows per batch
+    :return: generator of (header, list of rows)
+    """
+    # openpyxl read-only mode streams the rows of the sheet
+    import openpyxl
+
+    def convert(value):
+        if value is None:
+            return ""
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        return value
+
+    workbook = openpyxl.load_workbook(holdings_path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[sheet_num]
+        sheet.reset_dimensions()
+        rows = sheet.iter_rows(values_only=True)
+        header = [convert(v) for v in next(rows, ())]
+        batch = []
+        empty_rows = []
+        for row in rows:
+            row = [convert(v) for v in row[:len(header)]]
+            row += [""] * (len(header) - len(row))
+            if all(v == "" for v in row):
+                # kept only if followed by a row with data
+                empty_rows.append(row)
+                continue
+            batch += empty_rows + [row]
+            empty_rows = []
+            if len(batch) >= chunk_size:
+                yield header, batch[:chunk_size]
+                batch = batch[chunk_size:]
+        if len(batch) > 0:
+            yield header, batch
+    finally:
+        workbook.close()
+
+
+def xlsx_chunk_frame(header, rows, dtypes=None):
+    """a DataFrame of xlsx rows, parsed like read_excel does (missing values, numbers in text cells)
+
+    :param header: header row
+    :param rows: list of rows
+    :param dtypes: dict of {column: dtype} inferred over the whole sheet, see xlsx_sheet_dtypes. None infers the
+    types of the rows only
+    :return: DataFrame
+    """
+    from pandas.io.parsers import TextParser
+    object_cols = {c: object for c, dtype in (dtypes or {}).items() if dtype == object}
+    df = TextParser([header] + rows, header=0, dtype=object_cols or None).read()
+    for c, dtype in (dtypes or {}).items():
+        if dtype != object and df[c].dtype != dtype:
+            df[c] = df[c].astype(dtype)
+    return df
+
+
+def xlsx_sheet_dtypes(holdings_path, sheet_num=0, chunk_size=200_000):
+    """the column types read_excel infers over a whole xlsx sheet, from the types inferred per batch of rows:
+    a column is numeric if it is numeric in all batches (float if any value is missing), otherwise text
+
+    :param holdings_path: xlsx file path
+    :param sheet_num: sheet number
+    :param chunk_size: number of rows per batch
+    :return: dict of {column: dtype}
+    """
+    batch_dtypes = {}
+    has_missing = {}
+    for header, rows in iter_xlsx_rows(holdings_path, sheet_num, chunk_size):
+        df = xlsx_chunk_frame(header, rows)
+        for c in df.columns:
+            if df[c].isnull().all():
+                # the type of an empty column is float whatever the column is
+                has_missing[c] = True
+                batch_dtypes.setdefault(c, set())
+            else:
+                has_missing[c] = has_missing.get(c, False) or df[c].isnull().any()
+                batch_dtypes.setdefault(c, set()).add(df[c].dtype)
+    dtypes = {}
+    for c, types in batch_dtypes.items():
+        numeric = all(pd.api.types.is_bool_dtype(t) or pd.api.types.is_numeric_dtype(t) for t in types)
+        if len(types) == 0:
+            dtypes[c] = np.dtype(float)
+        elif len(types) == 1 and not (has_missing[c] and numeric):
+            dtypes[c] = types.pop()
+        elif numeric:
+            # e.g. integers with missing values
+            dtypes[c] = np.dtype(float)
+        else:
+            dtypes[c] = np.dtype(object)
+    return dtypes
+
+
+def iter_holdings_chunks(holdings_path, sheet_num=0, chunk_size=200_000):
+    """read a holdings file in chunks of rows, read like prepare_holdings does. the rows of an xlsx sheet are
+    streamed twice: the column types read_excel would infer over the whole sheet (e.g. ids stored as text turn
+    to float when some are missing) are found first, then each chunk is read with these types
+
+    :param holdings_path: holdings file path, CSV or Excel file
+    :param sheet_num: Excel sheet number
+    :param chunk_size: number of rows per chunk
+    :return: generator of holdings DataFrames
+    """
+    if holdings_path.lower().endswith(".csv"):
+        for chunk in pd.read_csv(holdings_path, dtype=str, chunksize=chunk_size):
+            yield chunk
+    elif holdings_path.lower().endswith(".xlsx"):
+        dtypes = xlsx_sheet_dtypes(holdings_path, sheet_num, chunk_size)
+        for header, rows in iter_xlsx_rows(holdings_path, sheet_num, chunk_size):
+            yield xlsx_chunk_frame(header, rows, dtypes)
+    elif holdings_path.lower().endswith(".xls"):
+        # old Excel files can't be streamed, the sheet is read whole and classified in chunks
+        holdings = pd.read_excel(holdings_path, sheet_name=sheet_num)
+        for start in range(0, len(holdings), chunk_size):
+            yield holdings.iloc[start:start + chunk_size]
+    else:
+        raise ValueError("holdings input file isn't Excel or CSV file: {}".format(holdings_path))
+
+
+def propagation_key_sep():
+    # separates the id values of the propagation columns in a propagation key, and marks a missing id
+    return "\x1f", "\x00"
+
+
+class ChunkedPropagation:
+    """propagate_is_fossil_by_cols for a file classified in chunks, from compact aggregates only:
+    - per propagation column, the min and max is_fossil per id of the classified rows
+    - the distinct propagation keys (the ids of all propagation columns) of the rows without is_fossil
+    resolve() replays the propagation by the columns in order over the distinct keys, so a column propagates
+    the is_fossil filled by the previous ones, same as propagating the whole file at once
+    """
+
+    def __init__(self, propagate_by_cols):
+        """
+        :param propagate_by_cols: columns to propagate by, in order
+        """
+        self.propagate_by_cols = propagate_by_cols
+        # e.g. the security number column is ISIN as well
+        self.key_cols = list(dict.fromkeys(propagate_by_cols))
+        self.classified = {c: pd.DataFrame(columns=["min", "max"], dtype=float) for c in self.key_cols}
+        self.unclassified = pd.DataFrame(columns=self.key_cols + ["key"], dtype=object)
+        self.filled = None
+
+    def add(self, df):
+        """add a classified chunk to the aggregates
+
+        :param df: classified holdings chunk, with is_fossil, holding_type and propagate_by_cols
+        :return: propagation key per row, missing for rows with is_fossil or without any id to propagate by
+        """
+        is_fossil = df["is_fossil"].to_numpy(dtype=float)
+        missing = np.isnan(is_fossil)
+        sep, marker = propagation_key_sep()
+        ids = {}
+        for c in self.key_cols:
+            # the rows propagate_is_fossil_by_cols groups by this column
+            propagate = (df[c].notnull() &
+                         ~df["holding_type"].isin(ignore_id_types_holding_type().get(c, []))).to_numpy()
+            codes, distinct_ids = propagation_ids(df[c])
+            ids[c] = pd.Series(np.append(distinct_ids, None)[codes], index=df.index).where(propagate)
+            rows = propagate & ~missing
+            agg = pd.Series(is_fossil[rows]).groupby(ids[c].to_numpy()[rows]).agg(["min", "max"])
+            self.classified[c] = pd.concat([self.classified[c], agg]).groupby(level=0).agg(
+                {"min": "min", "max": "max"})
+        ids = pd.DataFrame(ids, index=df.index)
+        has_id = ids.notnull().any(axis=1).to_numpy()
+        key = pd.Series(np.nan, index=df.index, dtype=object)
+        unclassified = ids[missing & has_id]
+        if len(unclassified) > 0:
+            unclassified_key = unclassified[self.key_cols[0]].fillna(marker)
+            for c in self.key_cols[1:]:
+                unclassified_key = unclassified_key + sep + unclassified[c].fillna(marker)
+            key[missing & has_id] = unclassified_key
+            unclassified = unclassified.assign(key=unclassified_key).drop_duplicates("key")
+            self.unclassified = pd.concat([self.unclassified, unclassified], ignore_index=True).drop_duplicates(
+                "key")
+        return key
+
+    def resolve(self):
+        """propagate is_fossil by the columns in order over the aggregates
+
+        :return: Series of the is_fossil filled per propagation key
+        """
+        keys = self.unclassified
+        is_fossil = np.full(len(keys), np.nan)
+        for c in self.propagate_by_cols:
+            print("\nPropagating by {}".format(c))
+            # the group min and max include the rows filled by the previous columns
+            filled = ~np.isnan(is_fossil) & keys[c].notnull().to_numpy()
+            agg = pd.concat([
+                self.classified[c],
+                pd.Series(is_fossil[filled]).groupby(keys[c].to_numpy()[filled]).agg(["min", "max"])
+            ]).groupby(level=0).agg({"min": "min", "max": "max"})
+            group_min = keys[c].map(agg["min"]).to_numpy(dtype=float)
+            group_max = keys[c].map(agg["max"]).to_numpy(dtype=float)
+            fill = np.isnan(is_fossil) & (group_min == group_max) & np.isin(group_min, [0, 1])
+            is_fossil[fill] = group_min[fill]
+            print("filled: {} out of unclassified distinct ids: {}".format(fill.sum(), len(keys)))
+        self.filled = pd.Series(is_fossil, index=keys["key"].to_numpy()).dropna()
+        return self.filled
+
+
+def classify_holdings_file_chunked(
+        holdings_path,
+        reference,
+        holdings_ticker_col=None,
+        holdings_company_col="שם המנפיק/שם נייר ערך",
+        sheet_num=0,
+        chunk_size=200_000,
+        max_workers=1,
+        match_cache_path="data/fff_match_cache.csv",
+        fuzzy_backend='fuzzywuzzy',
+        propagate_by_cols=None
+):
+    """classify a holdings file larger than memory in two passes, output next to it like classify_holdings_file:
+    1. stream the file in chunks, classify each chunk and append it to a temporary file, collecting the
+       propagation aggregates (see ChunkedPropagation)
+    2. resolve the propagation and stream the temporary file to the output, filling the propagated is_fossil
+    memory is bounded by the chunk size and the number of distinct ids, not by the file size
+
+    :param holdings_path: holdings file path, CSV or Excel file
+    :param reference: reference data, see load_reference_data
+    :param sheet_num: Excel sheet number
+    :param chunk_size: number of rows per chunk
+    other params as in classify_prepared_holdings
+    :return: output path
+    """
+    output_path = classification_output_path(holdings_path)
+    tmp_path = output_path + ".tmp"
+    print("\n** Holdings file for classification, in chunks of {} rows **".format(chunk_size))
+    print(holdings_path)
+    id_cols = None
+    columns = None
+    propagation = None
+    n_rows = 0
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline='') as f:
+            for i, chunk in enumerate(iter_holdings_chunks(holdings_path, sheet_num=sheet_num, chunk_size=chunk_size)):
+                print("\n1. Preparing holding file chunk {} (rows {} - {})".format(
+                    i + 1, n_rows + 1, n_rows + len(chunk)))
+                # the id columns are found in the first chunk, and kept for the others
+                chunk, holdings_il_sec_num_col, holdings_il_corp_col = prepare_holdings_df(chunk, id_cols=id_cols)
+                id_cols = (holdings_il_sec_num_col, holdings_il_corp_col)
+                classified = classify_prepared_holdings(
+                    chunk,
+                    holdings_il_sec_num_col,
+                    reference,
+                    holdings_ticker_col=holdings_ticker_col,
+                    holdings_company_col=holdings_company_col,
+                    max_workers=max_workers,
+                    match_cache_path=match_cache_path,
+                    fuzzy_backend=fuzzy_backend,
+                    propagate_by_cols=[]
+                )
+                if propagation is None:
+                    if propagate_by_cols is None:
+                        propagate_by_cols = [holdings_il_sec_num_col, "ISIN", "LEI"]
+                    propagation = ChunkedPropagation(propagate_by_cols)
+                    columns = classified.columns
+                elif not classified.columns.equals(columns):
+                    # e.g. a column added by a matcher only for some chunks - all chunks are written like the first
+                    print("chunk columns differ from the first chunk: {}".format(
+                        classified.columns.symmetric_difference(columns).tolist()))
+                    classified = classified.reindex(columns=columns)
+                classified = classified.assign(propagation_key=propagation.add(classified))
+                classified.to_csv(f, header=(i == 0), index=False)
+                n_rows += len(chunk)
+        if propagation is None:
+            raise ValueError("holdings input file is empty: {}".format(holdings_path))
+        # 9. propagate is_fossil across ISIN and LEI, from the aggregates of all the chunks
+        print("\n9. Propagating is_fossil across {}".format(", ".join(propagation.propagate_by_cols)))
+        filled = propagation.resolve()
+        with open(output_path, "w", encoding="utf-8-sig", newline='') as f:
+            # the classified chunks are copied as text, only the propagated is_fossil is changed
+            for i, chunk in enumerate(pd.read_csv(tmp_path, dtype=str, keep_default_na=False, chunksize=chunk_size)):
+                fill = chunk["propagation_key"].map(filled)
+                chunk["is_fossil"] = chunk["is_fossil"].where(fill.isnull(), fill.astype(str))
+                chunk.drop("propagation_key", axis=1).to_csv(f, header=(i == 0), index=False)
+        print("\nis_fossil filled by propagation: {} distinct ids".format(len(filled)))
+        print("\nWriting results to {}".format(output_path))
+    finally:
+        if path.isfile(tmp_path):
+            os.remove(tmp_path)
+    return output_path
+
+
+def classify_holdings(
+        holdings_path="data/holdings_for_classification/missing_cls.csv",
+        holdings_ticker_col=None,
+        holdings_company_col="שם המנפיק/שם נייר ערך",
+        sheet_num=0,
+        skip_fff = False,
+        max_workers=1,
+        match_cache_path="data/fff_match_cache.csv",
+        fuzzy_backend='fuzzywuzzy',
+        prev_class_log_path=None,
+        propagate_by_cols=None,
+        chunk_size=None
+):
+    # 2., 4., 6. prepare mapping files, previously classified and FFF list
+    reference = load_reference_data(skip_fff=skip_fff, prev_class_log_path=prev_class_log_path)
+    classify_holdings_file(
+        holdings_path,
+        reference,
+        holdings_ticker_col=holdings_ticker_col,
+        holdings_company_col=holdings_company_col,
+        sheet_num=sheet_num,
+        max_workers=max_workers,
+        match_cache_path=match_cache_path,
+        fuzzy_backend=fuzzy_backend,
+        propagate_by_cols=propagate_by_cols,
+        chunk_size=chunk_size
+    )
     return
 
 
+# the reference data in a classify_holdings_batch worker process, set once by init_classify_worker
+worker_reference = None
+
+
+def init_classify_worker(reference):
+    global worker_reference
+    worker_reference = reference
+
+
+def classify_holdings_file_worker(holdings_path, classify_args):
+    return classify_holdings_file(holdings_path, worker_reference, **classify_args)
+
+
+def classify_holdings_batch(
+        holdings_paths,
+        holdings_ticker_col=None,
+        holdings_company_col="שם המנפיק/שם נייר ערך",
+        sheet_num=0,
+        skip_fff=False,
+        max_workers=1,
+        match_cache_path="data/fff_match_cache.csv",
+        fuzzy_backend='fuzzywuzzy',
+        prev_class_log_path=None,
+        propagate_by_cols=None,
+        reference=None,
+        chunk_size=None
+):
+    """classify many holdings files, loading and preparing the reference data once.
+    each file is written like classify_holdings does, next to the input file
+
+    :param holdings_paths: list of holdings file paths, all with the same ticker / company columns
+    :param max_workers: number of files classified in parallel worker processes, 1 runs in the current process
+    :param reference: already loaded reference data, see load_reference_data - loaded if None
+    other params as in classify_holdings
+    :return: dict of {holdings_path: output path}, None for files that failed
+    """
+    if reference is None:
+        reference = load_reference_data(skip_fff=skip_fff, prev_class_log_path=prev_class_log_path)
+    classify_args = {
+        "holdings_ticker_col": holdings_ticker_col,
+        "holdings_company_col": holdings_company_col,
+        "sheet_num": sheet_num,
+        "match_cache_path": match_cache_path,
+        "fuzzy_backend": fuzzy_backend,
+        "propagate_by_cols": propagate_by_cols,
+        "chunk_size": chunk_size
+    }
+    output_paths = {}
+    if max_workers > 1 and len(holdings_paths) > 1:
+        if reference["fff"] is not None and match_cache_path is not None and not path.isfile(match_cache_path):
+            # create the cache before the workers append to it, so only one header is written
+            append_fff_match_cache({}, match_cache_path, None, create=True)
+        # fuzzy matching runs in one process per file, the files are the parallel tasks
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=init_classify_worker,
+                                 initargs=(reference,)) as executor:
+            futures = {p: executor.submit(classify_holdings_file_worker, p, classify_args) for p in holdings_paths}
+            for p, future in futures.items():
+                try:
+                    output_paths[p] = future.result()
+                except Exception as e:
+                    print("failed to classify {}: {}".format(p, e))
+                    output_paths[p] = None
+    else:
+        for i, p in enumerate(holdings_paths):
+            print("\n** Classifying file {} out of {}: {} **".format(i + 1, len(holdings_paths), p))
+            try:
+                output_paths[p] = classify_holdings_file(p, reference, **classify_args)
+            except Exception as e:
+                print("failed to classify {}: {}".format(p, e))
+                output_paths[p] = None
+    print("\nclassified {} out of {} files".format(
+        sum(o is not None for o in output_paths.values()), len(holdings_paths)))
+    return output_paths
+
+
+def fetch_classification_context_path():
+    return "data_sources/classification_context.pkl"
+
+
+def reference_source_paths():
+    """default paths of the reference sources, see ClassificationContext
+
+    :return: dict of {source name: path}
+    """
+    return {
+        "tlv_s2i": "data_sources/TASE mapping.csv",
+        "isin2lei": "data_sources/ISIN_LEI.csv",
+        "tlv": "data_sources/TASE companies - fossil classification.xlsx",
+        "prev_class": "data_sources/prev_class.csv",
+        "fff": "data_sources/Invest+Your+Values+company+screens.xlsx"
+    }
+
+
+def reference_source_required_cols():
+    """columns every reference source must have, as fetched
+
+    :return: dict of {source name: list of columns}
+    """
+    return {
+        "tlv_s2i": ["ISIN"],
+        "tlv": ["מספר מנפיק", "מספר תאגיד", "רשימה שחורה"],
+        "prev_class": ['מספר ני"ע', 'ISIN', 'מספר מנפיק', 'LEI', 'מספר תאגיד', 'is_fossil', "classification_date"],
+        "fff": ["Company", "Tickers", "Fossil Free Funds: Coal screen", "Fossil Free Funds: Oil / gas screen",
+                "Fossil Free Funds: Fossil-fired utility screen"]
+    }
+
+
+def validate_reference_source(name, df):
+    """check a reference source has the columns and rows classification needs
+
+    :param name: source name, see reference_source_paths()
+    :param df: the source, as fetched
+    :return: None, raises ValueError if invalid
+    """
+    columns = df.columns.str.strip()
+    missing = [c for c in reference_source_required_cols().get(name, []) if c not in columns]
+    if name == "tlv_s2i" and not any(c in columns for c in ['מספר ני"ע', """מס' ני"ע""", "Security Number"]):
+        missing.append('מספר ני"ע')
+    if len(missing) > 0:
+        raise ValueError("reference source {} is missing columns: {}".format(name, missing))
+    if len(df) == 0 and name != "prev_class":
+        raise ValueError("reference source {} is empty".format(name))
+
+
+def files_content_hash(file_paths, chunk_size=2 ** 20):
+    """sha256 of the content of one or more files
+
+    :param file_paths: list of file paths
+    :param chunk_size: bytes read at a time
+    :return: hex digest
+    """
+    h = hashlib.sha256()
+    for file_path in file_paths:
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+class ClassificationContext:
+    """The prepared reference data (see prepare_reference_data) loaded, validated and indexed once,
+    to classify any number of in-memory holdings DataFrames with classify().
+    Records the content hash and version of every reference source, see changed_sources().
+    Picklable - saved with save() and loaded with ClassificationContext.load() without re-preparing anything.
+    Its reference can be passed to classify_holdings_batch as well
+    """
+
+    def __init__(self, source_paths=None, prev_class_log_path=None, skip_fff=False, isin2lei_snapshot_path=None):
+        """fetch, validate and prepare the reference sources
+
+        :param source_paths: dict of {source name: path} overriding reference_source_paths()
+        :param prev_class_log_path: PrevClassLog path to take the latest previous classifications from,
+        None reads the prev_class file
+        :param skip_fff: don't load the Fossil Free Funds company list
+        :param isin2lei_snapshot_path: ISIN2LEI snapshot directory, default is fetch_isin2lei_snapshot_path()
+        """
+        self.source_paths = reference_source_paths()
+        self.source_paths.update(source_paths or {})
+        self.prev_class_log_path = prev_class_log_path
+        self.skip_fff = skip_fff
+        self.isin2lei_snapshot_path = isin2lei_snapshot_path or fetch_isin2lei_snapshot_path()
+        fetched = {
+            "tlv_s2i": fetch_latest_tlv_sec_num_to_issuer(self.source_paths["tlv_s2i"]),
+            "tlv": fetch_latest_tlv_list(self.source_paths["tlv"])
+        }
+        prev_class_log = PrevClassLog(prev_class_log_path) if prev_class_log_path else None
+        if prev_class_log is None:
+            fetched["prev_class"] = fetch_latest_prev_classified(self.source_paths["prev_class"])
+        if not skip_fff:
+            fetched["fff"] = fetch_latest_fff_list(self.source_paths["fff"])
+        isin2lei = fetch_latest_isin2lei_snapshot(snapshot_path=self.isin2lei_snapshot_path,
+                                                  isin2lei_path=self.source_paths["isin2lei"])
+        if len(isin2lei) == 0:
+            raise ValueError("reference source isin2lei is empty")
+        self.sources = {}
+        for name, df in fetched.items():
+            validate_reference_source(name, df)
+            self.sources[name] = self.source_version(name, rows=len(df))
+        self.sources["isin2lei"] = self.source_version("isin2lei", rows=len(isin2lei))
+        self.reference = prepare_reference_data(
+            fetched["tlv_s2i"],
+            isin2lei,
+            fetched["tlv"],
+            prev_class=fetched.get("prev_class"),
+            fff_all=fetched.get("fff"),
+            prev_class_log=prev_class_log
+        )
+        if prev_class_log is not None:
+            # hashed after prepare_reference_data, which may rebuild the view enriched with these id mappings
+            self.sources["prev_class_log"] = self.source_version(
+                "prev_class_log", rows=len(self.reference["latest_prev"]))
+        self.version = hashlib.sha256(
+            "".join(s["sha256"] for n, s in sorted(self.sources.items())).encode("utf-8")).hexdigest()[:12]
+        self.created_at = datetime.today().strftime('%Y-%m-%d %H:%M')
+        print("\nclassification context {}:".format(self.version))
+        print(self.versions())
+
+    def source_files(self, name):
+        """the files a reference source is read from
+
+        :param name: source name
+        :return: list of file paths
+        """
+        if name == "prev_class_log":
+            # the committed segments of the log are listed in its index
+            return [os.path.join(self.prev_class_log_path, "index.csv")]
+        if name == "isin2lei" and not os.path.isfile(self.source_paths["isin2lei"]):
+            # only the snapshot is kept
+            return [os.path.join(self.isin2lei_snapshot_path, fn) for fn in ["isin.npy", "lei.npy"]]
+        return [self.source_paths[name]]
+
+    def source_version(self, name, rows=None):
+        """content hash and version of a reference source
+
+        :param name: source name
+        :param rows: number of rows read from the source
+        :return: dict of files, stat (size and modification time per file), sha256, version, modified and rows
+        """
+        files = self.source_files(name)
+        stat = [(os.path.getsize(fn), os.path.getmtime(fn)) for fn in files]
+        sha256 = files_content_hash(files)
+        return {
+            "files": files,
+            "stat": stat,
+            "sha256": sha256,
+            # the latest modification date and a short content hash
+            "version": "{}.{}".format(datetime.fromtimestamp(max(m for s, m in stat)).strftime('%Y%m%d'),
+                                      sha256[:8]),
+            "modified": datetime.fromtimestamp(max(m for s, m in stat)).strftime('%Y-%m-%d %H:%M'),
+            "rows": rows
+        }
+
+    def versions(self):
+        """the versions of the reference sources
+
+        :return: DataFrame, a row per source
+        """
+        return pd.DataFrame(self.sources).transpose()[["version", "modified", "rows", "files"]]
+
+    def changed_sources(self):
+        """the reference sources changed since the context was built.
+        files are hashed again only if their size or modification time changed
+
+        :return: list of source names
+        """
+        changed = []
+        for name, source in self.sources.items():
+            files = self.source_files(name)
+            if files != source["files"] or not all(os.path.isfile(fn) for fn in files):
+                changed.append(name)
+                continue
+            stat = [(os.path.getsize(fn), os.path.getmtime(fn)) for fn in files]
+            if stat != source["stat"] and files_content_hash(files) != source["sha256"]:
+                changed.append(name)
+        return changed
+
+    def classify(
+            self,
+            holdings,
+            holdings_ticker_col=None,
+            holdings_company_col="שם המנפיק/שם נייר ערך",
+            max_workers=1,
+            match_cache_path="data/fff_match_cache.csv",
+            fuzzy_backend='fuzzywuzzy',
+            propagate_by_cols=None
+    ):
+        """classify a holdings DataFrame, see classify_prepared_holdings
+
+        :param holdings: holdings DataFrame, as read from a holdings file - not changed
+        other params as in classify_prepared_holdings
+        :return: classified holdings DataFrame
+        """
+        import copy
+        holdings, holdings_il_sec_num_col, holdings_il_corp_col = prepare_holdings_df(holdings.copy())
+        # shallow copies of the parts changed while classifying - the resolver coverage stats and the FFF columns
+        # added by the matchers - so concurrent calls (e.g. classification_service threads) don't share them
+        reference = dict(self.reference)
+        reference["id_resolver"] = copy.copy(self.reference["id_resolver"])
+        reference["id_resolver"].coverage = []
+        if reference["fff"] is not None:
+            reference["fff"] = reference["fff"].copy(deep=False)
+        return classify_prepared_holdings(
+            holdings,
+            holdings_il_sec_num_col,
+            reference,
+            holdings_ticker_col=holdings_ticker_col,
+            holdings_company_col=holdings_company_col,
+            max_workers=max_workers,
+            match_cache_path=match_cache_path,
+            fuzzy_backend=fuzzy_backend,
+            propagate_by_cols=propagate_by_cols
+        )
+
+    def save(self, path=None):
+        """save the context with pickle. the ISIN2LEI snapshot is referenced by path
+
+        :param path: file path, default is fetch_classification_context_path()
+        :return: None
+        """
+        import pickle
+        if path is None:
+            path = fetch_classification_context_path()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file and rename, so a reader never loads a partial context
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path=None):
+        """load a context saved with save()
+
+        :param path: file path, default is fetch_classification_context_path()
+        :return: ClassificationContext
+        """
+        import pickle
+        if path is None:
+            path = fetch_classification_context_path()
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def load_classification_context(context_path=None, rebuild=False, source_paths=None, prev_class_log_path=None,
+                                skip_fff=False, isin2lei_snapshot_path=None):
+    """load the saved classification context, or build it from the reference sources and save it.
+    the saved context is rebuilt if any of its sources changed, or it was built with other settings
+
+    :param context_path: context pickle path, default is fetch_classification_context_path()
+    :param rebuild: build from the reference sources even if a saved context exists
+    other params as in ClassificationContext
+    :return: ClassificationContext
+    """
+    if context_path is None:
+        context_path = fetch_classification_context_path()
+    if (not rebuild) and os.path.isfile(context_path):
+        context = ClassificationContext.load(context_path)
+        expected_paths = reference_source_paths()
+        expected_paths.update(source_paths or {})
+        same_settings = (context.source_paths == expected_paths and
+                         context.prev_class_log_path == prev_class_log_path and context.skip_fff == skip_fff and
+                         context.isin2lei_snapshot_path == (isin2lei_snapshot_path or fetch_isin2lei_snapshot_path()))
+        changed = context.changed_sources() if same_settings else []
+        if same_settings and len(changed) == 0:
+            return context
+        print("rebuilding classification context, changed sources: {}".format(changed or "settings"))
+    context = ClassificationContext(source_paths=source_paths, prev_class_log_path=prev_class_log_path,
+                                    skip_fff=skip_fff, isin2lei_snapshot_path=isin2lei_snapshot_path)
+    context.save(context_path)
+    return context
+
+
 def add_classifications_to_prev_class(holdings_cls_path, prev_class_path):
     """Add the results of a classification to prev_cls for future matching
 
@@ -872,3 +2246,212 @@ def update_prev_class(holdings_cls_path, prev_class_path):
     rename(prev_class_path, new_filename)
     prev_class_new.to_csv(prev_class_path, index=False)
     return
+
+
+def fetch_prev_class_log_path():
+    """Returns the relative path of the prev_class log directory (see PrevClassLog)
+
+    :return: prev_class log directory path
+    """
+    return "data_sources/prev_class_log"
+
+
+def prev_class_cols():
+    """columns kept for previous classifications, see add_classifications_to_prev_class
+
+    :return: list of column names
+    """
+    return ["שם המנפיק/שם נייר ערך", 'מספר ני"ע', 'מספר מנפיק', 'ISIN', 'מספר תאגיד', 'LEI', 'is_fossil',
+            "classification_date"]
+
+
+class PrevClassLog:
+    """An append-only log of previous classifications, replacing the rewritten prev_class.csv:
+    - segments/: immutable CSV segments, one per append - a past version is the segments up to it, no backups needed
+    - index.csv: the committed segments, with their row counts and classification dates
+    - views/latest_<segment>.pkl: a materialized view of the latest is_fossil per id for every id type
+      (see latest_prev_classifications), as of the last committed segment, updated incrementally on append.
+      The segments are enriched with all id types (like prepare_reference_data does with prev_class) before the
+      view is built, and the view records the IdResolver version it was enriched with
+    """
+
+    def __init__(self, log_path=None):
+        """open the log, creating an empty one if needed
+
+        :param log_path: log directory, default is fetch_prev_class_log_path()
+        """
+        if log_path is None:
+            log_path = fetch_prev_class_log_path()
+        self.log_path = log_path
+        os.makedirs(os.path.join(log_path, "segments"), exist_ok=True)
+        os.makedirs(os.path.join(log_path, "views"), exist_ok=True)
+        index_path = os.path.join(log_path, "index.csv")
+        if os.path.exists(index_path):
+            self.index = pd.read_csv(index_path, dtype={"segment": str})
+        else:
+            self.index = pd.DataFrame(columns=["segment", "rows", "min_classification_date",
+                                               "max_classification_date", "appended_at"])
+
+    def __len__(self):
+        return int(self.index["rows"].sum())
+
+    def segment_path(self, segment):
+        return os.path.join(self.log_path, "segments", "segment_{}.csv".format(segment))
+
+    def view_path(self, segment):
+        return os.path.join(self.log_path, "views", "latest_{}.pkl".format(segment))
+
+    def last_segment(self):
+        return self.index["segment"].iloc[-1] if len(self.index) > 0 else None
+
+    def read(self, until_segment=None):
+        """read the previous classifications, like fetch_latest_prev_classified
+
+        :param until_segment: read the log as of this segment (e.g. to restore a past version), default is all
+        :return: prev_class DataFrame, newest segment first
+        """
+        segments = self.index["segment"].tolist()
+        if until_segment is not None:
+            segments = segments[:segments.index(until_segment) + 1]
+        if len(segments) == 0:
+            return pd.DataFrame(columns=prev_class_cols(), dtype=str)
+        return pd.concat([pd.read_csv(self.segment_path(s), dtype=str) for s in reversed(segments)],
+                         ignore_index=True)
+
+    def latest(self, with_dates=False, resolver=None):
+        """the latest is_fossil per id, read from the materialized view - no need to read, sort and dedup the log
+
+        :param with_dates: if True, return the classification_date as well
+        :param resolver: IdResolver the ids should be enriched with - the view is rebuilt if it was enriched with
+        another version of the id mappings. None takes the view as is, or rebuilds it with load_id_resolver()
+        :return: same as latest_prev_classifications(add_all_id_types_to_holdings(prepare_prev_class(self.read())))
+        """
+        last_segment = self.last_segment()
+        if last_segment is None:
+            latest = latest_prev_classifications(prepare_prev_class(self.read()), with_dates=True)
+        else:
+            view_path = self.view_path(last_segment)
+            latest = pd.read_pickle(view_path) if os.path.exists(view_path) else None
+            if latest is None or (
+                    resolver is not None and latest.attrs.get("resolver_version") != resolver.version()):
+                latest = self.rebuild_views(resolver)
+        return latest if with_dates else latest["is_fossil"]
+
+    def prepare_segment(self, segment, resolver):
+        """latest is_fossil per id within a segment, ids cleaned like prepare_prev_class and enriched with all
+        id types, like prepare_reference_data does with prev_class
+
+        :param segment: segment DataFrame
+        :param resolver: IdResolver to add missing id types to the segment
+        :return: latest_prev_classifications DataFrame with classification dates
+        """
+        segment = add_all_id_types_to_holdings(prepare_prev_class(segment.copy()), resolver=resolver)
+        return latest_prev_classifications(segment, with_dates=True)
+
+    def write_view(self, latest, segment, resolver_version):
+        view_path = self.view_path(segment)
+        latest.attrs["resolver_version"] = resolver_version
+        # pickled with its index, the view is derived data that can be rebuilt from the segments
+        latest.to_pickle(view_path + ".tmp")
+        os.replace(view_path + ".tmp", view_path)
+
+    def commit(self, index):
+        # the index is the commit point: segments and views of later segments are ignored until it lists them
+        index_path = os.path.join(self.log_path, "index.csv")
+        index.to_csv(index_path + ".tmp", index=False)
+        os.replace(index_path + ".tmp", index_path)
+        self.index = index
+        # views of older segments are not needed anymore, they can be rebuilt from the segments
+        for f in os.listdir(os.path.join(self.log_path, "views")):
+            if f != os.path.basename(self.view_path(self.last_segment())):
+                os.remove(os.path.join(self.log_path, "views", f))
+
+    def append(self, classifications, resolver=None):
+        """append classifications as a new immutable segment, and update the latest views incrementally:
+        only the new segment is read and merged with the current views
+
+        :param classifications: DataFrame with (at least) prev_class_cols() columns
+        :param resolver: IdResolver to add missing id types, default is load_id_resolver()
+        :return: the new segment name
+        """
+        if resolver is None:
+            resolver = load_id_resolver()
+        last_segment = self.last_segment()
+        segment = "{:06d}".format(int(last_segment) + 1 if last_segment is not None else 1)
+        segment_path = self.segment_path(segment)
+        classifications.to_csv(segment_path + ".tmp", index=False)
+        os.replace(segment_path + ".tmp", segment_path)
+        # read the segment back, the views are built from exactly what read() and rebuild_views() see
+        classifications = pd.read_csv(segment_path, dtype=str)
+        # only ids in the new segment may change: the new classification replaces the current one unless that is
+        # later (ties go to the new one, missing dates are the oldest)
+        new_latest = self.prepare_segment(classifications, resolver)
+        # the current view is rebuilt first if the id mappings changed since it was built
+        latest = self.latest(with_dates=True, resolver=resolver)
+        current_dates = latest["classification_date"].reindex(new_latest.index)
+        new_dates = new_latest["classification_date"]
+        keep_current = current_dates.notnull() & (new_dates.isnull() | (current_dates > new_dates))
+        new_latest = new_latest[~keep_current.to_numpy()]
+        latest = pd.concat([latest[~latest.index.isin(new_latest.index)], new_latest])
+        self.write_view(latest, segment, resolver.version())
+        dates = classifications["classification_date"].dropna()
+        self.commit(pd.concat([self.index, pd.DataFrame([{
+            "segment": segment,
+            "rows": len(classifications),
+            "min_classification_date": dates.min(),
+            "max_classification_date": dates.max(),
+            "appended_at": datetime.today().strftime('%Y-%m-%d %H:%M:%S')
+        }])], ignore_index=True))
+        print("Appended {} classifications to {} as segment {}, latest views: {} ids".format(
+            len(classifications), self.log_path, segment, len(latest)
+        ))
+        return segment
+
+    def rebuild_views(self, resolver=None):
+        """rebuild the latest views from all segments, e.g. after the id mappings have changed
+
+        :param resolver: IdResolver to add missing id types, default is load_id_resolver()
+        :return: the latest view, None if the log is empty
+        """
+        last_segment = self.last_segment()
+        if last_segment is None:
+            return
+        if resolver is None:
+            resolver = load_id_resolver()
+        print("Rebuilding the latest views of {}".format(self.log_path))
+        latest = pd.concat([self.prepare_segment(pd.read_csv(self.segment_path(s), dtype=str), resolver)
+                            for s in reversed(self.index["segment"].tolist())])
+        latest = latest.sort_values("classification_date", ascending=False, kind="stable")
+        latest = latest[~latest.index.duplicated()]
+        self.write_view(latest, last_segment, resolver.version())
+        return latest
+
+
+def convert_prev_class_to_log(prev_class_path="data_sources/prev_class.csv", log_path=None, resolver=None):
+    """one-time conversion of prev_class.csv to a PrevClassLog, as its first segment
+
+    :param prev_class_path: previous classifications file path, CSV file
+    :param log_path: log directory, default is fetch_prev_class_log_path()
+    :param resolver: IdResolver to add missing id types, default is load_id_resolver()
+    :return: PrevClassLog
+    """
+    prev_class_log = PrevClassLog(log_path)
+    if len(prev_class_log.index) > 0:
+        raise ValueError("prev_class log {} is not empty".format(prev_class_log.log_path))
+    prev_class_log.append(fetch_latest_prev_classified(prev_class_path), resolver=resolver)
+    return prev_class_log
+
+
+def append_classifications_to_prev_class_log(holdings_cls_path, log_path=None, resolver=None):
+    """Add the results of a classification to the prev_class log, like update_prev_class does with prev_class.csv
+    but without rewriting or backing up the previous classifications
+
+    :param holdings_cls_path: classified holdings path, CSV file
+    :param log_path: log directory, default is fetch_prev_class_log_path()
+    :param resolver: IdResolver to add missing id types, default is load_id_resolver()
+    :return: the new segment name
+    """
+    holdings_cls = pd.read_csv(holdings_cls_path, dtype=str)
+    # add today's date to new classifications
+    holdings_cls["classification_date"] = datetime.today().strftime('%Y-%m-%d %H:%M')
+    return PrevClassLog(log_path).append(holdings_cls[prev_class_cols()], resolver=resolver)
@@ -26,6 +26,37 @@ def get_major_institutions_list():
     return institutions
 
 
+def get_analysis_cols():
+    """get the holdings columns used by the analysis functions, to read only them from the holdings dataset,
+    see load_holdings
+
+    :return: a list of holdings columns
+    """
+    analysis_cols = [
+        'ReportPeriodDesc', 'SystemName', 'ParentCorpName', 'ParentCorpLegalId', 'holding_type',
+        'שם המנפיק/שם נייר ערך', 'מספר ני"ע', 'מספר מנפיק', 'מספר תאגיד', 'ISIN', 'LEI',
+        'שווי', 'שווי פוסילי', 'ערך נקוב', 'is_fossil'
+    ]
+    return analysis_cols
+
+
+def load_holdings(quarters=None, systems=None, columns=None, dataset_path=None):
+    """load holdings from the parquet dataset, reading only the partitions and columns needed for analysis
+
+    :param quarters: list of ReportPeriodDesc to load, e.g. ['2024 רבעון 3'], default is all quarters
+    :param systems: list of SystemName to load, e.g. ['גמל', 'פנסיה'], default is all systems
+    :param columns: list of columns to load, default is get_analysis_cols()
+    :param dataset_path: holdings dataset path, default is fetch_all_holdings_dataset_path()
+    :return: holdings DataFrame
+    """
+    from reports_etl import read_holdings_dataset
+    if columns is None:
+        columns = get_analysis_cols()
+    holdings = read_holdings_dataset(dataset_path, columns=columns, periods=quarters, systems=systems)
+    print("loaded {:,} holdings, quarters: {}".format(len(holdings), holdings["ReportPeriodDesc"].nunique()))
+    return holdings
+
+
 def sum_and_fossil_sum_by_group(holdings, group):
     """get sum and fossil sum for holdings by group
 
@@ -33,7 +64,7 @@ def sum_and_fossil_sum_by_group(holdings, group):
     :param group: a list of columns to group by
     :return: sum and fossil_sum by group
     """
-    sums = pd.DataFrame(holdings.groupby(group, dropna=False).agg(
+    sums = pd.DataFrame(holdings.groupby(group, dropna=False, observed=True).agg(
         {'שווי': 'sum', 'שווי פוסילי': 'sum'})
     ).reset_index()
     return sums
@@ -68,7 +99,7 @@ def get_summary(holdings, group_col, *additional_group_cols):
     # add summary of non fossils
     holdings_cls_non_fossil_types = holdings[holdings["holding_type"].isin(get_non_fossil_holding_types())]
     summary_non_fossil_types = pd.DataFrame(
-        holdings_cls_non_fossil_types.groupby(group, dropna=False).agg(
+        holdings_cls_non_fossil_types.groupby(group, dropna=False, observed=True).agg(
             {'שווי': 'sum'})
     ).reset_index()
     summary = summary.merge(summary_non_fossil_types,
@@ -155,13 +186,15 @@ def get_latest_q_ranking_agg_from_holdings(holdings):
 def group_holdings_quarters_institutions(holdings, holding_types, quarters, institutions, fossil_only=0):
     """group fossil holdings for given quarters and institutions, to reflect held companies
 
-    :param holdings: holdings DataFrame
+    :param holdings: holdings DataFrame, None loads the quarters from the holdings dataset (see load_holdings)
     :param quarters: quarters, e.g. '2020 רבעון 1'
     :param institutions: institution short name (first word)
     :param holding_types: holding types included in the grouping
     :param fossil_only - if == 1, select only is_fossil==1 holdings
     :return: fossil holdings for the given quarters and institutions, grouped to reflect held companies
     """
+    if holdings is None:
+        holdings = load_holdings(quarters=quarters)
     # filter holdings
     if "ParentCorpGroup" not in holdings.columns:
         holdings['ParentCorpGroup'] = holdings['ParentCorpName'].str.split().str[0].str.split("-").str[0]
@@ -244,7 +277,7 @@ def group_holdings_quarters_institutions(holdings, holding_types, quarters, inst
     holdings_by_issuer_agg = pd.concat([
         il_holdings_by_issuer_agg, non_il_holdings_by_issuer_agg])
     # clean holding name
-    holdings_by_issuer_agg["clean_name"] = holdings_by_issuer_agg["name"].apply(clean_company)
+    holdings_by_issuer_agg["clean_name"] = company_col_clean(holdings_by_issuer_agg["name"])
     print("after adding Israeli and non-Israeli: {}".format(holdings_by_issuer_agg["fossil_sum"].sum()))
     # group by issuer_num
     holdings_by_issue_grp = holdings_by_issuer_agg.groupby([
@@ -3,10 +3,19 @@ import numpy as np
 import urllib.request as ur
 import urllib
 import time
+import os
+import hashlib
+import json
+import random
+import threading
+import numbers
+from datetime import datetime
+from itertools import repeat
 from os import listdir
 from os.path import isfile, join, getmtime
 import re
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from enrich_holdings import *
 import requests
 
@@ -25,6 +34,15 @@ def fetch_all_holdings_path():
     return "data/downloaded reports/company reports/all_holdings.csv"
 
 
+def fetch_all_holdings_dataset_path():
+    """Returns the relative path of the all_holdings parquet dataset (directory),
+    partitioned by ReportPeriodDesc and SystemName
+
+    :return: the relative path of the all_holdings dataset
+    """
+    return "data/downloaded reports/company reports/all_holdings"
+
+
 def fetch_all_company_holdings_cls_path():
     """Returns the relative path of the all_company_holdings_cls file
 
@@ -33,13 +51,43 @@ def fetch_all_company_holdings_cls_path():
     return "data/all_company_holdings_cls"
 
 
-def get_report_data_into_data_frame(from_year, from_q, to_year, to_q, report_type, system, report_status=1, corp=None):
-    headers = {
+def cma_base_url():
+    """Returns the base url of the Capital Market Authority public reports site
+
+    :return: base url
+    """
+    return "https://employersinfocmp.cma.gov.il"
+
+
+def add_download_links(reports, base_url=None):
+    """add download links (url) to a reports DataFrame, by DocumentId
+
+    :param reports: reports DataFrame
+    :param base_url: base url of the reports site, default is cma_base_url()
+    :return: reports with url
+    """
+    if base_url is None:
+        base_url = cma_base_url()
+    download_link_prefix = base_url + "/api/PublicReporting/downloadFiles?IdDoc="
+    download_link_suffix = "&extention=XLSX"
+    reports["url"] = download_link_prefix + reports["DocumentId"].astype(str) + download_link_suffix
+    return reports
+
+
+def cma_request_headers(base_url=None):
+    """headers for the public reports API requests
+
+    :param base_url: base url of the reports site, default is cma_base_url()
+    :return: dict of headers
+    """
+    if base_url is None:
+        base_url = cma_base_url()
+    return {
         'Accept': 'application/json, text/plain, */*',
         'Accept-Language': 'en-US,en;q=0.9,he;q=0.8',
         'Connection': 'keep-alive',
-        'Origin': 'https://employersinfocmp.cma.gov.il',
-        'Referer': 'https://employersinfocmp.cma.gov.il/',
+        'Origin': base_url,
+        'Referer': base_url + '/',
         'Sec-Fetch-Dest': 'empty',
         'Sec-Fetch-Mode': 'cors',
         'Sec-Fetch-Site': 'same-origin',
@@ -50,30 +98,120 @@ def get_report_data_into_data_frame(from_year, from_q, to_year, to_q, report_typ
         'sec-ch-ua-platform': '"Android"',
     }
 
-    json_data = {
+
+def fetch_reports_query_cache_path():
+    """Returns the relative path of the public reports query cache directory
+
+    :return: the relative path of the query cache directory
+    """
+    return "data/downloaded reports/query cache"
+
+
+def report_query_quarters(from_year, from_q, to_year, to_q):
+    """all quarters in a year/quarter range, keeping the type (str or int) of the input
+
+    :param from_year: first year
+    :param from_q: first quarter of first year
+    :param to_year: last year
+    :param to_q: last quarter of last year
+    :return: a list of (year, quarter) tuples
+    """
+    year_type, q_type = type(from_year), type(from_q)
+    first, last = int(from_year) * 4 + int(from_q) - 1, int(to_year) * 4 + int(to_q) - 1
+    return [(year_type(p // 4), q_type(p % 4 + 1)) for p in range(first, last + 1)]
+
+
+def post_public_reports_query(session, json_data, base_url, cache_dir=None, ttl=24 * 60 * 60):
+    """post a public reports query, using an on-disk response cache when cache_dir is given
+
+    :param session: requests.Session
+    :param json_data: query parameters
+    :param base_url: base url of the reports site
+    :param cache_dir: query cache directory, optional
+    :param ttl: cached responses older than ttl seconds are fetched again, default=1 day
+    :return: list of reports (response json)
+    """
+    cache_fn = None
+    if cache_dir:
+        query_key = json.dumps([base_url, json_data], sort_keys=True)
+        cache_fn = join(cache_dir, hashlib.sha256(query_key.encode()).hexdigest() + ".json")
+        if isfile(cache_fn) and time.time() - getmtime(cache_fn) < ttl:
+            with open(cache_fn, encoding="utf-8") as f:
+                return json.load(f)
+    response = session.post(
+        base_url + '/api/PublicReporting/GetPublicReports',
+        headers=cma_request_headers(base_url),
+        json=json_data,
+    )
+    response.raise_for_status()
+    reports = response.json()
+    if cache_fn:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        tmp_fn = "{}.{}.tmp".format(cache_fn, threading.get_ident())
+        with open(tmp_fn, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False)
+        os.replace(tmp_fn, cache_fn)
+    return reports
+
+
+def get_report_data_into_data_frame(from_year, from_q, to_year, to_q, report_type, system, report_status=1, corp=None,
+                                    split=True, max_workers=4, cache_dir=None, ttl=24 * 60 * 60, base_url=None):
+    """get public reports metadata for a year/quarter range, report type and system(s).
+    By default the range is split into per quarter (and per system) requests, sent concurrently over one session
+
+    :param from_year: first year
+    :param from_q: first quarter of first year
+    :param to_year: last year
+    :param to_q: last quarter of last year
+    :param report_type: report type code
+    :param system: system code, or a list of system codes (one request per system)
+    :param report_status: report status code, default=1
+    :param corp: corporation, optional
+    :param split: split the range into per quarter requests, default=True
+    :param max_workers: number of concurrent requests, default=4
+    :param cache_dir: query cache directory, optional - see post_public_reports_query
+    :param ttl: query cache time to live in seconds, default=1 day
+    :param base_url: base url of the reports site, default is cma_base_url()
+    :return: DataFrame of reports, with download links
+    """
+    if base_url is None:
+        base_url = cma_base_url()
+    if split:
+        quarters = [(y, q, y, q) for y, q in report_query_quarters(from_year, from_q, to_year, to_q)]
+    else:
+        quarters = [(from_year, from_q, to_year, to_q)]
+    systems = system if isinstance(system, (list, tuple)) else [system]
+    queries = [{
         'corporation': corp,
-        'fromYear': from_year,
-        'fromQuarter': from_q,
-        'toYear': to_year,
-        'toQuarter': to_q,
+        'fromYear': fy,
+        'fromQuarter': fq,
+        'toYear': ty,
+        'toQuarter': tq,
         'reportFromDate': None,
         'reportToDate': None,
         'investmentName': None,
         'reportType': report_type,
-        'systemField': system,
+        'systemField': s,
         'statusReport': report_status,
-    }
-
-    response = requests.post(
-        'https://employersinfocmp.cma.gov.il/api/PublicReporting/GetPublicReports',
-        headers=headers,
-        json=json_data,
-    )
-    reports = pd.DataFrame.from_dict(response.json())
+    } for fy, fq, ty, tq in quarters for s in systems]
+
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        session.mount(base_url, adapter)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # map keeps the order of queries
+            responses = list(executor.map(
+                lambda json_data: post_public_reports_query(session, json_data, base_url, cache_dir, ttl), queries
+            ))
+    reports = pd.DataFrame.from_dict([r for response in responses for r in response])
+    if reports.empty:
+        print("no reports for {} q{} until {} q{}".format(from_year, from_q, to_year, to_q))
+        return reports
+    if len(queries) > 1:
+        # a report could be returned by more than one query
+        reports = reports.drop_duplicates("DocumentId", ignore_index=True)
     # add download links to response dataframe
-    download_link_prefix = "https://employersinfocmp.cma.gov.il/api/PublicReporting/downloadFiles?IdDoc="
-    download_link_suffix = "&extention=XLSX"
-    reports["url"] = download_link_prefix + reports["DocumentId"].astype(str) + download_link_suffix
+    reports = add_download_links(reports, base_url)
     print("number of reports for {} q{} until {} q{}: {}".format(from_year, from_q, to_year, to_q, reports.shape[0]))
     return reports
 
@@ -89,9 +227,7 @@ def get_reports_from_response(response_directory):
     response_path = response_directory + "response.json"
     reports = pd.read_json(response_path)
     # add download links to response dataframe
-    download_link_prefix = "https://employersinfocmp.cma.gov.il/api/PublicReporting/downloadFiles?IdDoc="
-    download_link_suffix = "&extention=XLSX"
-    reports["url"] = download_link_prefix + reports["DocumentId"].astype(str) + download_link_suffix
+    reports = add_download_links(reports)
     print("Number of reports included in response.json: {}".format(reports.shape[0]))
     return reports
 
@@ -114,30 +250,186 @@ def add_filename_to_report(row):
     return filename
 
 
-def download_reports(files_df, to_dir, sleep=6):
-    """Download reports from files_df, with a delay in between downloads
+class TokenBucket:
+    """Thread safe token bucket rate limiter - tokens are added at a fixed rate, up to capacity"""
+
+    def __init__(self, rate, capacity=1):
+        """
+        :param rate: tokens added per second
+        :param capacity: maximal number of tokens (burst size)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """wait until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def download_manifest_columns():
+    """columns of the download manifest
+
+    :return: list of column names
+    """
+    return ["filename", "url", "size", "sha256", "downloaded_at"]
+
 
-    :param files_df: a DataFrame of reports
-    :param to_dir: target directory for downloads
-    :param sleep: number of seconds to wait between downloads, default=6
-    :return:
+def read_download_manifest(manifest_fn):
+    """read the download manifest - the latest entry per filename
+
+    :param manifest_fn: manifest filename, CSV
+    :return: DataFrame of downloaded files, indexed by filename
     """
-    # download files
-    files_len = len(files_df)
-    file_num = 1
-    for index, row in files_df.iterrows():
-        print("Downloading file {} out of {}".format(file_num, files_len), end="\r")
+    if not isfile(manifest_fn):
+        return pd.DataFrame(columns=download_manifest_columns()).set_index("filename")
+    manifest = pd.read_csv(manifest_fn, dtype={"filename": str, "url": str, "sha256": str})
+    return manifest.drop_duplicates("filename", keep="last").set_index("filename")
+
+
+def is_downloaded(fn, manifest_entry):
+    """check a file on disk against its manifest entry - same size and checksum
+
+    :param fn: file path
+    :param manifest_entry: manifest row of the file
+    :return: True if the file exists with the size and checksum recorded in the manifest
+    """
+    return (
+            isfile(fn) and
+            os.path.getsize(fn) == int(manifest_entry["size"]) and
+            file_content_hash(fn) == manifest_entry["sha256"]
+    )
+
+
+def remote_file_size(url, rate_limiter, timeout=60):
+    """size of a remote file, from the Content-Length of a HEAD request
+
+    :param url: file url
+    :param rate_limiter: TokenBucket shared by all downloads
+    :param timeout: socket timeout in seconds
+    :return: size in bytes, None if unknown
+    """
+    rate_limiter.acquire()
+    try:
+        with ur.urlopen(ur.Request(url, method="HEAD"), timeout=timeout) as response:
+            size = response.headers.get("Content-Length")
+    except (urllib.error.URLError, IOError):
+        return None
+    return int(size) if size is not None else None
+
+
+def download_file(url, fn, rate_limiter, retries=3, backoff=2, timeout=60):
+    """download a single file, retrying with exponential backoff on HTTP and connection errors.
+    the file is written to a temp file first, then renamed, so partial files are never left as fn
+
+    :param url: url to download
+    :param fn: target file path
+    :param rate_limiter: TokenBucket shared by all downloads
+    :param retries: number of retries after the first attempt
+    :param backoff: backoff base in seconds, waiting backoff * 2^attempt (+ jitter) before a retry
+    :param timeout: socket timeout in seconds
+    :return: 2 objects: file size, sha256
+    """
+    tmp_fn = fn + ".part"
+    for attempt in range(retries + 1):
+        rate_limiter.acquire()
         try:
-            url = row["url"]
-            filename = to_dir + row["filename"]
-            ur.urlretrieve(url, filename)
-            time.sleep(sleep)
-        except urllib.error.HTTPError as err:
-            print("HTTP error {} when trying to download report {}".format(err.code, filename))
-            print(row["ParentCorpName"], row["SystemName"], row["Name"], sep=" | ")
-            continue
-        finally:
-            file_num += 1
+            file_hash = hashlib.sha256()
+            size = 0
+            with ur.urlopen(url, timeout=timeout) as response, open(tmp_fn, "wb") as f:
+                for block in iter(lambda: response.read(2 ** 16), b""):
+                    f.write(block)
+                    file_hash.update(block)
+                    size += len(block)
+                expected_size = response.headers.get("Content-Length")
+            if expected_size is not None and int(expected_size) != size:
+                raise IOError("got {} bytes out of {}".format(size, expected_size))
+            os.replace(tmp_fn, fn)
+            return size, file_hash.hexdigest()
+        except (urllib.error.URLError, IOError) as err:
+            # client errors (except too many requests) won't be fixed by retrying
+            client_error = isinstance(err, urllib.error.HTTPError) and 400 <= err.code < 500 and err.code != 429
+            if client_error or attempt == retries:
+                if isfile(tmp_fn):
+                    os.remove(tmp_fn)
+                raise
+            time.sleep(backoff * 2 ** attempt + random.uniform(0, backoff))
+
+
+def download_reports(files_df, to_dir, sleep=6, max_workers=4, burst=1, retries=3, backoff=2, manifest_fn=None):
+    """Download reports from files_df, concurrently and rate limited.
+    Downloaded files are recorded in a manifest (filename, size, sha256) so an interrupted run resumes -
+    files already on disk with the size and checksum in the manifest are skipped. Files on disk with no manifest
+    entry (e.g. downloaded before there was a manifest) are added to the manifest instead of downloaded again,
+    only if their size is the remote file's size (Content-Length of a HEAD request)
+
+    :param files_df: a DataFrame of reports, with url and filename
+    :param to_dir: target directory for downloads
+    :param sleep: average number of seconds between downloads (rate limit), default=6
+    :param max_workers: number of concurrent downloads, default=4
+    :param burst: number of downloads that may start at once before the rate limit applies, default=1
+    :param retries: number of retries per file on HTTP errors, default=3
+    :param backoff: retry backoff base in seconds, default=2
+    :param manifest_fn: manifest filename, default is download_manifest.csv in to_dir
+    :return: a list of (filename, error) of files that could not be downloaded
+    """
+    if manifest_fn is None:
+        manifest_fn = join(to_dir, "download_manifest.csv")
+    manifest = read_download_manifest(manifest_fn)
+    to_download = [
+        row for row in files_df.to_dict("records")
+        if not (row["filename"] in manifest.index and
+                is_downloaded(join(to_dir, row["filename"]), manifest.loc[row["filename"]]))
+    ]
+    print("Skipping {} files already downloaded".format(len(files_df) - len(to_download)))
+    rate_limiter = TokenBucket(rate=1.0 / sleep, capacity=burst)
+    manifest_lock = threading.Lock()
+    failures = []
+
+    adopted = []
+
+    def download(row):
+        fn = join(to_dir, row["filename"])
+        if row["filename"] not in manifest.index and isfile(fn) and \
+                remote_file_size(row["url"], rate_limiter) == os.path.getsize(fn):
+            size, sha256 = os.path.getsize(fn), file_content_hash(fn)
+            adopted.append(row["filename"])
+        else:
+            size, sha256 = download_file(row["url"], fn, rate_limiter, retries, backoff)
+        entry = pd.DataFrame([[row["filename"], row["url"], size, sha256, datetime.now().isoformat()]],
+                             columns=download_manifest_columns())
+        with manifest_lock:
+            entry.to_csv(manifest_fn, mode="a", header=not isfile(manifest_fn), index=False)
+
+    files_len = len(to_download)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(download, row): row for row in to_download}
+        for file_num, future in enumerate(as_completed(futures), start=1):
+            print("Downloading file {} out of {}".format(file_num, files_len), end="\r")
+            row = futures[future]
+            try:
+                future.result()
+            except Exception as err:
+                if isinstance(err, urllib.error.HTTPError):
+                    print("HTTP error {} when trying to download report {}".format(err.code, row["filename"]))
+                else:
+                    print("Error {} when trying to download report {}".format(err, row["filename"]))
+                print(row.get("ParentCorpName"), row.get("SystemName"), row.get("Name"), sep=" | ")
+                failures.append((row["filename"], "{}: {}".format(type(err).__name__, err)))
+    if len(adopted) > 0:
+        print("Added {} files already on disk to the download manifest".format(len(adopted)))
+    return failures
 
 
 def connect_to_gspreadsheets_api(json_keyfile_name):
@@ -270,8 +562,8 @@ def fix_col_name(col_name):
         return col_name
 
 
-def clean_sheet(sheet, null_pct_thresh=0.5):
-    """ remove columns and rows with > null_pct_thresh% nulls
+def trim_sheet(sheet, null_pct_thresh=0.5):
+    """ remove empty columns and rows with > null_pct_thresh% nulls, the header is kept as the first row
     Args:
       sheet (DataFrame): sheet to be handled
       null_pct_thresh (float): threshold for row null removals
@@ -282,14 +574,36 @@ def clean_sheet(sheet, null_pct_thresh=0.5):
     # drop empty columns
     sheet = sheet.dropna(axis=1, how='all')
     num_cols = len(sheet.columns)
-    sheet = sheet.dropna(axis=0, thresh=num_cols * null_pct_thresh)
+    return sheet.dropna(axis=0, thresh=num_cols * null_pct_thresh)
+
+
+def set_sheet_header(sheet):
+    """ use the first row of a (non empty) trimmed sheet as its column names, with fixed column names
+    Args:
+      sheet (DataFrame): trimmed sheet
+
+    Returns:
+      DataFrame: sheet without the header row and columns with null header
+    """
+    sheet.columns = sheet.iloc[0].str.strip().map(fix_col_name)
+    # remove first 1 row (header) and columns with null header
+    return sheet.iloc[1:, sheet.columns.notnull()]
+
+
+def clean_sheet(sheet, null_pct_thresh=0.5):
+    """ remove columns and rows with > null_pct_thresh% nulls
+    Args:
+      sheet (DataFrame): sheet to be handled
+      null_pct_thresh (float): threshold for row null removals
+
+    Returns:
+      DataFrame: sheet without empty columns and rows having > null_pct_thresh% nulls
+    """
+    sheet = trim_sheet(sheet, null_pct_thresh)
     if sheet.empty:
         return sheet
     else:
-        sheet.columns = sheet.iloc[0].str.strip().map(fix_col_name)
-        # remove first 1 row (header) and columns with null header
-        sheet = sheet.iloc[1:, sheet.columns.notnull()]
-        return sheet
+        return set_sheet_header(sheet)
 
 
 def ignore_sheets(report):
@@ -318,51 +632,412 @@ def get_filename_list(reports_path):
     return reports_fn_list
 
 
-def pre_process_reports(reports_fn_list):
+def read_report(fn):
+    """read all sheets of a report, without a header row
+
+    :param fn: report filename
+    :return: a dict of {sheet_name: DataFrame}
+    """
+    return pd.read_excel(fn, sheet_name=None, header=None)
+
+
+def parse_report(fn):
+    """parse a report into trimmed sheets and the asset allocation of its summary sheet.
+    a summary sheet the asset allocation can't be extracted from doesn't fail the report - the asset allocation
+    is empty, with the error in its attrs["error"]
+
+    :param fn: report filename
+    :return: 2 objects: dict of {sheet_name: trimmed sheet}, asset allocation DataFrame (could be empty)
+    """
+    report = read_report(fn)
+    asset_alloc = pd.DataFrame()
+    if "סכום נכסים" in report:
+        try:
+            asset_alloc = get_asset_allocation_from_summary_sheet(report["סכום נכסים"])
+        except Exception as err:
+            print("Something went wrong with the summary sheet of report: {}".format(fn))
+            asset_alloc = pd.DataFrame()
+            asset_alloc.attrs["error"] = "{}: {}".format(type(err).__name__, err)
+    sheets = {sheet_name: trim_sheet(sheet) for sheet_name, sheet in report.items()}
+    return sheets, asset_alloc
+
+
+def process_report(fn, cache_dir=None):
+    """parse a report once and extract everything needed from it: sheet names, column names,
+    asset allocation (from the summary sheet) and holdings sheets
+
+    :param fn: report filename
+    :param cache_dir: parsed reports cache directory, optional - see parse_report_cached
+    :return: a dict with report_id, sheet_names, column_names (per fixed sheet name), asset_alloc,
+             asset_alloc_error (None unless the asset allocation could not be extracted) and holdings
+    """
+    if cache_dir:
+        sheets, asset_alloc = parse_report_cached(fn, cache_dir)
+    else:
+        sheets, asset_alloc = parse_report(fn)
+    report_id = Path(fn).stem
+    # sheet names, fixed following analysis of raw results
+    sheet_names = [fix_sheet_name(k) for k in sheets.keys()]
+    if not asset_alloc.empty:
+        asset_alloc["report_id"] = report_id
+    # column names and holdings per sheet
+    column_names = {}
+    holdings = []
+    for sheet_name in ignore_sheets(sheets):
+        fixed_sheet_name = fix_sheet_name(sheet_name)
+        if fixed_sheet_name not in column_names:
+            column_names[fixed_sheet_name] = []
+        sheet = sheets[sheet_name]
+        if not sheet.empty:
+            sheet = set_sheet_header(sheet)
+        if not sheet.empty:
+            column_names[fixed_sheet_name] += [fix_col_name(c) for c in sheet.columns]
+            if (sheet_name == 'מניות') & ('מספר מנפיק' not in sheet.columns):
+                print(fn)
+                print(sheet_name)
+                print("missing שם המנפיק/שם נייר ערך in file: {}, sheet: {}".format(fn, sheet_name))
+            sheet_df = sheet
+            sheet_df["report_id"] = report_id
+            # add holding_type column
+            sheet_df["holding_type"] = fixed_sheet_name
+            holdings.append(sheet_df)
+    return {
+        "report_id": report_id,
+        "sheet_names": sheet_names,
+        "column_names": column_names,
+        "asset_alloc": asset_alloc,
+        "asset_alloc_error": asset_alloc.attrs.get("error"),
+        "holdings": holdings
+    }
+
+
+# Parsed reports cache - trimmed sheets and asset allocation per report, keyed by file content hash.
+# Column names and sheet names are fixed after reading from the cache, so changing fix_col_name,
+# fix_sheet_name or ignore_sheets doesn't require re-parsing.
+# Bump REPORT_CACHE_VERSION when trim_sheet, get_asset_allocation_from_summary_sheet or the cell encoding change.
+REPORT_CACHE_VERSION = 2
+CELL_TYPES = ["str", "bool", "int", "float", "date", "other"]
+
+
+def fetch_parsed_reports_cache_path():
+    """Returns the relative path of the parsed reports cache directory
+
+    :return: the relative path of the parsed reports cache directory
+    """
+    return "data/downloaded reports/parsed reports cache"
+
+
+def file_content_hash(fn, block_size=2 ** 20):
+    """sha256 of a file's content
+
+    :param fn: filename
+    :param block_size: read block size in bytes
+    :return: hex digest of the file's content
+    """
+    file_hash = hashlib.sha256()
+    with open(fn, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def report_cache_fn(fn, cache_dir):
+    """the cache filename of a report, by its content hash and REPORT_CACHE_VERSION
+
+    :param fn: report filename
+    :param cache_dir: parsed reports cache directory
+    :return: cache filename
+    """
+    return join(cache_dir, "{}_v{}.parquet".format(file_content_hash(fn), REPORT_CACHE_VERSION))
+
+
+def cell_type(v):
+    """type of a sheet cell, one of CELL_TYPES or None for empty cells"""
+    if isinstance(v, str):
+        return "str"
+    elif pd.isna(v):
+        return None
+    elif isinstance(v, (bool, np.bool_)):
+        return "bool"
+    elif isinstance(v, numbers.Integral):
+        return "int" if -2 ** 63 <= v < 2 ** 63 else "other"
+    elif isinstance(v, numbers.Real):
+        return "float"
+    elif isinstance(v, datetime):
+        return "date"
+    else:
+        return "other"
+
+
+def encode_cells(sheet):
+    """encode a sheet of mixed type cells into typed columns, so it can be stored in a columnar format.
+    cell at position i is stored in column "<i>_<cell type>", other types are stored as text.
+    numeric and date columns are stored as is, in column "<i>_native"
+
+    :param sheet: DataFrame with mixed type cells
+    :return: encoded DataFrame
+    """
+    encoded = pd.DataFrame(index=range(len(sheet)))
+    for i in range(sheet.shape[1]):
+        col = sheet.iloc[:, i].reset_index(drop=True)
+        if col.dtype.kind in "ifM":
+            encoded["{}_native".format(i)] = col.astype("Int64") if col.dtype.kind == "i" else col
+            continue
+        values = pd.Series(col.to_numpy(dtype=object))
+        types = values.map(cell_type)
+        for t in CELL_TYPES:
+            mask = types == t
+            if mask.any():
+                typed = values.where(mask)
+                if t in ["str", "other"]:
+                    typed = typed.map(str, na_action='ignore')
+                elif t == "bool":
+                    typed = typed.astype("boolean")
+                elif t == "int":
+                    typed = typed.astype("Int64")
+                elif t == "float":
+                    typed = typed.astype(float)
+                elif t == "date":
+                    typed = pd.to_datetime(typed)
+                encoded["{}_{}".format(i, t)] = typed
+    return encoded
+
+
+def decode_cells(encoded, columns=None):
+    """decode a sheet encoded by encode_cells
+
+    :param encoded: encoded DataFrame
+    :param columns: column names, optional - if not given, empty columns are dropped and columns are numbered
+    :return: DataFrame with mixed type cells
+    """
+    encoded = encoded.reset_index(drop=True)
+    positions = sorted({int(c.split("_")[0]) for c in encoded.columns})
+    if columns is not None:
+        positions = range(len(columns))
+    sheet = pd.DataFrame(index=encoded.index)
+    for i in positions:
+        native = "{}_native".format(i)
+        if native in encoded.columns:
+            values = encoded[native]
+            if str(values.dtype) == "Int64" and values.notnull().all():
+                values = values.astype("int64")
+            sheet[i] = values
+            continue
+        values = np.full(len(encoded), np.nan, dtype=object)
+        for t in CELL_TYPES:
+            c = "{}_{}".format(i, t)
+            if c in encoded.columns:
+                mask = encoded[c].notnull().to_numpy()
+                if t == "date":
+                    values[mask] = encoded.loc[mask, c].dt.to_pydatetime()
+                else:
+                    values[mask] = encoded.loc[mask, c].astype(object).to_numpy()
+        sheet[i] = pd.Series(values, index=encoded.index, dtype=object)
+    if columns is not None:
+        sheet.columns = columns
+        return sheet
+    sheet = sheet.dropna(axis=1, how='all')
+    sheet.columns = range(sheet.shape[1])
+    return sheet
+
+
+def summary_cache_fn(cache_fn):
+    """the cache filename of a report's asset allocation"""
+    return cache_fn[:-len(".parquet")] + "_summary.parquet"
+
+
+def write_parquet(df, fn):
+    """write a DataFrame to parquet through a temp file, so an interrupted run doesn't leave a partial file"""
+    Path(fn).parent.mkdir(parents=True, exist_ok=True)
+    tmp_fn = "{}.{}.tmp".format(fn, os.getpid())
+    df.to_parquet(tmp_fn, index=False)
+    os.replace(tmp_fn, fn)
+
+
+def write_report_cache(cache_fn, sheets, asset_alloc):
+    """write a parsed report to the cache: all trimmed sheets stacked in a single parquet file,
+    and the asset allocation (if any) in a separate one
+
+    :param cache_fn: cache filename
+    :param sheets: dict of {sheet_name: trimmed sheet}
+    :param asset_alloc: asset allocation DataFrame
+    :return:
+    """
+    stacked = []
+    for sheet_name, sheet in sheets.items():
+        if sheet.empty:
+            # keep the sheet name, with an empty row
+            encoded = pd.DataFrame(index=range(1))
+        else:
+            # non-text headers are ignored by set_sheet_header, don't keep them
+            sheet = sheet.copy()
+            sheet.iloc[0] = sheet.iloc[0].where(sheet.iloc[0].map(lambda h: isinstance(h, str)))
+            encoded = encode_cells(sheet)
+            # keep row numbers, as read from the report
+            encoded.insert(0, "row", pd.array(sheet.index, dtype="Int64"))
+        encoded.insert(0, "sheet_name", sheet_name)
+        stacked.append(encoded)
+    if not asset_alloc.empty:
+        write_parquet(encode_cells(asset_alloc[["asset", "sum", "pct"]]), summary_cache_fn(cache_fn))
+    elif asset_alloc.attrs.get("error"):
+        # keep the error, reported again on cache hits
+        write_parquet(pd.DataFrame({"error": [asset_alloc.attrs["error"]]}), summary_cache_fn(cache_fn))
+    # the sheets file is written last - its existence marks a complete cache entry
+    write_parquet(pd.concat(stacked, axis=0, ignore_index=True), cache_fn)
+
+
+def read_report_cache(cache_fn):
+    """read a parsed report from the cache
+
+    :param cache_fn: cache filename
+    :return: 2 objects: dict of {sheet_name: trimmed sheet}, asset allocation DataFrame (could be empty)
+    """
+    stacked = pd.read_parquet(cache_fn)
+    sheets = {}
+    for sheet_name, encoded in stacked.groupby("sheet_name", sort=False):
+        sheet = decode_cells(encoded.drop(["sheet_name", "row"], axis=1).dropna(axis=1, how='all'))
+        if not sheet.empty:
+            sheet.index = encoded["row"].astype("int64").to_numpy()
+        sheets[sheet_name] = sheet
+    asset_alloc = pd.DataFrame()
+    if isfile(summary_cache_fn(cache_fn)):
+        summary = pd.read_parquet(summary_cache_fn(cache_fn))
+        if "error" in summary.columns:
+            asset_alloc.attrs["error"] = summary["error"].iloc[0]
+        else:
+            asset_alloc = decode_cells(summary, columns=["asset", "sum", "pct"])
+    return sheets, asset_alloc
+
+
+def parse_report_cached(fn, cache_dir):
+    """parse_report, using the parsed reports cache - only new or changed reports are parsed
+
+    :param fn: report filename
+    :param cache_dir: parsed reports cache directory
+    :return: 2 objects: dict of {sheet_name: trimmed sheet}, asset allocation DataFrame (could be empty)
+    """
+    cache_fn = report_cache_fn(fn, cache_dir)
+    if isfile(cache_fn):
+        return read_report_cache(cache_fn)
+    sheets, asset_alloc = parse_report(fn)
+    write_report_cache(cache_fn, sheets, asset_alloc)
+    return sheets, asset_alloc
+
+
+def process_report_safe(fn, cache_dir=None):
+    """process_report wrapper that returns errors instead of raising them, used by worker processes
+
+    :param fn: report filename
+    :param cache_dir: parsed reports cache directory, optional
+    :return: 3 objects: filename, processed report (None on failure), error (None on success)
+    """
+    try:
+        return fn, process_report(fn, cache_dir), None
+    except Exception as err:
+        return fn, None, "{}: {}".format(type(err).__name__, err)
+
+
+def process_reports(reports_fn_list, max_workers=1, failures=None, cache_dir=None):
+    """parse reports, serially or in parallel over a pool of worker processes.
+    Reports are yielded in the order of reports_fn_list, reports that could not be processed are skipped
+
+    :param reports_fn_list: a list of report filenames
+    :param max_workers: number of worker processes, default=1 (serial, in the current process)
+    :param failures: a list to which (filename, error) of failed reports is appended, optional
+    :param cache_dir: parsed reports cache directory, optional - only new or changed reports are parsed
+    :return: a generator of (filename, processed report) tuples
+    """
+    if failures is None:
+        failures = []
+    n_failed = 0
+    list_len = len(reports_fn_list)
+    executor = ProcessPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+    try:
+        if executor:
+            # map keeps the order of reports_fn_list
+            results = executor.map(process_report_safe, reports_fn_list, repeat(cache_dir),
+                                    chunksize=max(1, list_len // (max_workers * 8)))
+        else:
+            results = map(process_report_safe, reports_fn_list, repeat(cache_dir))
+        for rep_num, (fn, processed, error) in enumerate(results, start=1):
+            print("Processing report {} out of {}".format(rep_num, list_len), end="\r")
+            if error:
+                failures.append((fn, error))
+                n_failed += 1
+                continue
+            yield fn, processed
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+    if n_failed:
+        print("\nNumber of reports that could not be processed: {}".format(n_failed))
+
+
+def count_sheet_names(sheet_names, report_sheet_names):
+    """add a report's sheet names to the sheet names count
+
+    :param sheet_names: dict of {sheet_name: count}, updated in place
+    :param report_sheet_names: a list of (fixed) sheet names of a report
+    :return: updated sheet_names
+    """
+    for k in report_sheet_names:
+        if k in sheet_names:
+            sheet_names[k] += 1
+        else:
+            sheet_names[k] = 1
+    return sheet_names
+
+
+def count_column_names(column_names, report_column_names):
+    """add a report's column names to the column names' count per sheet
+
+    :param column_names: dict of {sheet_name: {column_name: count}}, updated in place
+    :param report_column_names: dict of {sheet_name: [column names]} of a report
+    :return: updated column_names
+    """
+    for sheet_name, cols in report_column_names.items():
+        if sheet_name not in column_names:
+            column_names[sheet_name] = {}
+        for c in cols:
+            if c in column_names[sheet_name]:
+                column_names[sheet_name][c] += 1
+            else:
+                column_names[sheet_name][c] = 1
+    return column_names
+
+
+def column_names_matrix(column_names):
+    """column names' count per sheet as DataFrame
+
+    :param column_names: dict of {sheet_name: {column_name: count}}
+    :return: a DataFrame of column names' count per sheet
+    """
+    cols_matrix = pd.DataFrame(column_names)
+    return cols_matrix[cols_matrix.index.notnull()]
+
+
+def pre_process_reports(reports_fn_list, max_workers=1, return_failures=False, cache_dir=None):
     """
 
     :param reports_fn_list: a list of report filenames to be processed
+    :param max_workers: number of worker processes, default=1 (serial)
+    :param return_failures: if True, return the list of (filename, error) of failed reports as well
+    :param cache_dir: parsed reports cache directory, optional - only new or changed reports are parsed
     :return: a DataFrame of column names' count per sheet, used to verify column name standardization
     """
-
     # 1. count sheet names across files, fix them
-    sheet_names = {}
-    for fn in reports_fn_list:
-        print("Processing report: {}".format(fn), end="\r")
-        try:
-            report = pd.read_excel(fn, sheet_name=None, header=None)
-            for k in report.keys():
-                k = fix_sheet_name(k)  # following analysis of raw results
-                if k in sheet_names:
-                    sheet_names[k] += 1
-                else:
-                    sheet_names[k] = 1
-        except:
-            print("Something went wrong with report: {}".format(fn))
-            reports_fn_list = [r for r in reports_fn_list if r != fn]
-    print(sheet_names)
     # 2. count column names per sheet name
+    sheet_names = {}
     column_names = {}
-    for fn in reports_fn_list:
-        report = pd.read_excel(fn, sheet_name=None, header=None)
-        for sheet_name in ignore_sheets(report):
-            fixed_sheet_name = fix_sheet_name(sheet_name)
-            if fixed_sheet_name not in column_names:
-                column_names[fixed_sheet_name] = {}
-            sheet = clean_sheet(report[sheet_name])
-            if not sheet.empty:
-                for c in sheet.columns:
-                    c = fix_col_name(c)  # following analysis of raw results
-                    if c in column_names[fixed_sheet_name]:
-                        column_names[fixed_sheet_name][c] += 1
-                    else:
-                        column_names[fixed_sheet_name][c] = 1
-                if (sheet_name == 'מניות') & ('מספר מנפיק' not in sheet.columns):
-                    print(fn)
-                    print(sheet_name)
-                    print("missing שם המנפיק/שם נייר ערך in file: {}, sheet: {}".format(fn, sheet_name))
-    cols_matrix = pd.DataFrame(column_names)
-    return cols_matrix[cols_matrix.index.notnull()]
+    failures = []
+    for fn, processed in process_reports(reports_fn_list, max_workers, failures, cache_dir):
+        count_sheet_names(sheet_names, processed["sheet_names"])
+        count_column_names(column_names, processed["column_names"])
+    print(sheet_names)
+    cols_matrix = column_names_matrix(column_names)
+    if return_failures:
+        return cols_matrix, failures
+    return cols_matrix
 
 
 def get_asset_allocation_from_summary_sheet(summary_sheet):
@@ -396,30 +1071,14 @@ def get_asset_allocation_from_summary_sheet(summary_sheet):
     return asset_alloc
 
 
-def process_summary_sheets(reports_fn_list):
-    """process all summary sheets from a reports filename list
+def concat_summary_sheets(all_summary_sheets_list):
+    """concat asset allocations from summary sheets, adding numeric sum and pct
 
-    :param reports_fn_list: a list of report filenames
+    :param all_summary_sheets_list: a list of asset allocation DataFrames
     :return: DataFrame of all summary sheets
     """
-    all_summary_sheets_list = []
-    list_len = len(reports_fn_list)
-    rep_num = 1
-    for fn in reports_fn_list:
-        print("Processing report {} out of {}".format(rep_num, list_len), end="\r")
-        try:
-            sheet = pd.read_excel(fn, sheet_name="סכום נכסים", header=None)
-            asset_alloc = get_asset_allocation_from_summary_sheet(sheet)
-            if not asset_alloc.empty:
-                # add report_id
-                report_id = Path(fn).stem
-                asset_alloc["report_id"] = report_id
-                rep_num += 1
-                all_summary_sheets_list.append(asset_alloc)
-        except:
-            print("Something went wrong with report: {}".format(fn))
-            reports_fn_list = [r for r in reports_fn_list if r != fn]
-    # moving concat out of the loop - better performance
+    if not all_summary_sheets_list:
+        return pd.DataFrame()
     all_summary_sheets = pd.concat(all_summary_sheets_list, axis=0, ignore_index=True)
     all_summary_sheets = all_summary_sheets[all_summary_sheets["asset"].notnull()]
     all_summary_sheets["pct_num"] = all_summary_sheets["pct"].astype(str).str.replace(r'[\%\s-]', '')
@@ -428,6 +1087,30 @@ def process_summary_sheets(reports_fn_list):
     return all_summary_sheets
 
 
+def process_summary_sheets(reports_fn_list, max_workers=1, return_failures=False, cache_dir=None):
+    """process all summary sheets from a reports filename list
+
+    :param reports_fn_list: a list of report filenames
+    :param max_workers: number of worker processes, default=1 (serial)
+    :param return_failures: if True, return the list of (filename, error) of failed reports as well,
+    including reports the asset allocation could not be extracted from
+    :param cache_dir: parsed reports cache directory, optional - only new or changed reports are parsed
+    :return: DataFrame of all summary sheets
+    """
+    all_summary_sheets_list = []
+    failures = []
+    for fn, processed in process_reports(reports_fn_list, max_workers, failures, cache_dir):
+        if processed["asset_alloc_error"]:
+            failures.append((fn, processed["asset_alloc_error"]))
+        if not processed["asset_alloc"].empty:
+            all_summary_sheets_list.append(processed["asset_alloc"])
+    # moving concat out of the loop - better performance
+    all_summary_sheets = concat_summary_sheets(all_summary_sheets_list)
+    if return_failures:
+        return all_summary_sheets, failures
+    return all_summary_sheets
+
+
 def get_totals(summary_sheets):
     """Get totals from summary sheets
 
@@ -439,39 +1122,73 @@ def get_totals(summary_sheets):
     return totals
 
 
-def extract_holdings(reports_fn_list):
+def concat_holdings(all_holdings_list):
+    """concat holdings sheets into one DataFrame
+
+    :param all_holdings_list: a list of holdings sheets
+    :return: DataFrame: unified holdings
+    """
+    if not all_holdings_list:
+        return pd.DataFrame()
+    all_holdings = pd.concat(all_holdings_list, axis=0, ignore_index=True)
+    all_holdings["report_id"] = all_holdings["report_id"].astype(str)
+    return all_holdings
+
+
+def extract_holdings(reports_fn_list, max_workers=1, return_failures=False, cache_dir=None):
     """extract holdings from reports
 
     :param reports_fn_list: list of reports filenames
+    :param max_workers: number of worker processes, default=1 (serial)
+    :param return_failures: if True, return the list of (filename, error) of failed reports as well
+    :param cache_dir: parsed reports cache directory, optional - only new or changed reports are parsed
     :return: DataFrame: unified holdings from all reports
     """
     all_holdings_list = []
-    list_len = len(reports_fn_list)
-    rep_num = 1
-    for fn in reports_fn_list:
-        print("Processing report {} out of {}".format(rep_num, list_len), end="\r")
-        try:
-            report = pd.read_excel(fn, sheet_name=None, header=None)
-            # add report_id
-            report_id = Path(fn).stem
-            for sheet_name in ignore_sheets(report):
-                fixed_sheet_name = fix_sheet_name(sheet_name)
-                sheet = clean_sheet(report[sheet_name])
-                if not sheet.empty:
-                    sheet_df = sheet
-                    sheet_df["report_id"] = report_id
-                    # add holding_type column
-                    sheet_df["holding_type"] = fixed_sheet_name
-                    all_holdings_list.append(sheet_df)
-            rep_num += 1
-        except:
-            print("Something went wrong with report: {}".format(fn))
-            reports_fn_list = [r for r in reports_fn_list if r != fn]
-    all_holdings = pd.concat(all_holdings_list, axis=0, ignore_index=True)
-    all_holdings["report_id"] = all_holdings["report_id"].astype(str)
+    failures = []
+    for fn, processed in process_reports(reports_fn_list, max_workers, failures, cache_dir):
+        all_holdings_list += processed["holdings"]
+    all_holdings = concat_holdings(all_holdings_list)
+    if return_failures:
+        return all_holdings, failures
     return all_holdings
 
 
+def ingest_reports(reports_fn_list, max_workers=1, cache_dir=None):
+    """process reports in a single pass - each report is parsed once, producing everything
+    pre_process_reports, process_summary_sheets and extract_holdings produce separately
+
+    :param reports_fn_list: list of reports filenames
+    :param max_workers: number of worker processes, default=1 (serial)
+    :param cache_dir: parsed reports cache directory, optional - only new or changed reports are parsed
+    :return: 5 objects: sheet names count (dict), column names' count per sheet (DataFrame),
+             all summary sheets (DataFrame), all holdings (DataFrame),
+             a list of (filename, error) of reports that could not be processed, or whose asset allocation
+             could not be extracted (their holdings are extracted)
+    """
+    sheet_names = {}
+    column_names = {}
+    all_summary_sheets_list = []
+    all_holdings_list = []
+    failures = []
+    for fn, processed in process_reports(reports_fn_list, max_workers, failures, cache_dir):
+        count_sheet_names(sheet_names, processed["sheet_names"])
+        count_column_names(column_names, processed["column_names"])
+        if processed["asset_alloc_error"]:
+            failures.append((fn, processed["asset_alloc_error"]))
+        if not processed["asset_alloc"].empty:
+            all_summary_sheets_list.append(processed["asset_alloc"])
+        all_holdings_list += processed["holdings"]
+    print(sheet_names)
+    return (
+        sheet_names,
+        column_names_matrix(column_names),
+        concat_summary_sheets(all_summary_sheets_list),
+        concat_holdings(all_holdings_list),
+        failures
+    )
+
+
 def no_holding_num_types():
     """holding types without expected holding number
 
@@ -714,3 +1431,172 @@ def concat_from_csv_by_path(all_holdings_path, new_holdings_path):
     all_holdings = pd.read_csv(all_holdings_path, dtype=holdings_dtypes())
     new_holdings = pd.read_csv(new_holdings_path, dtype=holdings_dtypes())
     return pd.concat([all_holdings, new_holdings])
+
+
+def holdings_partition_cols():
+    """Return the columns the holdings dataset is partitioned by
+
+    :return: list of partition columns
+    """
+    return ['ReportPeriodDesc', 'SystemName']
+
+
+def holdings_categorical_cols():
+    """Return low cardinality text columns of holdings, stored dictionary encoded (as pandas category)
+
+    :return: list of categorical columns
+    """
+    return [
+        'holding_type', 'report_id', 'ParentCorpName', 'ParentCorpLegalId', 'ProductNum', 'Name', 'ShortName',
+        'StatusDate', 'סוג מטבע', 'זירת מסחר', 'דירוג', 'שם מדרג', 'ספק מידע', 'ענף מסחר', 'אופי הנכס',
+        'קונסורציום כן/לא'
+    ]
+
+
+def holdings_numeric_cols():
+    """Return numeric holdings columns, stored as float - all other columns that are not categorical are stored
+    as text
+
+    :return: list of numeric columns
+    """
+    return [
+        'שווי', 'שווי פוסילי', 'is_fossil', 'ערך נקוב', 'שער', 'שעור מנכסי אפיק ההשקעה', 'שעור מסך נכסי השקעה',
+        'שעור מערך נקוב מונפק', 'תשואה לפדיון', 'מח"מ', 'פדיון/ריבית/דיבידנד לקבל', 'שעור תשואה במהלך התקופה',
+        'ריבית אפקטיבית'
+    ]
+
+
+def holdings_schema(columns):
+    """the parquet schema of holdings columns - types are set by column name, so every write to the dataset
+    (chunks of a conversion, appended quarters) has the same type per column, whatever the values of a chunk
+
+    :param columns: holdings columns
+    :return: pyarrow schema
+    """
+    import pyarrow as pa
+    fields = []
+    for col in columns:
+        if col in holdings_categorical_cols():
+            fields.append(pa.field(col, pa.dictionary(pa.int32(), pa.string())))
+        elif col in holdings_numeric_cols():
+            fields.append(pa.field(col, pa.float64()))
+        else:
+            fields.append(pa.field(col, pa.string()))
+    return pa.schema(fields)
+
+
+def prepare_holdings_for_parquet(holdings):
+    """set holdings column types for parquet (see holdings_schema): numeric columns as float,
+    low cardinality text columns as category, all other columns as text
+
+    :param holdings: holdings DataFrame
+    :return: holdings DataFrame, ready to be written to parquet
+    """
+    holdings = holdings.copy()
+    holdings.columns = holdings.columns.map(str)
+    for col in holdings.columns:
+        if isinstance(holdings[col].dtype, pd.CategoricalDtype):
+            # e.g. holdings read from the dataset, categories can't be mapped with na_action
+            holdings[col] = holdings[col].astype(object)
+        if col in holdings_categorical_cols():
+            holdings[col] = holdings[col].map(str, na_action='ignore').astype('category')
+        elif col in holdings_numeric_cols():
+            numeric = pd.to_numeric(holdings[col], errors='coerce')
+            not_numeric = numeric.isnull() & holdings[col].notnull()
+            if not_numeric.any():
+                print("{} non numeric values in {} are stored as null, e.g. {}".format(
+                    not_numeric.sum(), col, holdings.loc[not_numeric, col].iloc[0]))
+            holdings[col] = numeric.astype(float)
+        else:
+            holdings[col] = holdings[col].map(str, na_action='ignore').astype(object)
+    return holdings
+
+
+def write_holdings_dataset(holdings, dataset_path=None, replace_partitions=True):
+    """write holdings to the parquet dataset, one partition per ReportPeriodDesc and SystemName.
+    Only the partitions in holdings are written, all others are kept as is -
+    so appending a quarter doesn't rewrite the whole dataset
+
+    :param holdings: holdings DataFrame, with ReportPeriodDesc and SystemName
+    :param dataset_path: dataset path, default is fetch_all_holdings_dataset_path()
+    :param replace_partitions: if True (default), existing partitions with the same values are replaced,
+                               otherwise holdings are added to them
+    :return:
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    if dataset_path is None:
+        dataset_path = fetch_all_holdings_dataset_path()
+    holdings = prepare_holdings_for_parquet(holdings)
+    table = pa.Table.from_pandas(holdings, schema=holdings_schema(holdings.columns), preserve_index=False)
+    pq.write_to_dataset(
+        table,
+        root_path=dataset_path,
+        partition_cols=holdings_partition_cols(),
+        existing_data_behavior='delete_matching' if replace_partitions else 'overwrite_or_ignore'
+    )
+    print("Wrote {} holdings to {}, partitions: {}".format(
+        len(holdings), dataset_path, holdings.groupby(holdings_partition_cols(), dropna=False).ngroups
+    ))
+
+
+def read_holdings_dataset(dataset_path=None, columns=None, periods=None, systems=None):
+    """read holdings from the parquet dataset, only the partitions and columns needed
+
+    :param dataset_path: dataset path, default is fetch_all_holdings_dataset_path()
+    :param columns: list of columns to read, default is all columns
+    :param periods: list of ReportPeriodDesc to read, e.g. ['2024 רבעון 3'], default is all periods
+    :param systems: list of SystemName to read, e.g. ['גמל', 'פנסיה'], default is all systems
+    :return: holdings DataFrame, columns not in the dataset are skipped
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    if dataset_path is None:
+        dataset_path = fetch_all_holdings_dataset_path()
+    partitioning = ds.partitioning(holdings_schema(holdings_partition_cols()), flavor="hive")
+    dataset = ds.dataset(dataset_path, format="parquet", partitioning=partitioning)
+    # files written at different times may have different columns (with the same types, see holdings_schema),
+    # read them all with the union of their columns
+    schema = pa.unify_schemas([fragment.physical_schema for fragment in dataset.get_fragments()] +
+                              [partitioning.schema])
+    dataset = ds.dataset(dataset_path, format="parquet", partitioning=partitioning, schema=schema)
+    expression = None
+    if periods is not None:
+        expression = ds.field('ReportPeriodDesc').isin(list(periods))
+    if systems is not None:
+        systems_expression = ds.field('SystemName').isin(list(systems))
+        expression = systems_expression if expression is None else expression & systems_expression
+    if columns is not None:
+        columns = [c for c in columns if c in schema.names]
+    return dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+
+def append_csv_to_holdings_dataset(new_holdings_path, dataset_path=None):
+    """append holdings from a CSV file (e.g. a new quarter) to the parquet dataset
+
+    :param new_holdings_path: new holdings path, CSV
+    :param dataset_path: dataset path, default is fetch_all_holdings_dataset_path()
+    :return:
+    """
+    new_holdings = pd.read_csv(new_holdings_path, dtype=holdings_dtypes())
+    write_holdings_dataset(new_holdings, dataset_path)
+
+
+def convert_all_holdings_csv_to_dataset(all_holdings_path=None, dataset_path=None, chunksize=1000000):
+    """one time conversion of all_holdings.csv to the parquet dataset, reading the CSV in chunks
+
+    :param all_holdings_path: all holdings path, CSV, default is fetch_all_holdings_path()
+    :param dataset_path: dataset path (should not exist yet), default is fetch_all_holdings_dataset_path()
+    :param chunksize: number of CSV rows per chunk
+    :return:
+    """
+    if all_holdings_path is None:
+        all_holdings_path = fetch_all_holdings_path()
+    if dataset_path is None:
+        dataset_path = fetch_all_holdings_dataset_path()
+    if Path(dataset_path).exists():
+        print("ERROR: {} already exists, remove it before converting".format(dataset_path))
+        return
+    for chunk in pd.read_csv(all_holdings_path, dtype=holdings_dtypes(), chunksize=chunksize):
+        # chunks may share partitions, add to them instead of replacing
+        write_holdings_dataset(chunk, dataset_path, replace_partitions=False)